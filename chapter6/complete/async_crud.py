@@ -0,0 +1,95 @@
+"""SQLAlchemy Query Functions for the asyncio database layer
+
+These match the functions in crud.py, but take an AsyncSession, and run the
+same statements, built by crud.py. Lazy loading isn't available with
+asyncio, so every relationship in the response models is loaded up front."""
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date
+
+import changes
+import search
+import table_versions
+from crud import (
+    counts_query,
+    league_query,
+    leagues_query,
+    performances_export_query,
+    performances_query,
+    player_query,
+    players_query,
+    season_scores_query,
+    table_rows_query,
+    team_week_scores_query,
+    teams_query,
+    weekly_leaderboard_query,
+)
+
+
+async def get_player(db: AsyncSession, player_id: int):
+    return (await db.scalars(player_query(player_id))).unique().first()
+
+async def get_players(db: AsyncSession, skip: int = 0, limit: int = 100, min_last_changed_date: date = None, last_name : str = None, first_name : str = None, cursor: dict = None, player_ids: list = None, fields: tuple = None):
+    return (await db.scalars(players_query(
+        skip, limit, min_last_changed_date, last_name, first_name, cursor, player_ids, fields))).all()
+
+async def search_players(db: AsyncSession, query: str, match: str = "prefix", limit: int = 10):
+    candidates = search.candidates_query(query, match)
+    if candidates is None:
+        return []
+    return search.rank(await db.scalars(candidates), query, match, limit)
+
+async def get_performances(db: AsyncSession, skip: int = 0, limit: int = 100, min_last_changed_date: date = None, cursor: dict = None, fields: tuple = None, season: int = None, week_from: int = None, week_to: int = None):
+    return (await db.scalars(performances_query(
+        skip, limit, min_last_changed_date, cursor, fields, season, week_from, week_to))).all()
+
+async def stream_performances(db: AsyncSession, min_last_changed_date: date = None, batch_size: int = 1000):
+    """Yields batches of performance rows from a server-side cursor"""
+    result = await db.stream(
+        performances_export_query(min_last_changed_date),
+        execution_options={"yield_per": batch_size},
+    )
+    async for batch in result.mappings().partitions():
+        yield batch
+
+async def get_league(db: AsyncSession, league_id: int = None):
+    return (await db.scalars(league_query(league_id))).unique().first()
+
+async def get_leagues(db: AsyncSession, skip: int = 0, limit: int = 100, min_last_changed_date: date = None,league_name: str = None, cursor: dict = None, fields: tuple = None):
+    return (await db.scalars(leagues_query(skip, limit, min_last_changed_date, league_name, cursor, fields))).unique().all()
+
+async def get_teams(db: AsyncSession, skip: int = 0, limit: int = 100, min_last_changed_date: date = None, team_name: str = None, league_id: int = None, cursor: dict = None, fields: tuple = None):
+    return (await db.scalars(teams_query(skip, limit, min_last_changed_date, team_name, league_id, cursor, fields))).all()
+
+async def get_table_rows(db: AsyncSession, model):
+    """Returns every row of a model's table as tuples in column order"""
+    return [tuple(row) for row in await db.execute(table_rows_query(model))]
+
+#scoring queries
+async def get_season_scores(db: AsyncSession, skip: int = 0, limit: int = 100, season: int = None, player_id: int = None, position: str = None, min_games_played: int = None, sort_by: str = "total_points", descending: bool = True):
+    return (await db.scalars(season_scores_query(
+        skip, limit, season, player_id, position, min_games_played, sort_by, descending))).all()
+
+async def get_weekly_leaderboard(db: AsyncSession, season: int, week: int, position: str = None, limit: int = 10):
+    return (await db.scalars(weekly_leaderboard_query(season, week, position, limit))).all()
+
+async def get_team_week_scores(db: AsyncSession, skip: int = 0, limit: int = 100, league_id: int = None, team_id: int = None, season: int = None, week: int = None):
+    return (await db.scalars(team_week_scores_query(skip, limit, league_id, team_id, season, week))).all()
+
+#delta-sync queries
+async def get_changes(db: AsyncSession, since: int = 0, limit: int = 500):
+    latest = (await db.scalars(changes.latest_changes_query(since, limit))).all()
+    rows = {}
+    for table_name, keys in changes.keys_to_load(latest).items():
+        for row in await db.scalars(changes.rows_query(table_name, keys)):
+            rows[table_name, changes.row_key(table_name, row)] = row
+    return changes.entries(latest, rows)
+
+#analytics queries
+async def get_counts(db: AsyncSession):
+    """Counts leagues, teams, and players in a single statement"""
+    return (await db.execute(counts_query())).one()._asdict()
+
+async def get_table_version(db: AsyncSession, tables: tuple):
+    """Returns (version, changed_at) for the tables, or None if they have no versions"""
+    version, changed_at = (await db.execute(table_versions.table_version_query(tables))).one()
+    return None if version is None else (version, changed_at)
@@ -0,0 +1,111 @@
+"""Load test - sync database layer compared with the asyncio database layer
+
+Starts the API with uvicorn once with SWC_ASYNC_DB=false and once with
+SWC_ASYNC_DB=true, then sends requests from a growing number of concurrent
+clients. Prints requests per second and p99 latency for each run.
+
+Typical usage example (from the chapter6/complete directory):
+
+    python benchmarks/bench_async.py --requests 5000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# A mix of the read endpoints, cycled through by each client
+PATHS = [
+    "/v0/players/?limit=20",
+    "/v0/performances/?limit=100",
+    "/v0/teams/?limit=10",
+    "/v0/leagues/",
+    "/v0/players/101",
+    "/v0/counts/",
+]
+
+
+def start_server(port: int, use_async: bool) -> subprocess.Popen:
+    """Starts uvicorn in a child process and waits until it answers"""
+    env = dict(os.environ, SWC_ASYNC_DB="true" if use_async else "false")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=APP_DIR,
+        env=env,
+    )
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/")
+            return server
+        except httpx.TransportError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("The API didn't start")
+
+
+async def run_load(base_url: str, concurrency: int, total_requests: int) -> dict:
+    """Sends total_requests requests from concurrency clients at once"""
+    latencies = []
+    errors = 0
+    remaining = iter(range(total_requests))
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+
+        async def worker():
+            nonlocal errors
+            for request_number in remaining:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(PATHS[request_number % len(PATHS)])
+                    response.raise_for_status()
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests_per_second": len(latencies) / elapsed,
+        "p99_ms": statistics.quantiles(latencies, n=100)[98] * 1000,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    print(f"{'layer':>6} {'clients':>8} {'req/s':>10} {'p99 ms':>10} {'errors':>7}")
+    for use_async in (False, True):
+        server = start_server(args.port, use_async)
+        try:
+            for concurrency in args.concurrency:
+                result = asyncio.run(
+                    run_load(f"http://127.0.0.1:{args.port}", concurrency, args.requests)
+                )
+                print(
+                    f"{'async' if use_async else 'sync':>6} {concurrency:>8} "
+                    f"{result['requests_per_second']:>10.1f} {result['p99_ms']:>10.1f} "
+                    f"{result['errors']:>7}"
+                )
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Microbenchmark - per-call overhead of each crud.py function
+
+Calls each read function in crud.py with the small pages the API serves most,
+each call in its own session the way a request gets one, and splits the time
+per call into the time SQLite spent running the statements and everything
+else: building the statement, compiling it or finding it in the compiled
+cache, and turning the rows into ORM objects. At small page sizes the second
+part is most of the p50 latency.
+
+Typical usage example (from the chapter6/complete directory):
+
+    python benchmarks/bench_crud.py --number 500
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import crud
+import models
+from database import RequestStats, SessionLocal, request_stats
+
+# (crud function, description of the call, keyword arguments)
+CASES = [
+    (crud.get_player, "player_id", {"player_id": 102}),
+    (crud.get_players, "limit=1", {"limit": 1}),
+    (crud.get_players, "limit=10", {"limit": 10}),
+    (crud.get_players, "name", {"first_name": "Bryce", "last_name": "Young"}),
+    (crud.get_players, "ids", {"player_ids": [102, 109, 650], "limit": 3}),
+    (crud.get_players, "cursor", {"cursor": {"id": 300}, "limit": 10}),
+    (crud.get_performances, "limit=10", {"limit": 10}),
+    (crud.get_performances, "fields", {"limit": 10, "fields": ("performance_id", "fantasy_points")}),
+    (crud.get_league, "league_id", {"league_id": 5001}),
+    (crud.get_leagues, "limit=10", {"limit": 10}),
+    (crud.get_teams, "league_id", {"league_id": 5001}),
+    (crud.get_teams, "limit=1", {"limit": 1}),
+    (crud.get_counts, "", {}),
+    (crud.get_last_changed_date, "players", {"tables": (models.Player, models.Performance)}),
+    (crud.get_table_version, "players", {"tables": (models.Player, models.Performance)}),
+    (crud.get_season_scores, "limit=10", {"season": 2023, "limit": 10}),
+    (crud.get_weekly_leaderboard, "limit=10", {"season": 2023, "week": 1, "limit": 10}),
+    (crud.get_team_week_scores, "league week", {"league_id": 5001, "season": 2023, "week": 1}),
+    (crud.search_players, "prefix", {"query": "bry"}),
+    (crud.get_changes, "limit=10", {"since": 1000, "limit": 10}),
+]
+
+
+def time_call(crud_function, kwargs: dict, number: int, repeat: int) -> tuple:
+    """Returns the best microseconds per call, and the SQL microseconds of that run"""
+    best = None
+    for _ in range(repeat):
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        try:
+            def call():
+                with SessionLocal() as db:
+                    crud_function(db, **kwargs)
+
+            elapsed = timeit.timeit(call, number=number)
+        finally:
+            request_stats.reset(token)
+        if best is None or elapsed < best[0]:
+            best = (elapsed, stats.statement_time)
+    elapsed, statement_time = best
+    return elapsed / number * 1e6, statement_time / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=200, help="calls per timing run")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--function", action="append", help="only run these crud functions")
+    args = parser.parse_args()
+
+    print(f"{'function':>24} {'call':>12} {'us/call':>9} {'sql us':>8} {'python us':>10}")
+    for crud_function, description, kwargs in CASES:
+        if args.function and crud_function.__name__ not in args.function:
+            continue
+        total, statement_time = time_call(crud_function, kwargs, args.number, args.repeat)
+        print(
+            f"{crud_function.__name__:>24} {description:>12} {total:>9.1f} "
+            f"{statement_time:>8.1f} {total - statement_time:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
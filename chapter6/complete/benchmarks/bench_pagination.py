@@ -0,0 +1,100 @@
+"""Benchmark - skip/limit pagination compared with cursor pagination
+
+Builds a temporary SQLite database with a large performance table and times
+one page of crud.get_performances at increasing depths. The OFFSET time grows
+with the depth of the page, while the cursor time stays flat.
+
+Typical usage example (from the chapter6/complete directory):
+
+    python benchmarks/bench_pagination.py --rows 500000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import models
+from database import Base
+
+
+def build_database(path: str, rows: int):
+    """Creates the tables and fills the performance table with rows"""
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    start_date = date(2024, 3, 1)
+    with engine.begin() as connection:
+        connection.execute(
+            insert(models.Player),
+            [
+                {
+                    "player_id": player_id,
+                    "gsis_id": f"00-{player_id:07d}",
+                    "first_name": "First",
+                    "last_name": f"Last{player_id}",
+                    "position": "QB",
+                    "last_changed_date": start_date,
+                }
+                for player_id in range(1, 1001)
+            ],
+        )
+        connection.execute(
+            insert(models.Performance),
+            [
+                {
+                    "performance_id": performance_id,
+                    "week_number": f"2023_{performance_id % 17 + 1}",
+                    "fantasy_points": performance_id % 40,
+                    "player_id": performance_id % 1000 + 1,
+                    "last_changed_date": start_date
+                    + timedelta(days=performance_id % 90),
+                }
+                for performance_id in range(1, rows + 1)
+            ],
+        )
+    return engine
+
+
+def time_page(session_factory, repeat: int, **kwargs) -> float:
+    """Returns the best time in milliseconds to fetch one page"""
+    def fetch():
+        with session_factory() as db:
+            crud.get_performances(db, **kwargs)
+
+    return min(timeit.repeat(fetch, number=1, repeat=repeat)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = build_database(os.path.join(tmp_dir, "bench.db"), args.rows)
+        session_factory = sessionmaker(bind=engine)
+
+        print(f"{'depth':>10} {'skip ms':>10} {'cursor ms':>10}")
+        depth = args.limit
+        while depth < args.rows:
+            skip_ms = time_page(
+                session_factory, args.repeat, skip=depth, limit=args.limit
+            )
+            cursor_ms = time_page(
+                session_factory, args.repeat, limit=args.limit, cursor={"id": depth}
+            )
+            print(f"{depth:>10} {skip_ms:>10.2f} {cursor_ms:>10.2f}")
+            depth *= 4
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
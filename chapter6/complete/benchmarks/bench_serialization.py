@@ -0,0 +1,68 @@
+"""Microbenchmark - per-row cost of encoding list responses
+
+Compares the response_model path FastAPI uses (validate into the pydantic
+schema, serialize it, then json.dumps) with serialization.render_rows, which
+reads the ORM objects directly and encodes them with orjson.
+
+Typical usage example (from the chapter6/complete directory):
+
+    python benchmarks/bench_serialization.py
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+import crud
+import schemas
+import serialization
+from database import SessionLocal
+
+CASES = [
+    ("players", crud.get_players, schemas.Player),
+    ("performances", crud.get_performances, schemas.Performance),
+    ("leagues", crud.get_leagues, schemas.League),
+    ("teams", crud.get_teams, schemas.Team),
+]
+
+
+def response_model_path(rows: list, adapter: TypeAdapter) -> bytes:
+    """What FastAPI does with response_model=list[schema]"""
+    value = adapter.validate_python(rows, from_attributes=True)
+    return JSONResponse(adapter.dump_python(value, mode="json")).body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'list':>13} {'rows':>6} {'before us/row':>14} {'after us/row':>13} {'speedup':>8}")
+    db = SessionLocal()
+    try:
+        for name, crud_function, schema in CASES:
+            rows = crud_function(db, limit=args.limit)
+            adapter = TypeAdapter(list[schema])
+            before = min(timeit.repeat(
+                lambda: response_model_path(rows, adapter), number=1, repeat=args.repeat
+            ))
+            after = min(timeit.repeat(
+                lambda: serialization.render_rows(rows, schema), number=1, repeat=args.repeat
+            ))
+            per_row = 1e6 / max(len(rows), 1)
+            print(
+                f"{name:>13} {len(rows):>6} {before * per_row:>14.2f} "
+                f"{after * per_row:>13.2f} {before / after:>7.1f}x"
+            )
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
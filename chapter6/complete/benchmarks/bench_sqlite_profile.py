@@ -0,0 +1,83 @@
+"""Benchmark - SQLite tuning profiles under concurrent readers
+
+Builds a temporary database with a large performance table, then runs the
+same random read mix from a number of threads against an engine with no
+PRAGMAs, the tuned profile from database.sqlite_pragmas, and the tuned
+profile on a read-only immutable file. Prints reads per second for each.
+
+Typical usage example (from the chapter6/complete directory):
+
+    python benchmarks/bench_sqlite_profile.py --rows 300000 --threads 1 4 16
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import crud
+from bench_pagination import build_database
+from database import set_sqlite_pragmas, sqlite_pragmas, sqlite_url
+
+
+def make_engine(database_file: str, profile: str):
+    read_only = profile == "immutable"
+    engine = create_engine(
+        sqlite_url(database_file=database_file, read_only=read_only),
+        connect_args={"check_same_thread": False},
+    )
+    if profile != "baseline":
+        set_sqlite_pragmas(engine, sqlite_pragmas(read_only=read_only))
+    return engine
+
+
+def run_readers(engine, threads: int, seconds: float, rows: int) -> float:
+    """Runs random page reads from threads for seconds and returns reads per second"""
+    session_factory = sessionmaker(bind=engine)
+    stop_at = time.perf_counter() + seconds
+    counts = [0] * threads
+
+    def reader(number: int):
+        generator = random.Random(number)
+        while time.perf_counter() < stop_at:
+            with session_factory() as db:
+                crud.get_performances(db, limit=100, cursor={"id": generator.randrange(rows)})
+            counts[number] += 1
+
+    workers = [threading.Thread(target=reader, args=(number,)) for number in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sum(counts) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--seconds", type=float, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database_file = os.path.join(tmp_dir, "bench.db")
+        build_database(database_file, args.rows).dispose()
+
+        print(f"{'profile':>10} {'threads':>8} {'reads/s':>10}")
+        for profile in ("baseline", "tuned", "immutable"):
+            engine = make_engine(database_file, profile)
+            for threads in args.threads:
+                reads = run_readers(engine, threads, args.seconds, args.rows)
+                print(f"{profile:>10} {threads:>8} {reads:>10.1f}")
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Load test - throughput as the number of Gunicorn workers grows
+
+Starts the API with gunicorn_conf.py and 1, 2, 4 ... workers, up to the
+number of CPUs, and drives it from several client processes so the load
+generator isn't the bottleneck. Prints requests per second for each worker
+count and the scaling relative to one worker.
+
+Run it on a machine with at least twice as many CPUs as the largest worker
+count, so the clients have CPUs of their own.
+
+Typical usage example (from the chapter6/complete directory):
+
+    python benchmarks/bench_workers.py --requests 20000
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bench_async import run_load
+from gunicorn_conf import available_cpus
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def start_gunicorn(port: int, workers: int) -> subprocess.Popen:
+    """Starts Gunicorn with the production config and waits until it answers"""
+    env = dict(
+        os.environ,
+        WEB_CONCURRENCY=str(workers),
+        SWC_BIND=f"127.0.0.1:{port}",
+        SWC_SQLITE_READ_ONLY="true",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "main:app", "-c", "gunicorn_conf.py", "--access-logfile", "/dev/null", "--log-level", "warning"],
+        cwd=APP_DIR,
+        env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/")
+            return server
+        except httpx.TransportError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("Gunicorn didn't start")
+
+
+def client_process(arguments: tuple) -> dict:
+    base_url, concurrency, requests = arguments
+    return asyncio.run(run_load(base_url, concurrency, requests))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--clients", type=int, default=4, help="client processes")
+    parser.add_argument("--concurrency", type=int, default=64, help="connections per client process")
+    parser.add_argument("--max-workers", type=int, default=available_cpus())
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    worker_counts = []
+    workers = 1
+    while workers <= args.max_workers:
+        worker_counts.append(workers)
+        workers *= 2
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    baseline = None
+    print(f"{'workers':>8} {'req/s':>10} {'scaling':>8} {'errors':>7}")
+    for workers in worker_counts:
+        server = start_gunicorn(args.port, workers)
+        try:
+            per_client = args.requests // args.clients
+            started = time.perf_counter()
+            with multiprocessing.Pool(args.clients) as clients:
+                results = clients.map(
+                    client_process,
+                    [(base_url, args.concurrency, per_client)] * args.clients,
+                )
+            elapsed = time.perf_counter() - started
+        finally:
+            server.terminate()
+            server.wait()
+        errors = sum(result["errors"] for result in results)
+        requests_per_second = (per_client * args.clients - errors) / elapsed
+        baseline = baseline or requests_per_second
+        print(
+            f"{workers:>8} {requests_per_second:>10.1f} "
+            f"{requests_per_second / baseline:>7.2f}x {errors:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
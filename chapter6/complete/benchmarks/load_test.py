@@ -0,0 +1,308 @@
+"""Load test suite for the SWC API
+
+Starts the API with uvicorn, then sends a weighted mix of requests to every
+endpoint in main.py with realistic parameters, from a configurable number of
+concurrent clients. Reports throughput and p50/p95/p99 latency for each
+operation_id and writes them to a JSON file, so results can be compared
+between releases.
+
+Typical usage example (from the chapter6/complete directory):
+
+    python benchmarks/load_test.py --concurrency 50 --duration 30 --output results.json
+
+Use --url to test a server that is already running, and --env NAME=VALUE to
+start the local server with settings such as SWC_SNAPSHOT=true.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+class SampleData:
+    """Ids and names from the database, so requests ask for rows that exist"""
+
+    def __init__(self):
+        from sqlalchemy import func, select
+
+        import crud
+        import models
+        from database import SessionLocal
+
+        with SessionLocal() as db:
+            players = crud.get_players(db, limit=100000)
+            teams = crud.get_teams(db, limit=100000)
+            leagues = crud.get_leagues(db, limit=100000)
+            self.change_token = db.scalar(select(func.max(models.ChangeLog.change_id))) or 0
+            self.last_changed_dates = sorted(
+                {performance.last_changed_date for performance in crud.get_performances(db, limit=100000)}
+            )
+        self.player_ids = [player.player_id for player in players]
+        self.player_names = [(player.first_name, player.last_name) for player in players]
+        self.team_names = [team.team_name for team in teams]
+        self.league_ids = [league.league_id for league in leagues]
+        self.league_names = [league.league_name for league in leagues]
+
+
+def players_request(rng: random.Random, data: SampleData) -> tuple:
+    choice = rng.random()
+    if choice < 0.5:
+        return "/v0/players/", {"skip": rng.randrange(0, len(data.player_ids)), "limit": rng.choice([10, 50, 100])}
+    if choice < 0.7:
+        first_name, last_name = rng.choice(data.player_names)
+        return "/v0/players/", {"first_name": first_name, "last_name": last_name}
+    if choice < 0.8:
+        roster = rng.sample(data.player_ids, rng.choice([8, 15, 100]))
+        return "/v0/players/", {"ids": ",".join(str(player_id) for player_id in roster)}
+    return "/v0/players/", {"minimum_last_changed_date": rng.choice(data.last_changed_dates).isoformat(), "limit": 100}
+
+
+def search_request(rng: random.Random, data: SampleData) -> tuple:
+    first_name, last_name = rng.choice(data.player_names)
+    if rng.random() < 0.7:
+        # Autocomplete sends a request for each letter typed
+        name = f"{first_name} {last_name}"
+        return "/v0/players/search/", {"q": name[:rng.randint(1, len(name))]}
+    typo = rng.randrange(len(last_name))
+    return "/v0/players/search/", {"q": f"{first_name} {last_name[:typo]}{last_name[typo + 1:]}", "match": "fuzzy"}
+
+
+def performances_request(rng: random.Random, data: SampleData) -> tuple:
+    params = {"skip": rng.randrange(0, 1000), "limit": rng.choice([100, 500])}
+    choice = rng.random()
+    if choice < 0.3:
+        params["minimum_last_changed_date"] = rng.choice(data.last_changed_dates).isoformat()
+    elif choice < 0.5:
+        week = rng.choice([1, 2])
+        params.update({"season": 2023, "week_from": week, "week_to": week, "skip": 0})
+    return "/v0/performances/", params
+
+
+def teams_request(rng: random.Random, data: SampleData) -> tuple:
+    choice = rng.random()
+    if choice < 0.5:
+        return "/v0/teams/", {"league_id": rng.choice(data.league_ids)}
+    if choice < 0.7:
+        return "/v0/teams/", {"team_name": rng.choice(data.team_names)}
+    return "/v0/teams/", {"limit": 100}
+
+
+def season_scores_request(rng: random.Random, data: SampleData) -> tuple:
+    params = {"season": 2023, "limit": rng.choice([10, 25, 100])}
+    if rng.random() < 0.5:
+        params["position"] = rng.choice(["QB", "RB", "WR", "TE", "PK"])
+    if rng.random() < 0.3:
+        params["sort_by"] = rng.choice(["average_points", "max_points"])
+    return "/v0/season_scores/", params
+
+
+def team_scores_request(rng: random.Random, data: SampleData) -> tuple:
+    if rng.random() < 0.7:
+        return "/v0/team_scores/", {"league_id": rng.choice(data.league_ids), "season": 2023, "week": rng.choice([1, 2])}
+    return "/v0/team_scores/", {"season": 2023, "limit": 100}
+
+
+def changes_request(rng: random.Random, data: SampleData) -> tuple:
+    if rng.random() < 0.1:
+        return "/v0/changes/", {"since": 0, "limit": 1000}
+    # Most clients are almost in sync
+    return "/v0/changes/", {"since": max(0, data.change_token - rng.randrange(0, 200))}
+
+
+def leagues_request(rng: random.Random, data: SampleData) -> tuple:
+    if rng.random() < 0.3:
+        return "/v0/leagues/", {"league_name": rng.choice(data.league_names)}
+    return "/v0/leagues/", {}
+
+
+# operation_id: (share of the traffic, function that builds the path and query)
+SCENARIOS = {
+    "v0_health_check": (5, lambda rng, data: ("/", {})),
+    "v0_get_players": (20, players_request),
+    "v0_get_players_by_player_id": (20, lambda rng, data: (f"/v0/players/{rng.choice(data.player_ids)}", {})),
+    "v0_search_players": (10, search_request),
+    "v0_get_performances": (20, performances_request),
+    "v0_export_performances": (1, lambda rng, data: ("/v0/performances/export", {})),
+    "v0_get_season_scores": (5, season_scores_request),
+    "v0_get_weekly_leaderboard": (10, lambda rng, data: ("/v0/leaderboards/weekly/", {
+        "season": 2023,
+        "week": rng.choice([1, 2]),
+        "position": rng.choice([None, "QB", "RB", "WR", "TE", "PK"]),
+        "limit": rng.choice([10, 25]),
+    })),
+    "v0_get_team_scores": (5, team_scores_request),
+    "v0_get_league_by_league_id": (5, lambda rng, data: (f"/v0/leagues/{rng.choice(data.league_ids)}", {})),
+    "v0_get_leagues": (5, leagues_request),
+    "v0_get_teams": (10, teams_request),
+    "v0_get_bulk_file": (1, lambda rng, data: (
+        f"/v0/bulk/{rng.choice(['players', 'performances', 'leagues', 'teams', 'team_players'])}",
+        {"file_format": rng.choice(["arrow", "parquet"])},
+    )),
+    "v0_get_changes": (5, changes_request),
+    "v0_get_counts": (8, lambda rng, data: ("/v0/counts/", {})),
+}
+
+
+def app_operation_ids() -> set:
+    """Lists the operation_id of every endpoint in main.py"""
+    from main import app
+
+    return {
+        operation["operationId"]
+        for path in app.openapi()["paths"].values()
+        for operation in path.values()
+    }
+
+
+def start_server(port: int, env: dict) -> subprocess.Popen:
+    """Starts uvicorn in a child process and waits until it answers"""
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=APP_DIR,
+        env=dict(os.environ, **env),
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/")
+            return server
+        except httpx.TransportError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("The API didn't start")
+
+
+async def drive(base_url: str, concurrency: int, duration: float, seed: int, data: SampleData) -> dict:
+    """Sends the request mix from concurrency clients for duration seconds.
+
+    Returns the latencies in seconds and the error count for each operation."""
+    operation_ids = list(SCENARIOS)
+    weights = [SCENARIOS[operation_id][0] for operation_id in operation_ids]
+    results = {operation_id: {"latencies": [], "errors": 0} for operation_id in operation_ids}
+    limits = httpx.Limits(max_connections=concurrency)
+    stop_at = time.perf_counter() + duration
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+
+        async def worker(number: int):
+            rng = random.Random(seed + number)
+            while time.perf_counter() < stop_at:
+                operation_id = rng.choices(operation_ids, weights)[0]
+                path, params = SCENARIOS[operation_id][1](rng, data)
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path, params=params)
+                    await response.aread()
+                    response.raise_for_status()
+                except httpx.HTTPError:
+                    results[operation_id]["errors"] += 1
+                    continue
+                results[operation_id]["latencies"].append(time.perf_counter() - started)
+
+        await asyncio.gather(*(worker(number) for number in range(concurrency)))
+    return results
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Returns a percentile in milliseconds, or None with no samples"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index] * 1000
+
+
+def summarize(results: dict, duration: float) -> dict:
+    summary = {}
+    for operation_id, result in results.items():
+        latencies = sorted(result["latencies"])
+        summary[operation_id] = {
+            "requests": len(latencies),
+            "errors": result["errors"],
+            "throughput_rps": len(latencies) / duration,
+            "mean_ms": statistics.fmean(latencies) * 1000 if latencies else None,
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+        }
+    return summary
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=APP_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--duration", type=float, default=20, help="seconds per concurrency level")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--url", help="test this running server instead of starting one")
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--env", action="append", default=[], help="NAME=VALUE for the local server")
+    parser.add_argument("--output", default="load_test_results.json")
+    args = parser.parse_args()
+
+    missing = app_operation_ids() - set(SCENARIOS)
+    if missing:
+        parser.error(f"No load test scenario for: {', '.join(sorted(missing))}")
+
+    data = SampleData()
+    server_env = dict(setting.split("=", 1) for setting in args.env)
+    server = None if args.url else start_server(args.port, server_env)
+    base_url = args.url or f"http://127.0.0.1:{args.port}"
+
+    runs = []
+    try:
+        for concurrency in args.concurrency:
+            results = asyncio.run(drive(base_url, concurrency, args.duration, args.seed, data))
+            summary = summarize(results, args.duration)
+            runs.append({"concurrency": concurrency, "operations": summary})
+            print(f"\nconcurrency {concurrency}")
+            print(f"{'operation_id':>30} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+            for operation_id, stats in summary.items():
+                if not stats["requests"]:
+                    continue
+                print(
+                    f"{operation_id:>30} {stats['throughput_rps']:>8.1f} {stats['p50_ms']:>8.1f} "
+                    f"{stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f} {stats['errors']:>7}"
+                )
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "base_url": base_url,
+        "server_env": server_env,
+        "duration_seconds": args.duration,
+        "seed": args.seed,
+        "runs": runs,
+    }
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"\nWrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
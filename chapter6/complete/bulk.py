@@ -0,0 +1,76 @@
+"""Columnar bulk files built from the database
+
+Builds Apache Arrow IPC streams and Parquet files for whole tables. Each
+file is cached until the data version changes, so any write, including a
+delete or a second edit on the same day, has it rebuilt."""
+import io
+
+from sqlalchemy import Date, Float, Integer, String
+
+import models
+from cache import VersionedCache
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - pyarrow is optional
+    pa = None
+    pq = None
+
+# Table names used in the URLs, matching the bulk file names in the SDK
+TABLES = {
+    "players": models.Player,
+    "performances": models.Performance,
+    "leagues": models.League,
+    "teams": models.Team,
+    "team_players": models.TeamPlayer,
+}
+
+MEDIA_TYPES = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+FILE_EXTENSIONS = {"arrow": "arrows", "parquet": "parquet"}
+
+
+def is_available() -> bool:
+    return pa is not None
+
+
+def arrow_type(column):
+    """Maps a SQLAlchemy column type to an Arrow type"""
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if isinstance(column.type, Date):
+        return pa.date32()
+    if isinstance(column.type, String):
+        return pa.string()
+    raise TypeError(f"No Arrow type for column {column.name}")
+
+
+def build_table(model, rows: list):
+    """Turns rows from the model's table into an Arrow table"""
+    columns = list(model.__table__.columns)
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    return pa.table({
+        column.name: pa.array(column_values, type=arrow_type(column))
+        for column, column_values in zip(columns, values)
+    })
+
+
+def encode(table, file_format: str) -> bytes:
+    """Writes an Arrow table as an Arrow IPC stream or a Parquet file"""
+    sink = io.BytesIO()
+    if file_format == "parquet":
+        pq.write_table(table, sink)
+    else:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    return sink.getvalue()
+
+
+# Encoded files keyed by (table name, file format)
+bulk_file_cache = VersionedCache()
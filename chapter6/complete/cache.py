@@ -0,0 +1,97 @@
+"""Caches for results that only change when the data changes"""
+import os
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from database import engine
+
+# Bumped every time a session in this process writes to the database
+_write_generation = 0
+
+
+def _bump_write_generation():
+    global _write_generation
+    _write_generation += 1
+
+
+@event.listens_for(Session, "after_flush")
+def record_write(session, flush_context):
+    session.info["wrote"] = True
+    _bump_write_generation()
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def record_write_end(session):
+    """Commits publish the writes and rollbacks undo them, so both change the data"""
+    if session.info.pop("wrote", False):
+        _bump_write_generation()
+
+
+def data_version() -> tuple:
+    """Returns a value that changes whenever the data in the database changes.
+
+    Writes made through this process are tracked with a session event. Writes
+    from other processes show up as a change to the modification time or size
+    of the database file or its write-ahead log. No queries are run."""
+    version = [_write_generation]
+    for suffix in ("", "-wal"):
+        try:
+            stat = os.stat(engine.url.database + suffix)
+            version.append((stat.st_mtime_ns, stat.st_size))
+        except (OSError, TypeError):
+            version.append(None)
+    return tuple(version)
+
+
+class VersionedCache:
+    """Keeps computed values until the data version changes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._values = {}
+
+    def _lookup(self, key):
+        """Returns the data version, whether key is cached, and its value"""
+        version = data_version()
+        with self._lock:
+            if version != self._version:
+                self._version = version
+                self._values = {}
+            if key in self._values:
+                return version, True, self._values[key]
+        return version, False, None
+
+    def _store(self, version, key, value):
+        """Caches value unless the data changed while it was being computed"""
+        with self._lock:
+            if version == self._version:
+                self._values[key] = value
+
+    def get(self, key, loader):
+        """Returns the cached value for key, calling loader() when it is missing or stale"""
+        version, found, value = self._lookup(key)
+        if not found:
+            value = loader()
+            self._store(version, key, value)
+        return value
+
+    async def get_async(self, key, loader):
+        """Same as get, but awaits the value returned by loader()"""
+        version, found, value = self._lookup(key)
+        if not found:
+            value = await loader()
+            self._store(version, key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+            self._values = {}
+
+
+counts_cache = VersionedCache()
+table_version_cache = VersionedCache()
@@ -0,0 +1,188 @@
+"""Change log for the delta-sync feed
+
+Triggers on the league, team, team_player, player and performance tables
+write a row to change_log for every insert, update and delete. The
+change_id of each row is the change token: it only ever goes up, because
+the table uses SQLite's AUTOINCREMENT, so a client can store the last
+token it read and ask for the changes after it.
+
+The log only keeps the latest change of each row: every trigger deletes
+the row's earlier entry before it writes the new one. A row that changed
+several times since a token is sent once, and a page of changes is a
+plain range of change_id, so a sync cycle only reads the rows that
+changed. Create the triggers with python migrate.py, which also logs every
+existing row once so a client starting from token 0 gets a full copy."""
+import json
+from typing import NamedTuple
+
+from sqlalchemy import func, select, text, tuple_
+from sqlalchemy.engine import Engine
+
+import models
+
+# Tables in the feed, parents first, so a full copy can be loaded in order
+FEED_MODELS = {
+    model.__tablename__: model
+    for model in (models.League, models.Team, models.Player, models.TeamPlayer, models.Performance)
+}
+
+UPSERT = "upsert"
+DELETE = "delete"
+
+
+class ChangeEntry(NamedTuple):
+    """The latest change of one row, with the row as it is now unless it was deleted"""
+    change_id: int
+    entity: str
+    operation: str
+    key: dict
+    league: object = None
+    team: object = None
+    team_player: object = None
+    player: object = None
+    performance: object = None
+
+
+def key_columns(model) -> list:
+    return [column.name for column in model.__table__.primary_key.columns]
+
+
+def _key_json(model, prefix: str) -> str:
+    """SQL for the json_object of a row's primary key in a trigger"""
+    pairs = ", ".join(f"'{name}', {prefix}.{name}" for name in key_columns(model))
+    return f"json_object({pairs})"
+
+
+def _log_statement(table_name: str, operation: str, key_sql: str) -> str:
+    return (
+        "INSERT INTO change_log (table_name, operation, row_key) "
+        f"VALUES ('{table_name}', '{operation}', {key_sql});"
+    )
+
+
+def _compact_statement(table_name: str, *key_sqls: str) -> str:
+    """Deletes the earlier entries of the rows, so only their latest change is kept"""
+    return (
+        f"DELETE FROM change_log WHERE table_name = '{table_name}' "
+        f"AND row_key IN ({', '.join(key_sqls)});"
+    )
+
+
+def trigger_ddl() -> dict:
+    """Returns the statements that create the triggers, keyed by trigger name"""
+    statements = {}
+    for table_name, model in FEED_MODELS.items():
+        old_key, new_key = _key_json(model, "old"), _key_json(model, "new")
+        statements[f"{table_name}_change_insert"] = (
+            f"CREATE TRIGGER {table_name}_change_insert AFTER INSERT ON {table_name} BEGIN "
+            f"{_compact_statement(table_name, new_key)} "
+            f"{_log_statement(table_name, UPSERT, new_key)} END"
+        )
+        statements[f"{table_name}_change_delete"] = (
+            f"CREATE TRIGGER {table_name}_change_delete AFTER DELETE ON {table_name} BEGIN "
+            f"{_compact_statement(table_name, old_key)} "
+            f"{_log_statement(table_name, DELETE, old_key)} END"
+        )
+        # A changed primary key deletes the row under its old key
+        statements[f"{table_name}_change_update"] = (
+            f"CREATE TRIGGER {table_name}_change_update AFTER UPDATE ON {table_name} BEGIN "
+            f"{_compact_statement(table_name, old_key, new_key)} "
+            "INSERT INTO change_log (table_name, operation, row_key) "
+            f"SELECT '{table_name}', '{DELETE}', {old_key} WHERE {old_key} IS NOT {new_key}; "
+            f"{_log_statement(table_name, UPSERT, new_key)} END"
+        )
+    return statements
+
+
+def compact_statement() -> str:
+    """Deletes every entry but the latest of each row, for a log written
+    before the triggers kept it compact"""
+    return (
+        "DELETE FROM change_log WHERE change_id NOT IN "
+        "(SELECT max(change_id) FROM change_log GROUP BY table_name, row_key)"
+    )
+
+
+def create_change_log(target_engine: Engine) -> list:
+    """Creates any missing trigger, replaces any trigger from an older
+    version of this module, and logs every existing row when the change log
+    is empty. The change_log table comes from models.py."""
+    created = []
+    with target_engine.begin() as connection:
+        existing = dict(connection.execute(text("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'")).all())
+        for name, statement in trigger_ddl().items():
+            if existing.get(name) != statement:
+                if name in existing:
+                    connection.execute(text(f"DROP TRIGGER {name}"))
+                connection.execute(text(statement))
+                created.append(name)
+        if created:
+            connection.execute(text(compact_statement()))
+        if connection.scalar(select(func.count()).select_from(models.ChangeLog)) == 0:
+            for table_name, model in FEED_MODELS.items():
+                connection.execute(text(
+                    "INSERT INTO change_log (table_name, operation, row_key) "
+                    f"SELECT '{table_name}', '{UPSERT}', {_key_json(model, table_name)} FROM {table_name} "
+                    f"ORDER BY last_changed_date, {', '.join(key_columns(model))}"
+                ))
+    return created
+
+
+def latest_changes_query(since: int = 0, limit: int = 500):
+    """Builds a query for the latest change of each row changed after the
+    token, in change_id order. The log only holds the latest change of each
+    row, so this is a range of the primary key."""
+    change_log = models.ChangeLog
+    return (
+        select(change_log)
+        .where(change_log.change_id > since)
+        .order_by(change_log.change_id)
+        .limit(limit)
+    )
+
+
+def row_key(table_name: str, row) -> tuple:
+    """Returns the primary key of a row of a table in the feed"""
+    return tuple(getattr(row, name) for name in key_columns(FEED_MODELS[table_name]))
+
+
+def change_key(change) -> tuple:
+    """Returns the primary key of the row in a change_log row"""
+    key = json.loads(change.row_key)
+    return tuple(key[name] for name in key_columns(FEED_MODELS[change.table_name]))
+
+
+def keys_to_load(changes: list) -> dict:
+    """Groups the keys of the rows to read by table, leaving out deleted rows"""
+    keys = {}
+    for change in changes:
+        if change.operation == UPSERT:
+            keys.setdefault(change.table_name, []).append(change_key(change))
+    return keys
+
+
+def rows_query(table_name: str, keys: list):
+    """Builds a query for the rows of one table with the keys"""
+    model = FEED_MODELS[table_name]
+    columns = [getattr(model, name) for name in key_columns(model)]
+    if len(columns) == 1:
+        return select(model).where(columns[0].in_([key[0] for key in keys]))
+    return select(model).where(tuple_(*columns).in_(keys))
+
+
+def entries(changes: list, rows: dict) -> list:
+    """Pairs each change with its row, from rows keyed by (table name, key).
+    A row that is gone by the time it is read is sent as deleted."""
+    result = []
+    for change in changes:
+        row = None
+        if change.operation == UPSERT:
+            row = rows.get((change.table_name, change_key(change)))
+        result.append(ChangeEntry(
+            change_id=change.change_id,
+            entity=change.table_name,
+            operation=UPSERT if row is not None else DELETE,
+            key=json.loads(change.row_key),
+            **({change.table_name: row} if row is not None else {}),
+        ))
+    return result
@@ -0,0 +1,286 @@
+"""Response compression negotiated from Accept-Encoding
+
+Compresses JSON, NDJSON and Arrow responses with zstd, brotli or gzip,
+whichever the client accepts and this server has installed, in that order
+of preference. Bodies smaller than the minimum size are sent as they are.
+Streaming responses are compressed chunk by chunk.
+
+Compressed bodies of responses with an ETag are kept in a small cache
+until the data changes, so the same page asked for again is sent without
+compressing it again. The ETags from conditional.py are weak, so one ETag
+stands for the response in every encoding.
+
+Settings come from the environment:
+
+    SWC_COMPRESSION_ENCODINGS  encodings to offer, in order (zstd,br,gzip).
+                               Empty turns compression off.
+    SWC_COMPRESSION_MIN_SIZE   smallest body to compress, in bytes (1024)
+    SWC_COMPRESSION_THREAD_SIZE  smallest body or chunk to compress in the
+                               thread pool instead of on the event loop,
+                               in bytes (65536)
+    SWC_GZIP_LEVEL             gzip level, 1 to 9 (6)
+    SWC_BROTLI_LEVEL           brotli quality, 0 to 11 (4)
+    SWC_ZSTD_LEVEL             zstd level, 1 to 22 (3)
+    SWC_COMPRESSION_CACHE_BYTES  size of the compressed body cache (32 MiB)
+"""
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+from fastapi import Response
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+
+from cache import data_version
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is in requirements.txt
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstandard is in requirements.txt
+    zstandard = None
+
+# Media types worth compressing. Parquet files are compressed already.
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/vnd.apache.arrow.stream",
+    "text/",
+)
+
+
+def available_encodings() -> tuple:
+    """Lists the encodings this server can produce, in order of preference"""
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return tuple(encodings)
+
+
+def configured_encodings(environ=os.environ) -> tuple:
+    """Reads SWC_COMPRESSION_ENCODINGS, keeping only the encodings that are available"""
+    value = environ.get("SWC_COMPRESSION_ENCODINGS")
+    if value is None:
+        return available_encodings()
+    names = [name.strip().lower() for name in value.split(",") if name.strip()]
+    unknown = set(names) - {"zstd", "br", "gzip"}
+    if unknown:
+        raise ValueError(f"Unsupported SWC_COMPRESSION_ENCODINGS: {', '.join(sorted(unknown))}")
+    return tuple(name for name in names if name in available_encodings())
+
+
+ENCODINGS = configured_encodings()
+MIN_SIZE = int(os.getenv("SWC_COMPRESSION_MIN_SIZE", "1024"))
+# Compressing a large body takes long enough to hold up every other request
+# on the event loop, so it runs in the thread pool. zlib, brotli and zstd
+# release the GIL while they compress.
+THREAD_SIZE = int(os.getenv("SWC_COMPRESSION_THREAD_SIZE", "65536"))
+LEVELS = {
+    "gzip": int(os.getenv("SWC_GZIP_LEVEL", "6")),
+    "br": int(os.getenv("SWC_BROTLI_LEVEL", "4")),
+    "zstd": int(os.getenv("SWC_ZSTD_LEVEL", "3")),
+}
+
+
+def negotiate(accept_encoding: str, encodings: tuple = ENCODINGS) -> str:
+    """Picks the encoding to send for an Accept-Encoding header.
+
+    The encoding with the highest q-value wins, and ties go to the order of
+    encodings. Returns None to send the body as it is."""
+    if not accept_encoding or not encodings:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if name:
+            weights[name] = weight
+    best, best_weight = None, 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+class Compressor:
+    """Compresses a body in one or more chunks with one encoding"""
+
+    def __init__(self, encoding: str, level: int = None):
+        level = LEVELS[encoding] if level is None else level
+        self.encoding = encoding
+        if encoding == "gzip":
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        elif encoding == "br":
+            self._compressor = brotli.Compressor(quality=level)
+        elif encoding == "zstd":
+            self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            raise ValueError(f"Unsupported encoding: {encoding}")
+
+    def compress(self, data: bytes) -> bytes:
+        """Compresses a chunk and flushes it, so the client can decode it right away"""
+        if self.encoding == "gzip":
+            return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        if self.encoding == "gzip":
+            return self._compressor.flush()
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def compress(body: bytes, encoding: str, level: int = None) -> bytes:
+    """Compresses a whole body"""
+    level = LEVELS[encoding] if level is None else level
+    if encoding == "gzip":
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return compressor.compress(body) + compressor.flush()
+    if encoding == "br":
+        return brotli.compress(body, quality=level)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(body)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+class CompressedBodyCache:
+    """Keeps the most recently used compressed bodies, keyed by ETag and encoding,
+    up to a total size in bytes. Emptied when the data version changes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._version = None
+        self._bodies = OrderedDict()
+        self._size = 0
+
+    def _check_version(self):
+        """Empties the cache if the data changed. Call with the lock held."""
+        version = data_version()
+        if version != self._version:
+            self._version = version
+            self._bodies.clear()
+            self._size = 0
+
+    def get(self, etag: str, encoding: str):
+        with self._lock:
+            self._check_version()
+            body = self._bodies.get((etag, encoding))
+            if body is not None:
+                self._bodies.move_to_end((etag, encoding))
+            return body
+
+    def put(self, etag: str, encoding: str, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._check_version()
+            previous = self._bodies.pop((etag, encoding), None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._bodies[(etag, encoding)] = body
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, evicted = self._bodies.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+            self._bodies.clear()
+            self._size = 0
+
+
+compressed_body_cache = CompressedBodyCache(
+    int(os.getenv("SWC_COMPRESSION_CACHE_BYTES", str(32 * 1024 * 1024)))
+)
+
+
+def is_compressible(response: Response) -> bool:
+    content_type = response.headers.get("content-type", "")
+    return (
+        response.status_code not in (204, 206, 304)
+        and "content-encoding" not in response.headers
+        and content_type.startswith(COMPRESSIBLE_TYPES)
+    )
+
+
+def _add_vary(headers: MutableHeaders):
+    vary = headers.get("vary")
+    if vary is None:
+        headers["Vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower():
+        headers["Vary"] = vary + ", Accept-Encoding"
+
+
+async def _compressed_chunks(chunks, compressor: Compressor):
+    async for chunk in chunks:
+        if len(chunk) >= THREAD_SIZE:
+            data = await run_in_threadpool(compressor.compress, chunk)
+        else:
+            data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+async def compress_off_loop(body: bytes, encoding: str) -> bytes:
+    """Compresses a body, in the thread pool when it is THREAD_SIZE or larger"""
+    if len(body) >= THREAD_SIZE:
+        return await run_in_threadpool(compress, body, encoding)
+    return compress(body, encoding)
+
+
+async def compress_response(accept_encoding: str, response: Response) -> Response:
+    """Compresses a response from call_next in an http middleware.
+
+    Responses with a Content-Length are read whole and only compressed when
+    they reach MIN_SIZE. Streaming responses are compressed as they go.
+    Bodies and chunks of THREAD_SIZE or more are compressed in the thread
+    pool, so the event loop keeps serving other requests."""
+    if not is_compressible(response):
+        return response
+    headers = MutableHeaders(raw=list(response.raw_headers))
+    _add_vary(headers)
+    encoding = negotiate(accept_encoding)
+
+    if "content-length" not in headers:
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+            response.body_iterator = _compressed_chunks(response.body_iterator, Compressor(encoding))
+        response.raw_headers = headers.raw
+        return response
+
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    if encoding is not None and len(body) >= MIN_SIZE:
+        etag = headers.get("etag")
+        compressed = compressed_body_cache.get(etag, encoding) if etag else None
+        if compressed is None:
+            compressed = await compress_off_loop(body, encoding)
+            if etag and response.status_code == 200:
+                compressed_body_cache.put(etag, encoding, compressed)
+        body = compressed
+        headers["Content-Encoding"] = encoding
+        headers["Content-Length"] = str(len(body))
+    compressed_response = Response(content=body, status_code=response.status_code)
+    compressed_response.raw_headers = headers.raw
+    return compressed_response
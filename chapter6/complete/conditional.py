@@ -0,0 +1,57 @@
+"""HTTP conditional request helpers (ETag and Last-Modified)"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+
+def make_etag(path: str, query_items: list, version: int, changed_at: datetime) -> str:
+    """Builds a weak ETag from the request path, its query parameters, and
+    the version of the tables behind the response.
+
+    It is weak because it names the data, not the bytes: the same data is
+    sent as identical JSON or with any of the content encodings."""
+    query = "&".join(f"{key}={value}" for key, value in sorted(query_items))
+    source = f"{path}?{query}|{version}|{changed_at.isoformat()}"
+    return 'W/"' + hashlib.sha256(source.encode()).hexdigest()[:32] + '"'
+
+
+def last_modified_datetime(changed_at: datetime) -> datetime:
+    """Treats a changed_at from SQLite as UTC, to the second like HTTP dates"""
+    return changed_at.replace(tzinfo=timezone.utc, microsecond=0)
+
+
+def http_date(changed_at: datetime) -> str:
+    """Formats a changed_at for the Last-Modified header"""
+    return format_datetime(last_modified_datetime(changed_at), usegmt=True)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Checks an If-None-Match header against an ETag using weak comparison"""
+    if if_none_match.strip() == "*":
+        return True
+    if etag.startswith("W/"):
+        etag = etag[2:]
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def is_not_modified(if_none_match: str, if_modified_since: str, etag: str, changed_at: datetime) -> bool:
+    """Decides if the client's copy is current, so a 304 can be sent.
+
+    If-None-Match wins when both headers are sent, as in RFC 9110."""
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified_datetime(changed_at) <= since
+    return False
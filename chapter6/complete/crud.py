@@ -1,62 +1,296 @@
 """SQLAlchemy Query Functions"""
+from sqlalchemy import and_, func, or_, select
 from sqlalchemy.orm import Session
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, load_only, selectinload
 from datetime import date
 
+import changes
 import models
+import search
+import table_versions
+
+
+def paginate(query, model, id_column, skip: int = 0, limit: int = 100, min_last_changed_date: date = None, cursor: dict = None):
+    """Orders by the keyset and applies either the cursor or skip to the query.
+
+    The keyset is the primary key, or last_changed_date then the primary key
+    when the min_last_changed_date filter is set. With a cursor the query
+    seeks past the last row of the previous page instead of using OFFSET."""
+    if min_last_changed_date:
+        query = query.order_by(model.last_changed_date, id_column)
+    else:
+        query = query.order_by(id_column)
+    if cursor is None:
+        return query.offset(skip).limit(limit)
+    if min_last_changed_date:
+        query = query.where(
+            or_(
+                model.last_changed_date > cursor["last_changed_date"],
+                and_(
+                    model.last_changed_date == cursor["last_changed_date"],
+                    id_column > cursor["id"],
+                ),
+            )
+        )
+    else:
+        query = query.where(id_column > cursor["id"])
+    return query.limit(limit)
+
+def field_options(model, fields: tuple = None, relationships: dict = None, min_last_changed_date: date = None) -> list:
+    """Builds the loader options that load only the fields a response needs.
+
+    relationships maps each relationship name to the loader option for it.
+    With fields set, only those columns are selected and only those
+    relationships are loaded; the primary key is always loaded, and so is
+    last_changed_date when it is part of the keyset for the next cursor.
+    With fields None everything is loaded."""
+    relationships = relationships or {}
+    if fields is None:
+        return list(relationships.values())
+    columns = [getattr(model, name) for name in fields if name not in relationships]
+    if min_last_changed_date and "last_changed_date" not in fields:
+        columns.append(model.last_changed_date)
+    if not columns:
+        columns = [getattr(model, column.key) for column in model.__mapper__.primary_key]
+    options = [load_only(*columns)]
+    options.extend(loader for name, loader in relationships.items() if name in fields)
+    return options
+
+# The statement builders below are shared with async_crud.py. They are
+# select() statements, so SQLAlchemy compiles each combination of filters
+# once and finds the SQL in its compiled cache after that. The lookups by id
+# load the one row's children with a join, which saves the second statement
+# and the Python work of a selectin load.
+def player_query(player_id: int):
+    return select(models.Player
+                  ).options(joinedload(models.Player.performances)
+                  ).where(models.Player.player_id == player_id)
 
 def get_player(db: Session, player_id: int):
-    return db.query(models.Player).filter(models.Player.player_id == player_id).first()
+    return db.scalars(player_query(player_id)).unique().first()
 
-def get_players(db: Session, skip: int = 0, limit: int = 100, min_last_changed_date: date = None, last_name : str = None, first_name : str = None, ):
-    query = db.query(models.Player)
+def players_query(skip: int = 0, limit: int = 100, min_last_changed_date: date = None, last_name : str = None, first_name : str = None, cursor: dict = None, player_ids: list = None, fields: tuple = None):
+    query = select(models.Player
+                   ).options(*field_options(
+                        models.Player, fields, {"performances": selectinload(models.Player.performances)}, min_last_changed_date))
     if min_last_changed_date:
-        query = query.filter(models.Player.last_changed_date >= min_last_changed_date)
+        query = query.where(models.Player.last_changed_date >= min_last_changed_date)
     if first_name:
-        query = query.filter(models.Player.first_name == first_name)
+        query = query.where(models.Player.first_name == first_name)
     if last_name:
-        query = query.filter(models.Player.last_name == last_name)
-    return query.offset(skip).limit(limit).all()
+        query = query.where(models.Player.last_name == last_name)
+    if player_ids:
+        query = query.where(models.Player.player_id.in_(player_ids))
+    return paginate(query, models.Player, models.Player.player_id, skip, limit, min_last_changed_date, cursor)
 
+def get_players(db: Session, skip: int = 0, limit: int = 100, min_last_changed_date: date = None, last_name : str = None, first_name : str = None, cursor: dict = None, player_ids: list = None, fields: tuple = None):
+    return db.scalars(players_query(
+        skip, limit, min_last_changed_date, last_name, first_name, cursor, player_ids, fields)).all()
 
-def get_performances(db: Session, skip: int = 0, limit: int = 100, min_last_changed_date: date = None):
-    query = db.query(models.Performance)
+def search_players(db: Session, query: str, match: str = "prefix", limit: int = 10):
+    """Finds players by name in the player_search index and ranks them"""
+    candidates = search.candidates_query(query, match)
+    if candidates is None:
+        return []
+    return search.rank(db.scalars(candidates), query, match, limit)
+
+def performances_query(skip: int = 0, limit: int = 100, min_last_changed_date: date = None, cursor: dict = None, fields: tuple = None, season: int = None, week_from: int = None, week_to: int = None):
+    """The season and week range filters are a range scan of the
+    ix_performance_season_week index. The weeks are only a range within a
+    season, so send a season with week_from and week_to; without one the
+    index can't be used."""
+    query = select(models.Performance
+                   ).options(*field_options(models.Performance, fields, None, min_last_changed_date))
+    if min_last_changed_date:
+        query = query.where(models.Performance.last_changed_date >= min_last_changed_date)
+    if season:
+        query = query.where(models.Performance.season == season)
+    if week_from:
+        query = query.where(models.Performance.week >= week_from)
+    if week_to:
+        query = query.where(models.Performance.week <= week_to)
+    return paginate(query, models.Performance, models.Performance.performance_id, skip, limit, min_last_changed_date, cursor)
+
+def get_performances(db: Session, skip: int = 0, limit: int = 100, min_last_changed_date: date = None, cursor: dict = None, fields: tuple = None, season: int = None, week_from: int = None, week_to: int = None):
+    return db.scalars(performances_query(
+        skip, limit, min_last_changed_date, cursor, fields, season, week_from, week_to)).all()
+
+def performances_export_query(min_last_changed_date: date = None):
+    """Builds a query for the performance columns in the order of schemas.Performance"""
+    table = models.Performance.__table__
+    query = select(
+        table.c.performance_id,
+        table.c.player_id,
+        table.c.week_number,
+        table.c.season,
+        table.c.week,
+        table.c.fantasy_points,
+        table.c.last_changed_date,
+    ).order_by(table.c.performance_id)
     if min_last_changed_date:
-        query = query.filter(models.Performance.last_changed_date >= min_last_changed_date)
-    return query.offset(skip).limit(limit).all()
+        query = query.where(table.c.last_changed_date >= min_last_changed_date)
+    return query
+
+def stream_performances(db: Session, min_last_changed_date: date = None, batch_size: int = 1000):
+    """Yields batches of performance rows from a cursor, so the table is never all in memory"""
+    result = db.execute(
+        performances_export_query(min_last_changed_date),
+        execution_options={"yield_per": batch_size},
+    )
+    for batch in result.mappings().partitions():
+        yield batch
+
+def league_query(league_id: int):
+    return select(models.League
+                  ).options(joinedload(models.League.teams)
+                  ).where(models.League.league_id == league_id)
 
 def get_league(db: Session, league_id: int = None):
-    return db.query(models.League).filter(models.League.league_id == league_id).first()
+    return db.scalars(league_query(league_id)).unique().first()
 
-def get_leagues(db: Session, skip: int = 0, limit: int = 100, min_last_changed_date: date = None,league_name: str = None):
-    query = db.query(models.League
-                    ).options(joinedload(models.League.teams))
+def leagues_query(skip: int = 0, limit: int = 100, min_last_changed_date: date = None, league_name: str = None, cursor: dict = None, fields: tuple = None):
+    query = select(models.League
+                   ).options(*field_options(
+                        models.League, fields, {"teams": joinedload(models.League.teams)}, min_last_changed_date))
     if min_last_changed_date:
-        query = query.filter(models.League.last_changed_date >= min_last_changed_date)                              
-    if league_name: 
-        query = query.filter(models.League.league_name == league_name)     
-    return query.offset(skip).limit(limit).all()
+        query = query.where(models.League.last_changed_date >= min_last_changed_date)
+    if league_name:
+        query = query.where(models.League.league_name == league_name)
+    return paginate(query, models.League, models.League.league_id, skip, limit, min_last_changed_date, cursor)
 
+def get_leagues(db: Session, skip: int = 0, limit: int = 100, min_last_changed_date: date = None,league_name: str = None, cursor: dict = None, fields: tuple = None):
+    return db.scalars(leagues_query(skip, limit, min_last_changed_date, league_name, cursor, fields)).unique().all()
 
-def get_teams(db: Session, skip: int = 0, limit: int = 100, min_last_changed_date: date = None, team_name: str = None, league_id: int = None):
-    query = db.query(models.Team)
+def teams_query(skip: int = 0, limit: int = 100, min_last_changed_date: date = None, team_name: str = None, league_id: int = None, cursor: dict = None, fields: tuple = None):
+    query = select(models.Team
+                   ).options(*field_options(
+                        models.Team, fields, {"players": selectinload(models.Team.players)}, min_last_changed_date))
     if min_last_changed_date:
-        query = query.filter(models.Team.last_changed_date >= min_last_changed_date)
-    if team_name: 
-        query = query.filter(models.Team.team_name == team_name)
-    if league_id: 
-        query = query.filter(models.Team.league_id == league_id)
-    return query.offset(skip).limit(limit).all()    
+        query = query.where(models.Team.last_changed_date >= min_last_changed_date)
+    if team_name:
+        query = query.where(models.Team.team_name == team_name)
+    if league_id:
+        query = query.where(models.Team.league_id == league_id)
+    return paginate(query, models.Team, models.Team.team_id, skip, limit, min_last_changed_date, cursor)
+
+def get_teams(db: Session, skip: int = 0, limit: int = 100, min_last_changed_date: date = None, team_name: str = None, league_id: int = None, cursor: dict = None, fields: tuple = None):
+    return db.scalars(teams_query(skip, limit, min_last_changed_date, team_name, league_id, cursor, fields)).all()
+
+def table_rows_query(model):
+    """Builds a query for every row of a model's table, in primary key order"""
+    table = model.__table__
+    return select(table).order_by(*table.primary_key.columns)
+
+def get_table_rows(db: Session, model):
+    """Returns every row of a model's table as tuples in column order"""
+    return [tuple(row) for row in db.execute(table_rows_query(model))]
+
+#scoring queries
+SEASON_SCORE_SORTS = ("total_points", "average_points", "max_points", "games_played")
+
+def season_scores_query(skip: int = 0, limit: int = 100, season: int = None, player_id: int = None, position: str = None, min_games_played: int = None, sort_by: str = "total_points", descending: bool = True):
+    """Builds a query for season totals, sorted by one of SEASON_SCORE_SORTS.
+    Ties are broken by player_id and season so pages don't overlap."""
+    season_score = models.PlayerSeasonScore
+    query = select(season_score)
+    if season is not None:
+        query = query.where(season_score.season == season)
+    if player_id is not None:
+        query = query.where(season_score.player_id == player_id)
+    if position:
+        query = query.join(models.Player, models.Player.player_id == season_score.player_id
+                          ).where(models.Player.position == position)
+    if min_games_played:
+        query = query.where(season_score.games_played >= min_games_played)
+    sort_column = getattr(season_score, sort_by)
+    query = query.order_by(sort_column.desc() if descending else sort_column,
+                           season_score.player_id, season_score.season)
+    return query.offset(skip).limit(limit)
+
+def get_season_scores(db: Session, skip: int = 0, limit: int = 100, season: int = None, player_id: int = None, position: str = None, min_games_played: int = None, sort_by: str = "total_points", descending: bool = True):
+    return db.scalars(season_scores_query(
+        skip, limit, season, player_id, position, min_games_played, sort_by, descending)).all()
+
+def weekly_leaderboard_query(season: int, week: int, position: str = None, limit: int = 10):
+    """Builds a query for the top players of a week, read in rank order from
+    the primary key of the weekly_leaderboard table"""
+    leaderboard = models.WeeklyLeaderboard
+    return select(leaderboard).where(
+        leaderboard.season == season,
+        leaderboard.week == week,
+        leaderboard.board == (position or models.ALL_POSITIONS),
+        leaderboard.rank <= limit,
+    ).order_by(leaderboard.rank)
+
+def get_weekly_leaderboard(db: Session, season: int, week: int, position: str = None, limit: int = 10):
+    return db.scalars(weekly_leaderboard_query(season, week, position, limit)).all()
+
+def team_week_scores_query(skip: int = 0, limit: int = 100, league_id: int = None, team_id: int = None, season: int = None, week: int = None):
+    """Builds a query for weekly team totals, week by week with the highest
+    scoring team first. Ties are broken by team_id so pages don't overlap."""
+    team_score = models.TeamWeekScore
+    query = select(team_score)
+    if league_id is not None:
+        query = query.where(team_score.league_id == league_id)
+    if team_id is not None:
+        query = query.where(team_score.team_id == team_id)
+    if season is not None:
+        query = query.where(team_score.season == season)
+    if week is not None:
+        query = query.where(team_score.week == week)
+    query = query.order_by(team_score.season, team_score.week,
+                           team_score.total_points.desc(), team_score.team_id)
+    return query.offset(skip).limit(limit)
+
+def get_team_week_scores(db: Session, skip: int = 0, limit: int = 100, league_id: int = None, team_id: int = None, season: int = None, week: int = None):
+    return db.scalars(team_week_scores_query(skip, limit, league_id, team_id, season, week)).all()
+
+#delta-sync queries
+def get_changes(db: Session, since: int = 0, limit: int = 500):
+    """Returns the latest change of each row changed after the token, with
+    the rows as they are now, reading one query for each changed table"""
+    latest = db.scalars(changes.latest_changes_query(since, limit)).all()
+    rows = {}
+    for table_name, keys in changes.keys_to_load(latest).items():
+        for row in db.scalars(changes.rows_query(table_name, keys)):
+            rows[table_name, changes.row_key(table_name, row)] = row
+    return changes.entries(latest, rows)
 
 #analytics queries
 def get_player_count(db: Session):
-    query = db.query(models.Player)
-    return query.count()
+    return db.scalar(select(func.count()).select_from(models.Player))
 
 def get_team_count(db: Session):
-    query = db.query(models.Team)
-    return query.count()
+    return db.scalar(select(func.count()).select_from(models.Team))
 
 def get_league_count(db: Session):
-    query = db.query(models.League)
-    return query.count()
\ No newline at end of file
+    return db.scalar(select(func.count()).select_from(models.League))
+
+def counts_query():
+    """Builds one statement that counts leagues, teams, and players"""
+    return select(
+        select(func.count()).select_from(models.League).scalar_subquery().label("league_count"),
+        select(func.count()).select_from(models.Team).scalar_subquery().label("team_count"),
+        select(func.count()).select_from(models.Player).scalar_subquery().label("player_count"),
+    )
+
+def last_changed_query(tables: tuple):
+    """Builds one statement that finds the latest last_changed_date in each table"""
+    return select(*(
+        select(func.max(table.last_changed_date)).scalar_subquery()
+        for table in tables
+    ))
+
+def get_last_changed_date(db: Session, tables: tuple):
+    """Returns the latest last_changed_date across the tables, or None if they're empty"""
+    dates = [value for value in db.execute(last_changed_query(tables)).one() if value]
+    return max(dates, default=None)
+
+def get_table_version(db: Session, tables: tuple):
+    """Returns (version, changed_at) for the tables, or None if they have no versions"""
+    version, changed_at = db.execute(table_versions.table_version_query(tables)).one()
+    return None if version is None else (version, changed_at)
+
+def get_counts(db: Session):
+    """Counts leagues, teams, and players in a single statement"""
+    return db.execute(counts_query()).one()._asdict()
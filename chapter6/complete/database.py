@@ -1,13 +1,182 @@
 """Database configuration"""
-from sqlalchemy import create_engine
+import os
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import create_engine, event, pool
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./fantasy_data.db"
+DATABASE_FILE = "./fantasy_data.db"
+
+# Set SWC_SQLITE_READ_ONLY=true when nothing will change the database file,
+# like in the Docker image where it's copied in at build time. The file is
+# opened with immutable=1, so SQLite skips all locking and change detection.
+SQLITE_READ_ONLY = os.getenv("SWC_SQLITE_READ_ONLY", "false").lower() in ("1", "true", "yes")
+
+
+def sqlite_url(driver: str = "sqlite", database_file: str = DATABASE_FILE, read_only: bool = SQLITE_READ_ONLY) -> str:
+    """Builds the SQLAlchemy URL for the database file"""
+    if read_only:
+        return f"{driver}:///file:{database_file}?mode=ro&immutable=1&uri=true"
+    return f"{driver}:///{database_file}"
+
+
+SQLALCHEMY_DATABASE_URL = sqlite_url()
+ASYNC_DATABASE_URL = sqlite_url("sqlite+aiosqlite")
+
+
+def sqlite_pragmas(read_only: bool = SQLITE_READ_ONLY) -> dict:
+    """Returns the PRAGMAs to run on every new SQLite connection.
+
+    Each value can be changed with an SWC_SQLITE_<PRAGMA> environment
+    variable, and an empty value leaves SQLite's default in place.
+    journal_mode and synchronous only matter when the file can be written."""
+    defaults = {
+        # Readers don't block each other or a writer in WAL mode
+        "journal_mode": "WAL",
+        # Safe with WAL, and skips an fsync on every commit
+        "synchronous": "NORMAL",
+        # Read the file through a 256 MB memory map instead of read() calls
+        "mmap_size": "268435456",
+        # Negative sizes are in KiB, so this is a 64 MB page cache per connection
+        "cache_size": "-65536",
+        "temp_store": "MEMORY",
+    }
+    if read_only:
+        del defaults["journal_mode"]
+        del defaults["synchronous"]
+    pragmas = {}
+    for name, default in defaults.items():
+        value = os.getenv(f"SWC_SQLITE_{name.upper()}", default)
+        if value:
+            pragmas[name] = value
+    return pragmas
+
+
+def set_sqlite_pragmas(target_engine, pragmas: dict):
+    """Runs the PRAGMAs on each connection the engine opens"""
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    event.listen(target_engine, "connect", on_connect)
+
+
+class RequestStats:
+    """How one request used the database"""
+
+    def __init__(self):
+        self.statement_count = 0
+        # Seconds spent running SQL statements
+        self.statement_time = 0.0
+        # Connections taken from the pool, and the seconds spent waiting for them
+        self.checkout_count = 0
+        self.checkout_wait = 0.0
+        # Seconds from opening the request's session to closing it
+        self.session_time = 0.0
+
+
+# Holds the stats for the current request. None outside of a request.
+request_stats: ContextVar = ContextVar("request_stats", default=None)
+
+
+class TimedCheckout:
+    """Pool mixin that adds the time spent waiting for a connection to the request stats"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            stats = request_stats.get()
+            if stats is not None:
+                stats.checkout_count += 1
+                stats.checkout_wait += time.perf_counter() - started
+
+
+POOL_CLASSES = {
+    "queue": (pool.QueuePool, pool.AsyncAdaptedQueuePool),
+    "singleton": (pool.SingletonThreadPool, None),
+    "static": (pool.StaticPool, pool.StaticPool),
+    "null": (pool.NullPool, pool.NullPool),
+}
+
+
+def pool_options(is_async: bool = False, environ=os.environ) -> dict:
+    """Reads the connection pool settings for create_engine from the environment.
+
+    SWC_DB_POOL_CLASS picks queue, singleton, static or null. The queue pool
+    also takes SWC_DB_POOL_SIZE, SWC_DB_MAX_OVERFLOW and SWC_DB_POOL_TIMEOUT.
+    SWC_DB_POOL_PRE_PING and SWC_DB_POOL_RECYCLE work with every pool.
+    Settings that aren't set keep SQLAlchemy's defaults."""
+    pool_name = environ.get("SWC_DB_POOL_CLASS", "queue").lower()
+    if pool_name not in POOL_CLASSES or POOL_CLASSES[pool_name][is_async] is None:
+        raise ValueError(f"Unsupported SWC_DB_POOL_CLASS: {pool_name}")
+    pool_class = POOL_CLASSES[pool_name][is_async]
+    options = {
+        "poolclass": type(f"Timed{pool_class.__name__}", (TimedCheckout, pool_class), {}),
+        "pool_pre_ping": environ.get("SWC_DB_POOL_PRE_PING", "false").lower() in ("1", "true", "yes"),
+        "pool_recycle": int(environ.get("SWC_DB_POOL_RECYCLE", "-1")),
+    }
+    if pool_name == "queue":
+        for option, variable in (
+            ("pool_size", "SWC_DB_POOL_SIZE"),
+            ("max_overflow", "SWC_DB_MAX_OVERFLOW"),
+            ("pool_timeout", "SWC_DB_POOL_TIMEOUT"),
+        ):
+            if variable in environ:
+                options[option] = int(environ[variable])
+    return options
+
+
+# Set SWC_ASYNC_DB=true to serve requests from the asyncio database layer.
+# This needs the aiosqlite driver.
+USE_ASYNC_DB = os.getenv("SWC_ASYNC_DB", "false").lower() in ("1", "true", "yes")
+
+# Set SWC_SNAPSHOT=true to load the tables into memory at startup and serve
+# reads from there. See snapshot.py.
+USE_SNAPSHOT = os.getenv("SWC_SNAPSHOT", "false").lower() in ("1", "true", "yes")
 
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}, **pool_options()
 )
+set_sqlite_pragmas(engine, sqlite_pragmas())
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
\ No newline at end of file
+async_engine = None
+AsyncSessionLocal = None
+if USE_ASYNC_DB:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options(is_async=True))
+    set_sqlite_pragmas(async_engine.sync_engine, sqlite_pragmas())
+    AsyncSessionLocal = async_sessionmaker(
+        autoflush=False, bind=async_engine, expire_on_commit=False
+    )
+
+Base = declarative_base()
+
+
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    stats = request_stats.get()
+    if stats is not None:
+        stats.statement_count += 1
+        conn.info.setdefault("statement_started", []).append(time.perf_counter())
+
+
+def time_statement(conn, cursor, statement, parameters, context, executemany):
+    stats = request_stats.get()
+    started = conn.info.get("statement_started")
+    if stats is not None and started:
+        stats.statement_time += time.perf_counter() - started.pop()
+
+
+event.listen(engine, "before_cursor_execute", count_statement)
+event.listen(engine, "after_cursor_execute", time_statement)
+if async_engine is not None:
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count_statement)
+    event.listen(async_engine.sync_engine, "after_cursor_execute", time_statement)
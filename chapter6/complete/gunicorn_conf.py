@@ -0,0 +1,78 @@
+"""Gunicorn configuration for running the API in production
+
+Runs the FastAPI app in several Uvicorn worker processes, so every CPU the
+container gets can serve requests. All the workers read the same
+fantasy_data.db file.
+
+Typical usage example:
+
+    gunicorn main:app -c gunicorn_conf.py
+
+The workers share their Prometheus metrics through files in
+PROMETHEUS_MULTIPROC_DIR, so /metrics reports the totals of all of them.
+
+Send the master process SIGHUP to restart the workers one by one, for
+example after replacing the database file. Send SIGTERM to stop after the
+requests in progress are finished.
+"""
+import math
+import os
+import shutil
+import tempfile
+
+
+def available_cpus() -> int:
+    """Counts the CPUs this process may use, including container CPU limits"""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    try:
+        # cgroup v2 puts a quota like "200000 100000" (2 CPUs) in cpu.max
+        with open("/sys/fs/cgroup/cpu.max") as cpu_max:
+            quota, period = cpu_max.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return max(1, cpus or 1)
+
+
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# One worker per CPU unless WEB_CONCURRENCY says otherwise
+workers = int(os.getenv("WEB_CONCURRENCY", available_cpus()))
+
+bind = os.getenv("SWC_BIND", "0.0.0.0:80")
+
+# Restart each worker after this many requests, with jitter so they don't
+# all restart at once. This keeps any slow memory growth in check.
+max_requests = int(os.getenv("SWC_MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("SWC_MAX_REQUESTS_JITTER", "1000"))
+
+# Seconds a worker has to finish its requests on restart or shutdown
+graceful_timeout = int(os.getenv("SWC_GRACEFUL_TIMEOUT", "30"))
+
+# Seconds a worker can stay silent before the master replaces it
+timeout = int(os.getenv("SWC_WORKER_TIMEOUT", "60"))
+
+keepalive = 5
+accesslog = "-"
+
+# Set before the workers import the app, so prometheus_client keeps the
+# metrics in files every worker can read
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "swc_metrics"))
+
+
+def on_starting(server):
+    """Empties the metrics directory, so the numbers of an earlier run
+    aren't added to this one. The master doesn't import metrics.py, which
+    would give it metric files of its own."""
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def child_exit(server, worker):
+    """Drops the live gauges of a worker that exited. Its counters and
+    histograms stay in the totals, so they never go down."""
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,12 +1,26 @@
 """FastAPI program - Chapter 6"""
 
-from fastapi import Depends, FastAPI, HTTPException, Query
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from contextlib import asynccontextmanager
 from datetime import date
+from typing import Literal
+import asyncio
+import signal
+import time
 
 
-import crud, schemas
-from database import SessionLocal
+import async_crud, bulk, cache, compression, conditional, crud, metrics, models, schemas, pagination, search, serialization, snapshot
+from database import (
+    USE_ASYNC_DB,
+    USE_SNAPSHOT,
+    AsyncSessionLocal,
+    RequestStats,
+    SessionLocal,
+    request_stats,
+)
 
 api_description = """
 Test Render Deploy
@@ -14,33 +28,303 @@ This API provides read-only access to info from the Sports World Central (SWC) F
 The endpoints are grouped into the following categories:
 
 ## Analytics
-Get information about health of the API and counts of leagues, teams, and players.
+Get information about health of the API and counts of leagues, teams, and players. Download bulk files of each table in Arrow or Parquet format, and keep a copy in sync with the changes feed.
 
 ## Player
-You can get a list of an NFL players, or search for an individual player by player_id.
+You can get a list of an NFL players, search for an individual player by player_id, or search for players by name as you type.
 
 ## Scoring
-You can get a list of NFL player performances, including the fantasy points they scored using SWC league scoring.
+You can get a list of NFL player performances, including the fantasy points they scored using SWC league scoring. Get each player's season totals without adding up the performances yourself, the top scorers of each week, and the weekly totals of each team in a league.
 
 ## Membership
 Get information about all the SWC fantasy football leagues and the teams in them.
 """
 
+# Snapshot reloads started by SIGHUP, kept until they finish
+_reload_tasks = set()
+
+
+def start_snapshot_reload():
+    """Reloads the snapshot in the thread pool, so the event loop keeps
+    serving requests from the old snapshot while the new one loads"""
+    task = asyncio.ensure_future(run_in_threadpool(snapshot.reload))
+    _reload_tasks.add(task)
+    task.add_done_callback(_reload_tasks.discard)
+
+
+def add_reload_signal_handler() -> bool:
+    """Reloads the snapshot when the process gets SIGHUP. Returns False
+    where the event loop can't handle signals: when the app runs off the
+    main thread, as with TestClient, or on platforms without SIGHUP."""
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, start_snapshot_reload)
+    except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+        return False
+    return True
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Loads the in-memory snapshot before taking requests when it's turned on.
+    Sending the process SIGHUP reloads it from the database file. Under
+    Gunicorn, send SIGHUP to the master instead, which restarts the workers."""
+    reload_on_signal = False
+    if USE_SNAPSHOT:
+        await run_in_threadpool(snapshot.current)
+        reload_on_signal = add_reload_signal_handler()
+    yield
+    if reload_on_signal:
+        asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+
+
 # FastAPI constructor with additional details added for OpenAPI Specification
 app = FastAPI(
     description=api_description,
     title="Sports World Central (SWC) Fantasy Football API",
     version="0.1",
+    lifespan=lifespan,
 )
 
 
+# Name of the response header that reports how many SQL statements a request ran
+STATEMENT_COUNT_HEADER = "X-SQL-Statement-Count"
+
+
+@app.middleware("http")
+async def compress_response(request: Request, call_next):
+    """Compresses the response with the best encoding the client accepts.
+    Added before record_database_stats, so the metrics see the compressed size."""
+    response = await call_next(request)
+    return await compression.compress_response(request.headers.get("accept-encoding"), response)
+
+
+def operation_id(request: Request) -> str:
+    """Returns the operation_id of the route that handled the request"""
+    route = request.scope.get("route")
+    if route is None:
+        return "unmatched"
+    return getattr(route, "operation_id", None) or route.name
+
+
+@app.middleware("http")
+async def record_database_stats(request: Request, call_next):
+    """Reports how each request used the database, and records the metrics
+    served by /metrics.
+
+    The SQL statement count goes in its own header. The time spent waiting
+    for pooled connections, running statements and with the session open
+    go in the Server-Timing header, in milliseconds."""
+    stats = RequestStats()
+    token = request_stats.set(stats)
+    metrics.requests_in_flight.inc()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        request_stats.reset(token)
+        metrics.requests_in_flight.dec()
+        operation = operation_id(request)
+        metrics.requests_total.labels(operation, request.method, str(status)).inc()
+        metrics.request_duration.labels(operation).observe(time.perf_counter() - started)
+        metrics.db_statements.labels(operation).observe(stats.statement_count)
+        metrics.db_statements_total.labels(operation).inc(stats.statement_count)
+        metrics.db_time.labels(operation).observe(stats.statement_time)
+    if "content-length" in response.headers:
+        metrics.response_size.labels(operation).observe(int(response.headers["content-length"]))
+    response.headers[STATEMENT_COUNT_HEADER] = str(stats.statement_count)
+    response.headers["Server-Timing"] = (
+        f"db-checkout;dur={stats.checkout_wait * 1000:.3f};desc=\"{stats.checkout_count} checkouts\", "
+        f"db-query;dur={stats.statement_time * 1000:.3f}, "
+        f"db-session;dur={stats.session_time * 1000:.3f}"
+    )
+    return response
+
+
+def record_session_time(started: float):
+    """Adds the time since a session was opened to the request stats"""
+    stats = request_stats.get()
+    if stats is not None:
+        stats.session_time += time.perf_counter() - started
+
+
 # Dependency
 def get_db():
+    started = time.perf_counter()
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+        record_session_time(started)
+
+
+async def get_async_db():
+    started = time.perf_counter()
+    try:
+        async with AsyncSessionLocal() as db:
+            yield db
+    finally:
+        record_session_time(started)
+
+
+async def get_snapshot():
+    return snapshot.current()
+
+
+# The endpoints use the in-memory snapshot or the asyncio database layer if
+# either is turned on in database.py
+if USE_SNAPSHOT:
+    get_session = get_snapshot
+elif USE_ASYNC_DB:
+    get_session = get_async_db
+else:
+    get_session = get_db
+
+
+async def run_crud(crud_function, db, **kwargs):
+    """Calls a crud function using the configured database layer.
+
+    With the snapshot the matching function in snapshot.py answers from
+    memory. With the asyncio layer the matching function in async_crud is
+    awaited. Otherwise the crud function runs in the thread pool so it
+    doesn't block the event loop."""
+    if USE_SNAPSHOT:
+        return getattr(snapshot, crud_function.__name__)(db, **kwargs)
+    if USE_ASYNC_DB:
+        return await getattr(async_crud, crud_function.__name__)(db, **kwargs)
+    return await run_in_threadpool(crud_function, db, **kwargs)
+
+
+async def table_version(db, tables: tuple):
+    """Returns the (version, changed_at) of the tables, cached until the data changes"""
+    return await cache.table_version_cache.get_async(
+        tables, lambda: run_crud(crud.get_table_version, db, tables=tables)
+    )
+
+
+async def not_modified(request: Request, response: Response, db, tables: tuple):
+    """Adds the ETag and Last-Modified headers, and returns a 304 response if
+    the client's copy is still current.
+
+    The validators come from the versions of the tables behind the
+    response, which triggers bump on every write, including deletes. They
+    are cached until the data changes, so a 304 for a list is sent without
+    loading any rows. Call it after the parameters are checked, and after
+    a single resource is found, so a 304 is only sent in place of a 200."""
+    versions = await table_version(db, tables)
+    if versions is None:
+        return None
+    version, changed_at = versions
+    headers = {
+        "ETag": conditional.make_etag(
+            request.url.path, request.query_params.multi_items(), version, changed_at
+        ),
+        "Last-Modified": conditional.http_date(changed_at),
+    }
+    response.headers.update(headers)
+    if conditional.is_not_modified(
+        request.headers.get("if-none-match"),
+        request.headers.get("if-modified-since"),
+        headers["ETag"],
+        changed_at,
+    ):
+        return Response(status_code=304, headers=headers)
+    return None
+
+
+def rows_response(rows: list, schema, response: Response, fields: tuple = None):
+    """Sends a list of rows with the fast encoder, keeping any headers already set"""
+    return serialization.RowsResponse(rows, schema, headers=dict(response.headers), fields=fields)
+
+
+# Name of the response header that carries the cursor for the next page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+cursor_query = Query(
+    None,
+    description=f"Opaque cursor from the {NEXT_CURSOR_HEADER} header of the previous page. Use it in place of skip to page through large lists quickly.",
+)
+
+
+def fields_query(schema):
+    """Builds the fields query parameter for a list endpoint"""
+    return Query(
+        None,
+        description=f"Comma-separated names of the fields to return for each item, from: {', '.join(schema.model_fields)}. Leave it out to get every field. Nested lists are only loaded when they are named.",
+    )
+
+
+def read_fields(fields: str, schema):
+    """Parses the fields query parameter into a tuple in schema order"""
+    if fields is None:
+        return None
+    names = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = names - set(schema.model_fields)
+    if unknown or not names:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}" if unknown else "fields is empty",
+        )
+    return tuple(name for name in schema.model_fields if name in names)
+
+
+def read_cursor(cursor: str, minimum_last_changed_date: date):
+    """Decodes the cursor query parameter and checks it fits the request"""
+    if cursor is None:
+        return None
+    try:
+        key = pagination.decode_cursor(cursor)
+    except pagination.InvalidCursorError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if ("last_changed_date" in key) != (minimum_last_changed_date is not None):
+        raise HTTPException(
+            status_code=400,
+            detail="Cursor does not match minimum_last_changed_date",
+        )
+    return key
+
+
+def set_next_cursor(response: Response, rows: list, id_attr: str, limit: int, minimum_last_changed_date: date):
+    """Adds the cursor for the next page to the response headers if there is one"""
+    cursor = pagination.next_cursor(
+        rows, id_attr, minimum_last_changed_date is not None, limit
+    )
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
+
+
+# Most player ids one request can look up with the ids parameter
+MAX_PLAYER_IDS = 500
+
+# Most players one weekly leaderboard request returns
+MAX_LEADERBOARD_SIZE = 100
+
+# Name of the response header that carries the token for the next changes request
+CHANGE_TOKEN_HEADER = "X-Change-Token"
+
+# Most changes one changes feed request returns
+MAX_CHANGES_PAGE = 1000
+
+# Most players and characters of one player search
+MAX_SEARCH_RESULTS = 50
+MAX_SEARCH_LENGTH = 100
+
+
+def read_player_ids(ids: str):
+    """Parses the comma-separated ids query parameter"""
+    if ids is None:
+        return None
+    try:
+        player_ids = sorted({int(player_id) for player_id in ids.split(",") if player_id.strip()})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be comma-separated player ids")
+    if len(player_ids) > MAX_PLAYER_IDS:
+        raise HTTPException(
+            status_code=400, detail=f"ids can list at most {MAX_PLAYER_IDS} players"
+        )
+    return player_ids
 
 
 @app.get(
@@ -59,12 +343,14 @@ async def root():
     "/v0/players/",
     response_model=list[schemas.Player],
     summary="Get all the SWC players that meet all the parameters you sent with your request",
-    description="""Use this endpoint to get a list of SWC players. You can use the parameters to filter down the players in the list. Names are not unique. You use the skip and limit to perform pagination of the API. Don't use the Player ID values to perform counts. Those are not guaranteed to be in order.""",
+    description=f"""Use this endpoint to get a list of SWC players. You can use the parameters to filter down the players in the list. Names are not unique. You use the skip and limit to perform pagination of the API, or pass the cursor from the X-Next-Cursor header to get the next page. To get several players you already have the Player IDs for, such as the players on a team, send up to {MAX_PLAYER_IDS} of them in ids. Don't use the Player ID values to perform counts. Those are not guaranteed to be in order.""",
     response_description="A list of NFL players that are in SWC fantasy football. They don't to be on a team.",
     operation_id="v0_get_players",
     tags=["players"],
 )
-def read_players(
+async def read_players(
+    request: Request,
+    response: Response,
     skip: int = Query(
         0, description="The number of items to skip at the beginning of API call."
     ),
@@ -79,17 +365,65 @@ def read_players(
         None, description="The first name of the players to return"
     ),
     last_name: str = Query(None, description="The last name of the players to return"),
-    db: Session = Depends(get_db),
+    ids: str = Query(
+        None,
+        description=f"Comma-separated Player IDs of the players to return, up to {MAX_PLAYER_IDS}. Every player found is returned in one response, so skip, limit and cursor are ignored.",
+    ),
+    fields: str = fields_query(schemas.Player),
+    cursor: str = cursor_query,
+    db: Session = Depends(get_session),
 ):
-    players = crud.get_players(
+    player_ids = read_player_ids(ids)
+    field_names = read_fields(fields, schemas.Player)
+    if player_ids is not None:
+        skip, limit, cursor = 0, len(player_ids), None
+    cursor_key = read_cursor(cursor, minimum_last_changed_date)
+    unchanged = await not_modified(request, response, db, (models.Player, models.Performance))
+    if unchanged is not None:
+        return unchanged
+    players = await run_crud(
+        crud.get_players,
         db,
         skip=skip,
         limit=limit,
         min_last_changed_date=minimum_last_changed_date,
+        cursor=cursor_key,
+        fields=field_names,
         first_name=first_name,
         last_name=last_name,
+        player_ids=player_ids,
     )
-    return players
+    if player_ids is None:
+        set_next_cursor(response, players, "player_id", limit, minimum_last_changed_date)
+    return rows_response(players, schemas.Player, response, field_names)
+
+
+@app.get(
+    "/v0/players/search/",
+    response_model=list[schemas.PlayerSearchResult],
+    summary="Search for players by name",
+    description="""Use this endpoint to find players as a user types their name, instead of downloading every player from v0_get_players. With prefix matching, each word you send must start the player's first or last name, so "bry yo" finds Bryce Young. With fuzzy matching, names that are spelled a little differently are found too. The best matches come first, with a score from 0 to 1 for how close each name is to the query.""",
+    response_description="A list of players ranked by how well their names match the query.",
+    operation_id="v0_search_players",
+    tags=["players"],
+)
+async def search_players(
+    request: Request,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=MAX_SEARCH_LENGTH, description="The name, or the start of the name, to search for."),
+    match: Literal[search.MATCH_TYPES] = Query(
+        "prefix", description="Match the start of each name (prefix) or similar spellings (fuzzy)."
+    ),
+    limit: int = Query(
+        10, ge=1, le=MAX_SEARCH_RESULTS, description=f"The number of players to return, up to {MAX_SEARCH_RESULTS}."
+    ),
+    db: Session = Depends(get_session),
+):
+    unchanged = await not_modified(request, response, db, (models.Player,))
+    if unchanged is not None:
+        return unchanged
+    players = await run_crud(crud.search_players, db, query=q, match=match, limit=limit)
+    return rows_response(players, schemas.PlayerSearchResult, response)
 
 
 @app.get(
@@ -101,10 +435,18 @@ def read_players(
     operation_id="v0_get_players_by_player_id",
     tags=["players"],
 )
-def read_player(player_id: int, db: Session = Depends(get_db)):
-    player = crud.get_player(db, player_id=player_id)
+async def read_player(
+    player_id: int,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_session),
+):
+    player = await run_crud(crud.get_player, db, player_id=player_id)
     if player is None:
         raise HTTPException(status_code=404, detail="Player not found")
+    unchanged = await not_modified(request, response, db, (models.Player, models.Performance))
+    if unchanged is not None:
+        return unchanged
     return player
 
 
@@ -112,12 +454,14 @@ def read_player(player_id: int, db: Session = Depends(get_db)):
     "/v0/performances/",
     response_model=list[schemas.Performance],
     summary="Get all the weekly performances that meet all the parameters you sent with your request",
-    description="""Use this endpoint to get lists of weekly performances by players in the SWC. You us the skip and limit to perform pagination of the API. Don't use the Performance ID for counting or logic, because that is an internal ID and is not guaranteed to be sequential""",
+    description="""Use this endpoint to get lists of weekly performances by players in the SWC. Send a season, and a range of weeks in it with week_from and week_to, to get only those weeks. You us the skip and limit to perform pagination of the API, or pass the cursor from the X-Next-Cursor header to get the next page. Don't use the Performance ID for counting or logic, because that is an internal ID and is not guaranteed to be sequential""",
     response_description="A list of weekly scoring performances. It may be by multiple players.",
     operation_id="v0_get_performances",
     tags=["scoring"],
 )
-def read_performances(
+async def read_performances(
+    request: Request,
+    response: Response,
     skip: int = Query(
         0, description="The number of items to skip at the beginning of API call."
     ),
@@ -128,12 +472,207 @@ def read_performances(
         None,
         description="The minimum data of change that you want to return records. Exclude any records changed before this.",
     ),
-    db: Session = Depends(get_db),
+    season: int = Query(None, description="The season of the performances to return, such as 2023."),
+    week_from: int = Query(
+        None, ge=1, description="The first week of the season to return performances for. Requires season."
+    ),
+    week_to: int = Query(
+        None, ge=1, description="The last week of the season to return performances for. Requires season."
+    ),
+    fields: str = fields_query(schemas.Performance),
+    cursor: str = cursor_query,
+    db: Session = Depends(get_session),
+):
+    field_names = read_fields(fields, schemas.Performance)
+    if (week_from or week_to) and not season:
+        raise HTTPException(status_code=400, detail="week_from and week_to require a season")
+    cursor_key = read_cursor(cursor, minimum_last_changed_date)
+    unchanged = await not_modified(request, response, db, (models.Performance,))
+    if unchanged is not None:
+        return unchanged
+    performances = await run_crud(
+        crud.get_performances,
+        db,
+        skip=skip,
+        limit=limit,
+        min_last_changed_date=minimum_last_changed_date,
+        cursor=cursor_key,
+        fields=field_names,
+        season=season,
+        week_from=week_from,
+        week_to=week_to,
+    )
+    set_next_cursor(response, performances, "performance_id", limit, minimum_last_changed_date)
+    return rows_response(performances, schemas.Performance, response, field_names)
+
+
+def performance_lines(minimum_last_changed_date: date):
+    """Yields the performances as NDJSON from a database cursor.
+
+    The stream opens its own session, because the request's session is
+    closed before the response body is sent."""
+    with SessionLocal() as db:
+        for batch in crud.stream_performances(
+            db, min_last_changed_date=minimum_last_changed_date
+        ):
+            yield serialization.ndjson_lines(batch)
+
+
+async def async_performance_lines(minimum_last_changed_date: date):
+    """Same as performance_lines, using the asyncio database layer"""
+    async with AsyncSessionLocal() as db:
+        async for batch in async_crud.stream_performances(
+            db, min_last_changed_date=minimum_last_changed_date
+        ):
+            yield serialization.ndjson_lines(batch)
+
+
+@app.get(
+    "/v0/performances/export",
+    response_class=StreamingResponse,
+    summary="Stream every weekly performance that meets the parameters as newline-delimited JSON",
+    description="""Use this endpoint to download all the weekly performances in one call instead of paging through v0_get_performances. Each line of the response is one performance in the same format as v0_get_performances. Use minimum_last_changed_date to only get performances that changed since your last download.""",
+    response_description="Newline-delimited JSON (NDJSON) with one weekly scoring performance per line.",
+    operation_id="v0_export_performances",
+    tags=["scoring"],
+)
+async def export_performances(
+    minimum_last_changed_date: date = Query(
+        None,
+        description="The minimum data of change that you want to return records. Exclude any records changed before this.",
+    ),
 ):
-    performances = crud.get_performances(
-        db, skip=skip, limit=limit, min_last_changed_date=minimum_last_changed_date
+    if USE_ASYNC_DB:
+        lines = async_performance_lines(minimum_last_changed_date)
+    else:
+        lines = performance_lines(minimum_last_changed_date)
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+
+@app.get(
+    "/v0/season_scores/",
+    response_model=list[schemas.SeasonScore],
+    summary="Get each player's fantasy points totals for a season",
+    description="""Use this endpoint to get the total, average, and highest weekly fantasy points and the games played for each player and season, instead of adding up the weekly performances from v0_get_performances. Filter by season, player, or position, and sort by any of the totals. You use the skip and limit to perform pagination of the API.""",
+    response_description="A list of season totals, one for each player and season.",
+    operation_id="v0_get_season_scores",
+    tags=["scoring"],
+)
+async def read_season_scores(
+    request: Request,
+    response: Response,
+    skip: int = Query(
+        0, description="The number of items to skip at the beginning of API call."
+    ),
+    limit: int = Query(
+        100, description="The number of records to return after the skipped records."
+    ),
+    season: int = Query(None, description="The season to return totals for, such as 2023."),
+    player_id: int = Query(None, description="The Player ID to return totals for."),
+    position: str = Query(None, description="The position of the players to return, such as QB or WR."),
+    minimum_games_played: int = Query(
+        None, description="Exclude players who played fewer games than this in the season."
+    ),
+    sort_by: Literal[crud.SEASON_SCORE_SORTS] = Query(
+        "total_points", description="The total to sort the list by."
+    ),
+    sort_order: Literal["desc", "asc"] = Query(
+        "desc", description="Sort from highest to lowest (desc) or lowest to highest (asc)."
+    ),
+    db: Session = Depends(get_session),
+):
+    unchanged = await not_modified(request, response, db, (models.PlayerSeasonScore,))
+    if unchanged is not None:
+        return unchanged
+    season_scores = await run_crud(
+        crud.get_season_scores,
+        db,
+        skip=skip,
+        limit=limit,
+        season=season,
+        player_id=player_id,
+        position=position,
+        min_games_played=minimum_games_played,
+        sort_by=sort_by,
+        descending=sort_order == "desc",
     )
-    return performances
+    return rows_response(season_scores, schemas.SeasonScore, response)
+
+
+@app.get(
+    "/v0/leaderboards/weekly/",
+    response_model=list[schemas.LeaderboardEntry],
+    summary="Get the top scoring players of one week",
+    description="""Use this endpoint to get the players with the most fantasy points in one week, in rank order. Send a position to rank only the players at that position. Players with the same points are ranked by Player ID. The rankings are computed ahead of time, so this endpoint stays fast on game days.""",
+    response_description="A list of players ranked by fantasy points for the week.",
+    operation_id="v0_get_weekly_leaderboard",
+    tags=["scoring"],
+)
+async def read_weekly_leaderboard(
+    request: Request,
+    response: Response,
+    season: int = Query(..., description="The season of the week, such as 2023."),
+    week: int = Query(..., description="The week number in the season, starting at 1."),
+    position: str = Query(
+        None, description="Only rank players at this position, such as QB or WR."
+    ),
+    limit: int = Query(
+        10, ge=1, le=MAX_LEADERBOARD_SIZE, description=f"The number of players to return, up to {MAX_LEADERBOARD_SIZE}."
+    ),
+    db: Session = Depends(get_session),
+):
+    unchanged = await not_modified(request, response, db, (models.WeeklyLeaderboard,))
+    if unchanged is not None:
+        return unchanged
+    entries = await run_crud(
+        crud.get_weekly_leaderboard,
+        db,
+        season=season,
+        week=week,
+        position=position,
+        limit=limit,
+    )
+    return rows_response(entries, schemas.LeaderboardEntry, response)
+
+
+@app.get(
+    "/v0/team_scores/",
+    response_model=list[schemas.TeamWeekScore],
+    summary="Get the fantasy points each team scored in a week",
+    description="""Use this endpoint to get the total fantasy points of each team's players for each week, instead of adding up the performances of every player on a team. Filter by league to get the weekly standings of a league, or by team to follow one team through the season. Within a week, the highest scoring team comes first. You use the skip and limit to perform pagination of the API.""",
+    response_description="A list of weekly totals, one for each team and week.",
+    operation_id="v0_get_team_scores",
+    tags=["scoring"],
+)
+async def read_team_scores(
+    request: Request,
+    response: Response,
+    skip: int = Query(
+        0, description="The number of items to skip at the beginning of API call."
+    ),
+    limit: int = Query(
+        100, description="The number of records to return after the skipped records."
+    ),
+    league_id: int = Query(None, description="The League ID of the teams to return."),
+    team_id: int = Query(None, description="The Team ID to return totals for."),
+    season: int = Query(None, description="The season to return totals for, such as 2023."),
+    week: int = Query(None, description="The week number in the season, starting at 1."),
+    db: Session = Depends(get_session),
+):
+    unchanged = await not_modified(request, response, db, (models.TeamWeekScore,))
+    if unchanged is not None:
+        return unchanged
+    team_scores = await run_crud(
+        crud.get_team_week_scores,
+        db,
+        skip=skip,
+        limit=limit,
+        league_id=league_id,
+        team_id=team_id,
+        season=season,
+        week=week,
+    )
+    return rows_response(team_scores, schemas.TeamWeekScore, response)
 
 
 @app.get(
@@ -145,10 +684,18 @@ def read_performances(
     operation_id="v0_get_league_by_league_id",
     tags=["membership"],
 )
-def read_league(league_id: int, db: Session = Depends(get_db)):
-    league = crud.get_league(db, league_id=league_id)
+async def read_league(
+    league_id: int,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_session),
+):
+    league = await run_crud(crud.get_league, db, league_id=league_id)
     if league is None:
         raise HTTPException(status_code=404, detail="League not found")
+    unchanged = await not_modified(request, response, db, (models.League, models.Team))
+    if unchanged is not None:
+        return unchanged
     return league
 
 
@@ -156,12 +703,14 @@ def read_league(league_id: int, db: Session = Depends(get_db)):
     "/v0/leagues/",
     response_model=list[schemas.League],
     summary="Get all the SWC fantasy football leagues that match the parameters you send",
-    description="""Use this endpoint to get lists of SWC fantasy football leagues. You us the skip and limit to perform pagination of the API. League name is not guaranteed to be unique. Don't use the League ID for counting or logic, because that is an internal ID and is not guaranteed to be sequential""",
+    description="""Use this endpoint to get lists of SWC fantasy football leagues. You us the skip and limit to perform pagination of the API, or pass the cursor from the X-Next-Cursor header to get the next page. League name is not guaranteed to be unique. Don't use the League ID for counting or logic, because that is an internal ID and is not guaranteed to be sequential""",
     response_description="A list of leagues on the SWC fantasy football website.",
     operation_id="v0_get_leagues",
     tags=["membership"],
 )
-def read_leagues(
+async def read_leagues(
+    request: Request,
+    response: Response,
     skip: int = Query(
         0, description="The number of items to skip at the beginning of API call."
     ),
@@ -175,28 +724,41 @@ def read_leagues(
     league_name: str = Query(
         None, description="Name of the leagues to return. Not unique in the SWC."
     ),
-    db: Session = Depends(get_db),
+    fields: str = fields_query(schemas.League),
+    cursor: str = cursor_query,
+    db: Session = Depends(get_session),
 ):
-    leagues = crud.get_leagues(
+    field_names = read_fields(fields, schemas.League)
+    cursor_key = read_cursor(cursor, minimum_last_changed_date)
+    unchanged = await not_modified(request, response, db, (models.League, models.Team))
+    if unchanged is not None:
+        return unchanged
+    leagues = await run_crud(
+        crud.get_leagues,
         db,
         skip=skip,
         limit=limit,
         min_last_changed_date=minimum_last_changed_date,
+        cursor=cursor_key,
+        fields=field_names,
         league_name=league_name,
     )
-    return leagues
+    set_next_cursor(response, leagues, "league_id", limit, minimum_last_changed_date)
+    return rows_response(leagues, schemas.League, response, field_names)
 
 
 @app.get(
     "/v0/teams/",
     response_model=list[schemas.Team],
     summary="Get all the SWC fantasy football teams that match the parameters you send",
-    description="""Use this endpoint to get lists of SWC fantasy football teams. You us the skip and limit to perform pagination of the API. Team name is not guaranteed to be unique. If you get the Team ID from another query such as v0_get_players, you can match it with the Team ID from this query.  Don't use the Team ID for counting or logic, because that is an internal ID and is not guaranteed to be sequential""",
+    description="""Use this endpoint to get lists of SWC fantasy football teams. You us the skip and limit to perform pagination of the API, or pass the cursor from the X-Next-Cursor header to get the next page. Team name is not guaranteed to be unique. If you get the Team ID from another query such as v0_get_players, you can match it with the Team ID from this query.  Don't use the Team ID for counting or logic, because that is an internal ID and is not guaranteed to be sequential""",
     response_description="A list of teams on the SWC fantasy football website.",
     operation_id="v0_get_teams",
     tags=["membership"],
 )
-def read_teams(
+async def read_teams(
+    request: Request,
+    response: Response,
     skip: int = Query(
         0, description="The number of items to skip at the beginning of API call."
     ),
@@ -214,17 +776,92 @@ def read_teams(
     league_id: int = Query(
         None, description="League ID of the teams to return. Unique in SWC."
     ),
-    db: Session = Depends(get_db),
+    fields: str = fields_query(schemas.Team),
+    cursor: str = cursor_query,
+    db: Session = Depends(get_session),
 ):
-    teams = crud.get_teams(
+    field_names = read_fields(fields, schemas.Team)
+    cursor_key = read_cursor(cursor, minimum_last_changed_date)
+    unchanged = await not_modified(request, response, db, (models.Team, models.TeamPlayer, models.Player))
+    if unchanged is not None:
+        return unchanged
+    teams = await run_crud(
+        crud.get_teams,
         db,
         skip=skip,
         limit=limit,
         min_last_changed_date=minimum_last_changed_date,
+        cursor=cursor_key,
+        fields=field_names,
         team_name=team_name,
         league_id=league_id,
     )
-    return teams
+    set_next_cursor(response, teams, "team_id", limit, minimum_last_changed_date)
+    return rows_response(teams, schemas.Team, response, field_names)
+
+
+@app.get(
+    "/v0/changes/",
+    response_model=list[schemas.Change],
+    summary="Get every league, team, team player, player, and performance changed since your last sync",
+    description=f"""Use this endpoint to keep a copy of the SWC data in sync with one call, instead of paging through each list endpoint with minimum_last_changed_date. Each change has a change_id, which only goes up. Send 0 in since to get every row, then send the {CHANGE_TOKEN_HEADER} header of each response in since to get only what changed after it. A row that changed more than once is returned once, with its latest change. The operation is upsert, with the row as it is now in the field named after the entity, or delete, with only the key of the row. When fewer changes than the limit come back, you are in sync.""",
+    response_description="A list of changes in change_id order.",
+    operation_id="v0_get_changes",
+    tags=["analytics"],
+)
+async def read_changes(
+    response: Response,
+    since: int = Query(
+        0, ge=0, description=f"The change token from the {CHANGE_TOKEN_HEADER} header of your last sync, or 0 for every row."
+    ),
+    limit: int = Query(
+        500, ge=1, le=MAX_CHANGES_PAGE, description=f"The number of changes to return, up to {MAX_CHANGES_PAGE}."
+    ),
+    db: Session = Depends(get_session),
+):
+    entries = await run_crud(crud.get_changes, db, since=since, limit=limit)
+    response.headers[CHANGE_TOKEN_HEADER] = str(entries[-1].change_id if entries else since)
+    return rows_response(entries, schemas.Change, response)
+
+
+@app.get(
+    "/v0/bulk/{table_name}",
+    response_class=Response,
+    responses={
+        200: {"content": {media_type: {} for media_type in bulk.MEDIA_TYPES.values()}}
+    },
+    summary="Get a bulk file with every row of one SWC table",
+    description="""Use this endpoint to download a whole table in a columnar format for analytics. The file is built from the live database, so it always matches the other endpoints. Use the arrow format for an Apache Arrow IPC stream or the parquet format for a Parquet file.""",
+    response_description="An Arrow IPC stream or Parquet file with every row of the table.",
+    operation_id="v0_get_bulk_file",
+    tags=["analytics"],
+)
+async def read_bulk_file(
+    table_name: Literal["players", "performances", "leagues", "teams", "team_players"],
+    request: Request,
+    response: Response,
+    file_format: Literal["arrow", "parquet"] = Query(
+        "parquet", description="The file format to return: arrow or parquet."
+    ),
+    db: Session = Depends(get_session),
+):
+    if not bulk.is_available():
+        raise HTTPException(status_code=501, detail="Bulk files are not available on this server")
+    model = bulk.TABLES[table_name]
+    unchanged = await not_modified(request, response, db, (model,))
+    if unchanged is not None:
+        return unchanged
+
+    async def build_file():
+        rows = await run_crud(crud.get_table_rows, db, model=model)
+        table = await run_in_threadpool(bulk.build_table, model, rows)
+        return await run_in_threadpool(bulk.encode, table, file_format)
+
+    content = await bulk.bulk_file_cache.get_async((table_name, file_format), build_file)
+    file_name = f"{table_name}.{bulk.FILE_EXTENSIONS[file_format]}"
+    headers = dict(response.headers)
+    headers["Content-Disposition"] = f'attachment; filename="{file_name}"'
+    return Response(content, media_type=bulk.MEDIA_TYPES[file_format], headers=headers)
 
 
 @app.get(
@@ -236,10 +873,14 @@ def read_teams(
     operation_id="v0_get_counts",
     tags=["analytics"],
 )
-def get_count(db: Session = Depends(get_db)):
-    counts = schemas.Counts(
-        league_count=crud.get_league_count(db),
-        team_count=crud.get_team_count(db),
-        player_count=crud.get_player_count(db),
+async def get_count(db: Session = Depends(get_session)):
+    counts = await cache.counts_cache.get_async(
+        "counts", lambda: run_crud(crud.get_counts, db)
     )
-    return counts
+    return schemas.Counts(**counts)
+
+
+@app.get("/metrics", include_in_schema=False, operation_id="metrics")
+async def read_metrics():
+    """Request and database metrics in the Prometheus text format"""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
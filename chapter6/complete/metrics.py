@@ -0,0 +1,92 @@
+"""Request and database metrics in the Prometheus text format
+
+The counters, gauges and histograms that the middleware in main.py updates
+on every request, and that the /metrics endpoint renders in the Prometheus
+text exposition format, using prometheus_client.
+
+Under Gunicorn the workers share their numbers: gunicorn_conf.py sets
+PROMETHEUS_MULTIPROC_DIR, every worker writes its metrics to files in that
+directory, and /metrics adds up the files of all the workers, so any worker
+answers a scrape with the totals. Without the variable, as in a single
+Uvicorn process or the tests, the metrics stay in memory."""
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Directory the workers share their metrics in, when running under Gunicorn
+MULTIPROCESS_DIR_VARIABLE = "PROMETHEUS_MULTIPROC_DIR"
+
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+# The API's own metrics, without the process metrics of the default registry
+REGISTRY = CollectorRegistry()
+
+requests_total = Counter(
+    "swc_http_requests_total",
+    "HTTP requests served, by operation, method and status code.",
+    ("operation_id", "method", "status"),
+    registry=REGISTRY,
+)
+request_duration = Histogram(
+    "swc_http_request_duration_seconds",
+    "Time to send the response headers, by operation.",
+    ("operation_id",),
+    registry=REGISTRY,
+)
+response_size = Histogram(
+    "swc_http_response_size_bytes",
+    "Size of the response bodies that had a Content-Length, by operation.",
+    ("operation_id",),
+    buckets=SIZE_BUCKETS,
+    registry=REGISTRY,
+)
+requests_in_flight = Gauge(
+    "swc_http_requests_in_flight",
+    "Requests being handled right now.",
+    multiprocess_mode="livesum",
+    registry=REGISTRY,
+)
+db_statements = Histogram(
+    "swc_db_statements_per_request",
+    "SQL statements each request ran, by operation.",
+    ("operation_id",),
+    buckets=STATEMENT_BUCKETS,
+    registry=REGISTRY,
+)
+db_statements_total = Counter(
+    "swc_db_statements_total",
+    "SQL statements run while handling requests, by operation.",
+    ("operation_id",),
+    registry=REGISTRY,
+)
+db_time = Histogram(
+    "swc_db_time_per_request_seconds",
+    "Time each request spent running SQL statements, by operation.",
+    ("operation_id",),
+    registry=REGISTRY,
+)
+
+
+def is_multiprocess() -> bool:
+    return bool(os.environ.get(MULTIPROCESS_DIR_VARIABLE))
+
+
+def render() -> bytes:
+    """Returns every metric in the Prometheus text format, added up across
+    the workers when they share a metrics directory"""
+    if is_multiprocess():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
@@ -0,0 +1,144 @@
+"""Database migrations
+
+Brings an existing fantasy_data.db up to date with the SQLAlchemy models.
+Every step checks what is already in the database first, so it is safe to
+run the migrations more than once.
+
+Typical usage example:
+
+    python migrate.py
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.orm import Session
+
+from database import Base, engine
+import changes
+import models  # noqa: F401 - registers the tables on Base.metadata
+import scoring
+import search
+import table_versions
+
+
+def is_rowid_index(index) -> bool:
+    """Checks if an index only covers the integer primary key of its table.
+
+    SQLite stores these tables in primary key order already, so an extra
+    index on that column only takes up space."""
+    primary_key = list(index.table.primary_key.columns)
+    return len(primary_key) == 1 and list(index.columns) == primary_key
+
+
+def create_tables(target_engine: Engine) -> list:
+    """Creates any table declared on the models that the database is missing"""
+    created = []
+    inspector = inspect(target_engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            table.create(target_engine)
+            created.append(table.name)
+    return created
+
+
+def add_columns(target_engine: Engine) -> list:
+    """Adds any column declared on the models that an existing table is missing.
+
+    Computed columns are added as virtual generated columns, so SQLite
+    derives their values for the rows already in the table."""
+    added = []
+    inspector = inspect(target_engine)
+    with target_engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    definition = CreateColumn(column).compile(dialect=target_engine.dialect)
+                    connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {definition}"))
+                    added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def create_indexes(target_engine: Engine) -> list:
+    """Creates any index declared on the models that the database is missing"""
+    created = []
+    inspector = inspect(target_engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing and not is_rowid_index(index):
+                index.create(target_engine)
+                created.append(index.name)
+    return created
+
+
+def create_search_index(target_engine: Engine) -> list:
+    """Creates the player name search index and the triggers that keep it in sync"""
+    return search.create_search_index(target_engine)
+
+
+def create_change_log(target_engine: Engine) -> list:
+    """Creates the triggers that log changes for the changes feed"""
+    return changes.create_change_log(target_engine)
+
+
+def create_table_versions(target_engine: Engine) -> list:
+    """Creates the triggers that keep the table versions behind the ETags"""
+    return table_versions.create_table_versions(target_engine)
+
+
+def create_scoring_triggers(target_engine: Engine) -> list:
+    """Creates the triggers that record the old groups of deleted and moved rows for the scoring refreshes"""
+    return scoring.create_scoring_triggers(target_engine)
+
+
+def refresh_aggregates(target_engine: Engine) -> dict:
+    """Brings the materialized scoring tables up to date with the data"""
+    with Session(target_engine) as db:
+        return scoring.refresh_all(db)
+
+
+def restore_rollback_journal(target_engine: Engine) -> str:
+    """Moves the write-ahead log into the file and switches it back to the
+    rollback journal.
+
+    journal_mode is stored in the file, and database.py sets WAL on every
+    connection that can write, migrations included. Switching back keeps the
+    migrated file in rollback mode, so it can be opened read-only and
+    immutable, as in the Docker image. The server turns WAL on again when it
+    opens the file for writing."""
+    # Pooled connections keep the log open, and the mode only changes
+    # when this is the last one
+    target_engine.dispose()
+    with target_engine.connect() as connection:
+        connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        return connection.exec_driver_sql("PRAGMA journal_mode=DELETE").scalar()
+
+
+def run_migrations(target_engine: Engine = engine):
+    """Runs every migration step in order"""
+    for table_name in create_tables(target_engine):
+        print(f"Created table {table_name}")
+    for column_name in add_columns(target_engine):
+        print(f"Added column {column_name}")
+    for index_name in create_indexes(target_engine):
+        print(f"Created index {index_name}")
+    for name in create_search_index(target_engine):
+        print(f"Created {name}")
+    for name in create_change_log(target_engine):
+        print(f"Created {name}")
+    for name in create_table_versions(target_engine):
+        print(f"Created {name}")
+    for name in create_scoring_triggers(target_engine):
+        print(f"Created {name}")
+    for table_name, written in refresh_aggregates(target_engine).items():
+        print(f"Refreshed {written} rows of {table_name}")
+    print(f"Journal mode {restore_rollback_journal(target_engine)}")
+
+
+if __name__ == "__main__":
+    run_migrations()
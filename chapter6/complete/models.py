@@ -1,5 +1,5 @@
 """SQLAlchemy models"""
-from sqlalchemy import Column, ForeignKey, Integer, String, Float, Date
+from sqlalchemy import Column, Computed, ForeignKey, Index, Integer, String, Float, Date, DateTime, text
 from sqlalchemy.orm import relationship
 
 from database import Base
@@ -7,13 +7,20 @@ from database import Base
 
 class Player(Base):
     __tablename__ = "player"
+    __table_args__ = (
+        Index("ix_player_last_name_first_name", "last_name", "first_name"),
+        # Case-insensitive, so LIKE 'br%' in search.py can search them for
+        # words too short for the trigram index
+        Index("ix_player_first_name_nocase", text("first_name COLLATE NOCASE")),
+        Index("ix_player_last_name_nocase", text("last_name COLLATE NOCASE")),
+    )
 
     player_id = Column(Integer, primary_key=True, index=True)
     gsis_id = Column(String, nullable=True)
-    first_name = Column(String, nullable=False)
+    first_name = Column(String, nullable=False, index=True)
     last_name = Column(String, nullable=False)
     position = Column(String, nullable=False)
-    last_changed_date = Column(Date, nullable=False)
+    last_changed_date = Column(Date, nullable=False, index=True)
 
     performances = relationship("Performance", back_populates="player")
 
@@ -24,13 +31,19 @@ class Player(Base):
 
 class Performance(Base):
     __tablename__ = "performance"
+    __table_args__ = (
+        Index("ix_performance_season_week", "season", "week"),
+    )
 
     performance_id = Column(Integer, primary_key=True, index=True)
     week_number = Column(String, nullable=False)
+    # The season and week in a week_number like 2023_1, computed by SQLite
+    season = Column(Integer, Computed("CAST(substr(week_number, 1, instr(week_number, '_') - 1) AS INTEGER)"))
+    week = Column(Integer, Computed("CAST(substr(week_number, instr(week_number, '_') + 1) AS INTEGER)"))
     fantasy_points = Column(Float, nullable=False)
-    last_changed_date = Column(Date, nullable=False)
+    last_changed_date = Column(Date, nullable=False, index=True)
 
-    player_id = Column(Integer, ForeignKey("player.player_id"))
+    player_id = Column(Integer, ForeignKey("player.player_id"), index=True)
 
     player = relationship("Player", back_populates="performances")
 
@@ -39,19 +52,22 @@ class League(Base):
     __tablename__ = "league"
 
     league_id = Column(Integer, primary_key=True, index=True)
-    league_name = Column(String, nullable=False)
+    league_name = Column(String, nullable=False, index=True)
     scoring_type = Column(String, nullable=False)
-    last_changed_date = Column(Date, nullable=False)
+    last_changed_date = Column(Date, nullable=False, index=True)
 
     teams = relationship("Team", back_populates="league")
 
 
 class Team(Base):
     __tablename__ = "team"
+    __table_args__ = (
+        Index("ix_team_league_id_team_name", "league_id", "team_name"),
+    )
 
     team_id = Column(Integer, primary_key=True, index=True)
-    team_name = Column(String, nullable=False)
-    last_changed_date = Column(Date, nullable=False)    
+    team_name = Column(String, nullable=False, index=True)
+    last_changed_date = Column(Date, nullable=False, index=True)
 
     league_id = Column(Integer, ForeignKey("league.league_id"))
 
@@ -65,3 +81,112 @@ class TeamPlayer(Base):
     team_id = Column(Integer, ForeignKey("team.team_id"), primary_key=True, index=True)
     player_id = Column(Integer, ForeignKey("player.player_id"), primary_key=True, index=True)
     last_changed_date = Column(Date, nullable=False)    
+
+
+class PlayerSeasonScore(Base):
+    """Season totals for each player, built from the performance table by scoring.py"""
+    __tablename__ = "player_season_score"
+    __table_args__ = (
+        Index("ix_player_season_score_season_total_points", "season", "total_points"),
+    )
+
+    player_id = Column(Integer, ForeignKey("player.player_id"), primary_key=True)
+    season = Column(Integer, primary_key=True)
+    games_played = Column(Integer, nullable=False)
+    total_points = Column(Float, nullable=False)
+    average_points = Column(Float, nullable=False)
+    max_points = Column(Float, nullable=False)
+    last_changed_date = Column(Date, nullable=False, index=True)
+
+
+class TeamWeekScore(Base):
+    """The fantasy points each team's players scored in a week, built by scoring.py"""
+    __tablename__ = "team_week_score"
+    __table_args__ = (
+        Index("ix_team_week_score_league_id_season_week", "league_id", "season", "week"),
+    )
+
+    team_id = Column(Integer, ForeignKey("team.team_id"), primary_key=True)
+    season = Column(Integer, primary_key=True)
+    week = Column(Integer, primary_key=True)
+    league_id = Column(Integer, ForeignKey("league.league_id"), nullable=False)
+    total_points = Column(Float, nullable=False)
+    players_scored = Column(Integer, nullable=False)
+    last_changed_date = Column(Date, nullable=False, index=True)
+
+
+# Board of the weekly leaderboard that ranks every position together
+ALL_POSITIONS = "ALL"
+
+
+class WeeklyLeaderboard(Base):
+    """The players of each week ranked by fantasy points, built by scoring.py.
+
+    board is ALL for every player, or a position for the players at that
+    position, so the top players of any board are the first rows of an
+    index range. The table is stored in primary key order (WITHOUT ROWID),
+    so those rows sit next to each other on disk."""
+    __tablename__ = "weekly_leaderboard"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    season = Column(Integer, primary_key=True)
+    week = Column(Integer, primary_key=True)
+    board = Column(String, primary_key=True)
+    rank = Column(Integer, primary_key=True)
+    player_id = Column(Integer, ForeignKey("player.player_id"), nullable=False)
+    first_name = Column(String, nullable=False)
+    last_name = Column(String, nullable=False)
+    position = Column(String, nullable=False)
+    fantasy_points = Column(Float, nullable=False)
+    last_changed_date = Column(Date, nullable=False, index=True)
+
+
+class AggregateRefresh(Base):
+    """The newest last_changed_date each table in scoring.py has been
+    refreshed from, and the last scoring_change row it has read"""
+    __tablename__ = "aggregate_refresh"
+
+    aggregate_name = Column(String, primary_key=True)
+    refreshed_through = Column(Date, nullable=False)
+    scoring_change_id = Column(Integer, nullable=True)
+
+
+class ScoringChange(Base):
+    """A group that a row left when it was deleted, or left or joined when
+    it was moved, written by the triggers from scoring.py. Those groups
+    can't be found by last_changed_date, so the refreshes read them here."""
+    __tablename__ = "scoring_change"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    change_id = Column(Integer, primary_key=True)
+    table_name = Column(String, nullable=False)
+    player_id = Column(Integer, nullable=False)
+    season = Column(Integer, nullable=True)
+    week = Column(Integer, nullable=True)
+    team_id = Column(Integer, nullable=True)
+
+
+class ChangeLog(Base):
+    """The latest insert, update or delete of each row of the tables in the
+    changes feed, written by the triggers from changes.py. The triggers find
+    the earlier entry of a row to delete with ix_change_log_table_name_row_key."""
+    __tablename__ = "change_log"
+    __table_args__ = (
+        Index("ix_change_log_table_name_row_key", "table_name", "row_key"),
+        {"sqlite_autoincrement": True},
+    )
+
+    change_id = Column(Integer, primary_key=True)
+    table_name = Column(String, nullable=False)
+    operation = Column(String, nullable=False)
+    row_key = Column(String, nullable=False)
+
+
+class TableVersion(Base):
+    """A counter for each table served with an ETag, bumped by the triggers
+    from table_versions.py on every insert, update and delete"""
+    __tablename__ = "table_version"
+
+    table_name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False)
+    changed_at = Column(DateTime, nullable=False)
@@ -0,0 +1,41 @@
+"""Keyset pagination helpers"""
+import base64
+import json
+from datetime import date
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a cursor can't be decoded or doesn't match the request"""
+
+
+def encode_cursor(last_id: int, last_changed_date: date = None) -> str:
+    """Builds an opaque cursor from the key of the last row on a page"""
+    key = {"id": last_id}
+    if last_changed_date is not None:
+        key["last_changed_date"] = last_changed_date.isoformat()
+    payload = json.dumps(key, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    """Turns a cursor back into the key of the last row on the previous page"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        decoded = {"id": int(key["id"])}
+        if "last_changed_date" in key:
+            decoded["last_changed_date"] = date.fromisoformat(
+                key["last_changed_date"]
+            )
+        return decoded
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursorError("Invalid cursor") from e
+
+
+def next_cursor(rows: list, id_attr: str, by_date: bool, limit: int):
+    """Returns the cursor for the page after rows, or None on the last page"""
+    if limit <= 0 or len(rows) < limit:
+        return None
+    last_row = rows[-1]
+    last_changed_date = last_row.last_changed_date if by_date else None
+    return encode_cursor(getattr(last_row, id_attr), last_changed_date)
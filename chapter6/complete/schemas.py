@@ -1,6 +1,6 @@
 """Pydantic schemas"""
 from pydantic import BaseModel, ConfigDict
-from typing import List
+from typing import Dict, List, Optional
 from datetime import date
 
 
@@ -9,6 +9,8 @@ class Performance(BaseModel):
     performance_id : int
     player_id : int
     week_number : str
+    season : int
+    week : int
     fantasy_points : float
     last_changed_date : date
         
@@ -23,6 +25,10 @@ class PlayerBase(BaseModel):
     position : str
     last_changed_date : date
 
+class PlayerSearchResult(PlayerBase):
+    model_config = ConfigDict(from_attributes = True)
+    score : float
+
 class Player(PlayerBase):
     model_config = ConfigDict(from_attributes = True)
     performances: List[Performance] = []
@@ -40,15 +46,65 @@ class Team(TeamBase):
     players: List[PlayerBase] = []
 
 
-class League(BaseModel):
+class LeagueBase(BaseModel):
     model_config = ConfigDict(from_attributes = True)
     league_id : int
     league_name : str
     scoring_type : str
     last_changed_date : date
+
+class League(LeagueBase):
+    model_config = ConfigDict(from_attributes = True)
     teams: List[TeamBase] = []
 
+class TeamPlayer(BaseModel):
+    model_config = ConfigDict(from_attributes = True)
+    team_id : int
+    player_id : int
+    last_changed_date : date
+
 class Counts(BaseModel):
     league_count : int
     team_count : int
     player_count : int
+
+class SeasonScore(BaseModel):
+    model_config = ConfigDict(from_attributes = True)
+    player_id : int
+    season : int
+    games_played : int
+    total_points : float
+    average_points : float
+    max_points : float
+    last_changed_date : date
+
+class LeaderboardEntry(BaseModel):
+    model_config = ConfigDict(from_attributes = True)
+    rank : int
+    player_id : int
+    first_name : str
+    last_name : str
+    position : str
+    fantasy_points : float
+
+class TeamWeekScore(BaseModel):
+    model_config = ConfigDict(from_attributes = True)
+    team_id : int
+    league_id : int
+    season : int
+    week : int
+    total_points : float
+    players_scored : int
+    last_changed_date : date
+
+class Change(BaseModel):
+    model_config = ConfigDict(from_attributes = True)
+    change_id : int
+    entity : str
+    operation : str
+    key : Dict[str, int]
+    league : Optional[LeagueBase] = None
+    team : Optional[TeamBase] = None
+    team_player : Optional[TeamPlayer] = None
+    player : Optional[PlayerBase] = None
+    performance : Optional[Performance] = None
@@ -0,0 +1,373 @@
+"""Materialized scoring tables
+
+The scoring endpoints read totals that are built from the performance table
+ahead of time, instead of adding up performances on every request. Each
+refresh only recomputes the groups that have a performance with a
+last_changed_date on or after the previous refresh, so the tables never
+need to be rebuilt from scratch.
+
+The newest last_changed_date read by a refresh is stored in the
+aggregate_refresh table. Rows changed on that date are read again by the
+next refresh, since more rows could change later the same day; recomputing
+a group gives the same result every time.
+
+A deleted row, or a row moved to another group, leaves nothing behind to
+find by date in its old group, and a moved row may keep its old date.
+Triggers on those tables write the groups a row left and joined to
+scoring_change, and each refresh also recomputes the groups written there
+since the last scoring_change row it read. Rows every refresh has read are
+deleted.
+
+Run python migrate.py after loading new data to refresh every table."""
+from datetime import date
+
+from sqlalchemy import delete, exists, func, insert, literal, or_, select, text, true, tuple_, union
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+import crud
+import models
+
+# name: statement, for the triggers that write scoring_change
+SCORING_CHANGE_DDL = {
+    "performance_scoring_delete": """
+        CREATE TRIGGER performance_scoring_delete AFTER DELETE ON performance BEGIN
+            INSERT INTO scoring_change (table_name, player_id, season, week)
+            VALUES ('performance', old.player_id, old.season, old.week);
+        END""",
+    "performance_scoring_update": """
+        CREATE TRIGGER performance_scoring_update AFTER UPDATE OF player_id, week_number ON performance BEGIN
+            INSERT INTO scoring_change (table_name, player_id, season, week)
+            VALUES ('performance', old.player_id, old.season, old.week),
+                   ('performance', new.player_id, new.season, new.week);
+        END""",
+    "team_player_scoring_delete": """
+        CREATE TRIGGER team_player_scoring_delete AFTER DELETE ON team_player BEGIN
+            INSERT INTO scoring_change (table_name, player_id, team_id)
+            VALUES ('team_player', old.player_id, old.team_id);
+        END""",
+    "team_player_scoring_update": """
+        CREATE TRIGGER team_player_scoring_update AFTER UPDATE OF team_id, player_id ON team_player BEGIN
+            INSERT INTO scoring_change (table_name, player_id, team_id)
+            VALUES ('team_player', old.player_id, old.team_id),
+                   ('team_player', new.player_id, new.team_id);
+        END""",
+}
+
+
+def create_scoring_triggers(target_engine: Engine) -> list:
+    """Creates any missing scoring_change trigger, replacing any trigger
+    from an older version of this module"""
+    created = []
+    with target_engine.begin() as connection:
+        existing = dict(connection.execute(text("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'")).all())
+        for name, statement in SCORING_CHANGE_DDL.items():
+            statement = statement.strip()
+            if existing.get(name) != statement:
+                if name in existing:
+                    connection.execute(text(f"DROP TRIGGER {name}"))
+                connection.execute(text(statement))
+                created.append(name)
+    return created
+
+
+def get_watermark(db: Session, aggregate_name: str) -> date:
+    """Returns the last_changed_date an aggregate was last refreshed from, or None"""
+    return db.scalar(
+        select(models.AggregateRefresh.refreshed_through).where(
+            models.AggregateRefresh.aggregate_name == aggregate_name
+        )
+    )
+
+
+def get_change_watermark(db: Session, aggregate_name: str) -> int:
+    """Returns the last scoring_change row an aggregate has read, or 0"""
+    return db.scalar(
+        select(models.AggregateRefresh.scoring_change_id).where(
+            models.AggregateRefresh.aggregate_name == aggregate_name
+        )
+    ) or 0
+
+
+def newest_scoring_change(db: Session) -> int:
+    return db.scalar(select(func.max(models.ScoringChange.change_id))) or 0
+
+
+def set_watermark(db: Session, aggregate_name: str, refreshed_through: date, scoring_change_id: int = None):
+    if refreshed_through is not None:
+        db.merge(models.AggregateRefresh(
+            aggregate_name=aggregate_name,
+            refreshed_through=refreshed_through,
+            scoring_change_id=scoring_change_id,
+        ))
+
+
+def since_watermark(query, model, watermark: date):
+    """Keeps the rows changed on or after the watermark, or every row on the first refresh"""
+    if watermark is None:
+        return query
+    return query.where(model.last_changed_date >= watermark)
+
+
+def scoring_changes(columns: tuple, model, change_watermark: int):
+    """Selects the groups the model's rows left or joined when they were
+    deleted or moved after the change watermark"""
+    scoring_change = models.ScoringChange
+    return select(*columns).where(
+        scoring_change.table_name == model.__tablename__,
+        scoring_change.change_id > change_watermark,
+    )
+
+
+def refresh_player_season_scores(db: Session) -> int:
+    """Recomputes the season totals of each player and season with changed
+    performances, or that a performance was deleted from or moved into or
+    out of. Returns how many totals were written."""
+    performance = models.Performance
+    season_score = models.PlayerSeasonScore
+    scoring_change = models.ScoringChange
+    season = performance.season
+    watermark = get_watermark(db, season_score.__tablename__)
+    change_watermark = get_change_watermark(db, season_score.__tablename__)
+    newest = db.scalar(select(func.max(performance.last_changed_date)))
+    newest_change = newest_scoring_change(db)
+
+    changed_groups = union(
+        since_watermark(select(performance.player_id, season), performance, watermark),
+        scoring_changes((scoring_change.player_id, scoring_change.season), performance, change_watermark),
+    )
+    db.execute(
+        delete(season_score).where(
+            tuple_(season_score.player_id, season_score.season).in_(changed_groups)
+        )
+    )
+    totals = (
+        select(
+            performance.player_id,
+            season,
+            func.count(),
+            func.sum(performance.fantasy_points),
+            func.avg(performance.fantasy_points),
+            func.max(performance.fantasy_points),
+            func.max(performance.last_changed_date),
+        )
+        .where(tuple_(performance.player_id, season).in_(changed_groups))
+        .group_by(performance.player_id, season)
+    )
+    written = db.execute(
+        insert(season_score).from_select(
+            [
+                season_score.player_id,
+                season_score.season,
+                season_score.games_played,
+                season_score.total_points,
+                season_score.average_points,
+                season_score.max_points,
+                season_score.last_changed_date,
+            ],
+            totals,
+        )
+    ).rowcount
+    # Totals whose performances were all deleted
+    db.execute(
+        delete(season_score).where(
+            ~exists().where(
+                performance.player_id == season_score.player_id,
+                season == season_score.season,
+            )
+        )
+    )
+    set_watermark(db, season_score.__tablename__, newest, newest_change)
+    return written
+
+
+def refresh_weekly_leaderboards(db: Session) -> int:
+    """Ranks the players again for each week with a changed performance,
+    with a performance by a changed player, or that a performance was
+    deleted from or moved into or out of. Returns how many rows were written."""
+    performance = models.Performance
+    player = models.Player
+    leaderboard = models.WeeklyLeaderboard
+    scoring_change = models.ScoringChange
+    season = performance.season
+    week = performance.week
+    watermark = get_watermark(db, leaderboard.__tablename__)
+    change_watermark = get_change_watermark(db, leaderboard.__tablename__)
+    newest = crud.get_last_changed_date(db, (performance, player))
+    newest_change = newest_scoring_change(db)
+
+    changed_weeks = [
+        since_watermark(select(season, week), performance, watermark),
+        scoring_changes((scoring_change.season, scoring_change.week), performance, change_watermark),
+    ]
+    if watermark is not None:
+        changed_weeks.append(
+            select(season, week).join(player, player.player_id == performance.player_id
+                                      ).where(player.last_changed_date >= watermark),
+        )
+    changed_weeks = union(*changed_weeks)
+    db.execute(
+        delete(leaderboard).where(tuple_(leaderboard.season, leaderboard.week).in_(changed_weeks))
+    )
+    written = 0
+    for board, partition in ((literal(models.ALL_POSITIONS), ()), (player.position, (player.position,))):
+        ranked = (
+            select(
+                season,
+                week,
+                board,
+                func.row_number().over(
+                    partition_by=(season, week, *partition),
+                    order_by=(performance.fantasy_points.desc(), performance.player_id),
+                ),
+                performance.player_id,
+                player.first_name,
+                player.last_name,
+                player.position,
+                performance.fantasy_points,
+                func.max(performance.last_changed_date, player.last_changed_date),
+            )
+            .join(player, player.player_id == performance.player_id)
+            .where(tuple_(season, week).in_(changed_weeks))
+        )
+        written += db.execute(
+            insert(leaderboard).from_select(
+                [
+                    leaderboard.season,
+                    leaderboard.week,
+                    leaderboard.board,
+                    leaderboard.rank,
+                    leaderboard.player_id,
+                    leaderboard.first_name,
+                    leaderboard.last_name,
+                    leaderboard.position,
+                    leaderboard.fantasy_points,
+                    leaderboard.last_changed_date,
+                ],
+                ranked,
+            )
+        ).rowcount
+    # Weeks whose performances were all deleted
+    db.execute(
+        delete(leaderboard).where(
+            ~exists().where(season == leaderboard.season, week == leaderboard.week)
+        )
+    )
+    set_watermark(db, leaderboard.__tablename__, newest, newest_change)
+    return written
+
+
+def refresh_team_week_scores(db: Session) -> int:
+    """Adds up each team's weekly points again where a performance by one of
+    its players changed, was deleted or moved, and every week of a team
+    whose roster or league changed, including players dropped from the
+    roster. All the teams are scored in one INSERT ... SELECT. Returns how
+    many rows were written."""
+    performance = models.Performance
+    team_player = models.TeamPlayer
+    team = models.Team
+    team_score = models.TeamWeekScore
+    scoring_change = models.ScoringChange
+    season = performance.season
+    week = performance.week
+    watermark = get_watermark(db, team_score.__tablename__)
+    change_watermark = get_change_watermark(db, team_score.__tablename__)
+    newest = crud.get_last_changed_date(db, (performance, team_player, team))
+    newest_change = newest_scoring_change(db)
+
+    if watermark is None:
+        changed = true()
+        changed_scores = true()
+    else:
+        changed_weeks = union(
+            select(team_player.team_id, season, week).join(
+                performance, performance.player_id == team_player.player_id
+            ).where(performance.last_changed_date >= watermark),
+            scoring_changes(
+                (team_player.team_id, scoring_change.season, scoring_change.week), performance, change_watermark
+            ).join(team_player, team_player.player_id == scoring_change.player_id),
+        )
+        changed_teams = union(
+            select(team_player.team_id).where(team_player.last_changed_date >= watermark),
+            select(team.team_id).where(team.last_changed_date >= watermark),
+            scoring_changes((scoring_change.team_id,), team_player, change_watermark),
+        )
+        changed = or_(
+            tuple_(team_player.team_id, season, week).in_(changed_weeks),
+            team_player.team_id.in_(changed_teams),
+        )
+        changed_scores = or_(
+            tuple_(team_score.team_id, team_score.season, team_score.week).in_(changed_weeks),
+            team_score.team_id.in_(changed_teams),
+        )
+    db.execute(delete(team_score).where(changed_scores))
+    totals = (
+        select(
+            team_player.team_id,
+            season,
+            week,
+            team.league_id,
+            func.sum(performance.fantasy_points),
+            func.count(),
+            func.max(func.max(performance.last_changed_date, team_player.last_changed_date, team.last_changed_date)),
+        )
+        .join(performance, performance.player_id == team_player.player_id)
+        .join(team, team.team_id == team_player.team_id)
+        .where(changed)
+        .group_by(team_player.team_id, season, week)
+    )
+    written = db.execute(
+        insert(team_score).from_select(
+            [
+                team_score.team_id,
+                team_score.season,
+                team_score.week,
+                team_score.league_id,
+                team_score.total_points,
+                team_score.players_scored,
+                team_score.last_changed_date,
+            ],
+            totals,
+        )
+    ).rowcount
+    # Weekly totals of teams that no longer have a player with a performance that week
+    db.execute(
+        delete(team_score).where(
+            ~exists().where(
+                team_player.team_id == team_score.team_id,
+                performance.player_id == team_player.player_id,
+                season == team_score.season,
+                week == team_score.week,
+            )
+        )
+    )
+    set_watermark(db, team_score.__tablename__, newest, newest_change)
+    return written
+
+
+# Every materialized table, in the order to refresh them
+REFRESHES = {
+    models.PlayerSeasonScore.__tablename__: refresh_player_season_scores,
+    models.WeeklyLeaderboard.__tablename__: refresh_weekly_leaderboards,
+    models.TeamWeekScore.__tablename__: refresh_team_week_scores,
+}
+
+
+def prune_scoring_changes(db: Session):
+    """Deletes the scoring_change rows every materialized table has read"""
+    read_through = db.scalars(
+        select(models.AggregateRefresh.scoring_change_id).where(
+            models.AggregateRefresh.aggregate_name.in_(REFRESHES)
+        )
+    ).all()
+    if len(read_through) == len(REFRESHES) and None not in read_through:
+        db.execute(delete(models.ScoringChange).where(models.ScoringChange.change_id <= min(read_through)))
+
+
+def refresh_all(db: Session) -> dict:
+    """Refreshes every materialized table in one transaction and returns how
+    many rows each one wrote"""
+    written = {name: refresh(db) for name, refresh in REFRESHES.items()}
+    prune_scoring_changes(db)
+    db.commit()
+    return written
@@ -0,0 +1,189 @@
+"""Player name search
+
+Player names are indexed in player_search, an SQLite FTS5 table with the
+trigram tokenizer. It reads the names from the player table, and triggers
+on the player table keep the index in sync with every insert, update and
+delete. Create it with python migrate.py.
+
+Two kinds of matching are supported:
+
+    prefix  every word of the query starts the first or last name, so
+            "bry yo" finds Bryce Young. Made for autocomplete.
+    fuzzy   names that share most of their trigrams with the query, so
+            "patrik mahoms" still finds Patrick Mahomes.
+
+The index finds the candidate players, then each one is scored by the
+trigram similarity of its name to the query, from 0 to 1, and the best
+scores come first. The scoring is plain Python so the snapshot in
+snapshot.py ranks players the same way."""
+import re
+from datetime import date
+from typing import NamedTuple
+
+from sqlalchemy import and_, column, literal_column, or_, select, table, text
+from sqlalchemy.engine import Engine
+
+import models
+
+MATCH_TYPES = ("prefix", "fuzzy")
+
+# Fuzzy matches must contain this share of the query's trigrams
+MIN_WORD_SIMILARITY = 0.5
+
+# Most candidates a fuzzy search scores, best index matches first
+MAX_FUZZY_CANDIDATES = 200
+
+player_search = table("player_search", column("rowid"), column("first_name"), column("last_name"))
+
+# name: statement, in the order to create them
+SEARCH_INDEX_DDL = {
+    "player_search": """
+        CREATE VIRTUAL TABLE player_search USING fts5(
+            first_name, last_name,
+            content='player', content_rowid='player_id', tokenize='trigram'
+        )""",
+    "player_search_insert": """
+        CREATE TRIGGER player_search_insert AFTER INSERT ON player BEGIN
+            INSERT INTO player_search(rowid, first_name, last_name)
+            VALUES (new.player_id, new.first_name, new.last_name);
+        END""",
+    "player_search_delete": """
+        CREATE TRIGGER player_search_delete AFTER DELETE ON player BEGIN
+            INSERT INTO player_search(player_search, rowid, first_name, last_name)
+            VALUES ('delete', old.player_id, old.first_name, old.last_name);
+        END""",
+    "player_search_update": """
+        CREATE TRIGGER player_search_update AFTER UPDATE OF player_id, first_name, last_name ON player BEGIN
+            INSERT INTO player_search(player_search, rowid, first_name, last_name)
+            VALUES ('delete', old.player_id, old.first_name, old.last_name);
+            INSERT INTO player_search(rowid, first_name, last_name)
+            VALUES (new.player_id, new.first_name, new.last_name);
+        END""",
+}
+
+
+class PlayerMatch(NamedTuple):
+    player_id: int
+    gsis_id: str
+    first_name: str
+    last_name: str
+    position: str
+    last_changed_date: date
+    score: float
+
+
+def create_search_index(target_engine: Engine) -> list:
+    """Creates the search table and its triggers if they are missing, and
+    fills the table from the player table when it is new"""
+    created = []
+    with target_engine.begin() as connection:
+        existing = set(connection.scalars(text("SELECT name FROM sqlite_master")))
+        for name, statement in SEARCH_INDEX_DDL.items():
+            if name not in existing:
+                connection.execute(text(statement))
+                created.append(name)
+        if "player_search" in created:
+            connection.execute(text("INSERT INTO player_search(player_search) VALUES ('rebuild')"))
+    return created
+
+
+def query_words(query: str) -> list:
+    """Splits a query into lowercase words, dropping the LIKE wildcards"""
+    return re.findall(r"[^\s%_]+", query.lower())
+
+
+def trigrams(text_value: str) -> set:
+    """Returns the trigrams of each word, padded so the start of a word counts"""
+    grams = set()
+    for word in re.findall(r"[^\W_]+", text_value.lower()):
+        padded = f"  {word} "
+        grams.update(padded[index:index + 3] for index in range(len(padded) - 2))
+    return grams
+
+
+def _phrase(value: str) -> str:
+    return '"' + value.replace('"', '""') + '"'
+
+
+def prefix_candidates_query(words: list):
+    """Builds a query for the players whose first or last name starts with
+    every word. Words of three or more characters are looked up in the
+    trigram index, and LIKE keeps the names they start. A query of only
+    shorter words, like "br", has nothing to look up there, so its LIKE
+    searches the NOCASE indexes on first_name and last_name instead."""
+    player = models.Player
+    query = select(player).where(and_(*(
+        or_(player.first_name.like(f"{word}%"), player.last_name.like(f"{word}%"))
+        for word in words
+    )))
+    indexed = [_phrase(word) for word in words if len(word) >= 3]
+    if indexed:
+        query = query.join(player_search, player_search.c.rowid == player.player_id).where(
+            literal_column("player_search").op("MATCH")(" AND ".join(indexed))
+        )
+    return query
+
+
+def fuzzy_candidates_query(words: list):
+    """Builds a query for the players whose names contain any trigram of the
+    words, the names with the most in common first"""
+    player = models.Player
+    grams = sorted({
+        word[index:index + 3]
+        for word in re.findall(r"[^\W_]+", " ".join(words))
+        for index in range(len(word) - 2)
+    })
+    if not grams:
+        return None
+    return (
+        select(player)
+        .join(player_search, player_search.c.rowid == player.player_id)
+        .where(literal_column("player_search").op("MATCH")(" OR ".join(_phrase(gram) for gram in grams)))
+        .order_by(literal_column("player_search.rank"))
+        .limit(MAX_FUZZY_CANDIDATES)
+    )
+
+
+def candidates_query(query: str, match: str = "prefix"):
+    """Builds the query for the players to score, or returns None when the
+    query can't match any player"""
+    words = query_words(query)
+    if not words:
+        return None
+    if match == "fuzzy":
+        return fuzzy_candidates_query(words)
+    return prefix_candidates_query(words)
+
+
+def is_prefix_match(player, words: list) -> bool:
+    first_name = player.first_name.lower()
+    last_name = player.last_name.lower()
+    return all(first_name.startswith(word) or last_name.startswith(word) for word in words)
+
+
+def rank(players, query: str, match: str = "prefix", limit: int = 10) -> list:
+    """Scores the players against the query and returns the best matches"""
+    words = query_words(query)
+    query_grams = trigrams(query)
+    if not words or not query_grams:
+        return []
+    matches = []
+    for player in players:
+        name_grams = trigrams(f"{player.first_name} {player.last_name}")
+        shared = len(query_grams & name_grams)
+        if match == "fuzzy":
+            if shared / len(query_grams) < MIN_WORD_SIMILARITY:
+                continue
+        elif not is_prefix_match(player, words):
+            continue
+        matches.append(PlayerMatch(
+            player_id=player.player_id,
+            gsis_id=player.gsis_id,
+            first_name=player.first_name,
+            last_name=player.last_name,
+            position=player.position,
+            last_changed_date=player.last_changed_date,
+            score=round(shared / len(query_grams | name_grams), 4),
+        ))
+    matches.sort(key=lambda found: (-found.score, found.last_name, found.first_name, found.player_id))
+    return matches[:limit]
@@ -0,0 +1,405 @@
+"""In-memory snapshot of the database for the read-only API
+
+Loads every table once into lists of named tuples, with hash indexes on the
+ids and the names the API filters on. The query functions here match the
+ones in crud.py, but take a Snapshot in place of a Session, so the endpoints
+can serve reads without going through SQLAlchemy or SQLite.
+
+Call reload() to pick up a new database file. The old snapshot keeps
+serving requests until the new one is fully loaded and swapped in."""
+import threading
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import date
+from typing import NamedTuple
+
+from sqlalchemy import select
+
+import changes
+import models
+import search
+import table_versions
+from database import engine
+
+
+class Performance(NamedTuple):
+    performance_id: int
+    week_number: str
+    season: int
+    week: int
+    fantasy_points: float
+    last_changed_date: date
+    player_id: int
+
+
+class Player(NamedTuple):
+    player_id: int
+    gsis_id: str
+    first_name: str
+    last_name: str
+    position: str
+    last_changed_date: date
+    performances: tuple
+
+
+class Team(NamedTuple):
+    team_id: int
+    team_name: str
+    last_changed_date: date
+    league_id: int
+    players: tuple
+
+
+class League(NamedTuple):
+    league_id: int
+    league_name: str
+    scoring_type: str
+    last_changed_date: date
+    teams: tuple
+
+
+class TeamPlayer(NamedTuple):
+    team_id: int
+    player_id: int
+    last_changed_date: date
+
+
+class SeasonScore(NamedTuple):
+    player_id: int
+    season: int
+    games_played: int
+    total_points: float
+    average_points: float
+    max_points: float
+    last_changed_date: date
+
+
+class LeaderboardEntry(NamedTuple):
+    season: int
+    week: int
+    board: str
+    rank: int
+    player_id: int
+    first_name: str
+    last_name: str
+    position: str
+    fantasy_points: float
+    last_changed_date: date
+
+
+class TeamWeekScore(NamedTuple):
+    team_id: int
+    season: int
+    week: int
+    league_id: int
+    total_points: float
+    players_scored: int
+    last_changed_date: date
+
+
+class Change(NamedTuple):
+    change_id: int
+    table_name: str
+    operation: str
+    row_key: str
+
+
+class Table:
+    """The rows of one table in primary key order, plus the same rows in
+    (last_changed_date, primary key) order for the date filter"""
+
+    def __init__(self, rows: list, id_attr: str):
+        self.id_attr = id_attr
+        self.rows = sorted(rows, key=lambda row: getattr(row, id_attr))
+        self.ids = [getattr(row, id_attr) for row in self.rows]
+        self.by_id = dict(zip(self.ids, self.rows))
+        self.by_date = sorted(self.rows, key=self.date_key)
+        self.date_keys = [self.date_key(row) for row in self.by_date]
+
+    def date_key(self, row) -> tuple:
+        return (row.last_changed_date, getattr(row, self.id_attr))
+
+    def index(self, attr: str) -> dict:
+        """Builds a hash index from a column value to the rows that have it"""
+        index = defaultdict(list)
+        for row in self.rows:
+            index[getattr(row, attr)].append(row)
+        return dict(index)
+
+
+class Snapshot:
+    """Every table of the database, loaded into memory"""
+
+    def __init__(self, performances: list, players: list, teams: list, leagues: list, team_players: list, season_scores: list = (), leaderboard_entries: list = (), team_week_scores: list = (), change_log: list = (), table_versions: list = ()):
+        self.performances = Table(performances, "performance_id")
+        self.players = Table(players, "player_id")
+        self.teams = Table(teams, "team_id")
+        self.leagues = Table(leagues, "league_id")
+        self.team_players = team_players
+        self.performances_by_season = self.performances.index("season")
+        self.players_by_first_name = self.players.index("first_name")
+        self.players_by_last_name = self.players.index("last_name")
+        self.teams_by_name = self.teams.index("team_name")
+        self.teams_by_league = self.teams.index("league_id")
+        self.leagues_by_name = self.leagues.index("league_name")
+        self.tables = {
+            models.Performance: self.performances,
+            models.Player: self.players,
+            models.Team: self.teams,
+            models.League: self.leagues,
+        }
+        self.season_scores = list(season_scores)
+        # Each board of the weekly leaderboard in rank order, keyed by
+        # (season, week, board)
+        self.leaderboards = defaultdict(list)
+        for entry in sorted(leaderboard_entries, key=lambda entry: entry.rank):
+            self.leaderboards[entry.season, entry.week, entry.board].append(entry)
+        # Weekly team totals week by week, highest scoring team first
+        self.team_week_scores = sorted(
+            team_week_scores,
+            key=lambda row: (row.season, row.week, -row.total_points, row.team_id),
+        )
+        # The log holds the latest change of each row; in change_id order
+        # the changes after a token are one slice
+        self.latest_changes = sorted(change_log, key=lambda change: change.change_id)
+        self.latest_change_ids = [change.change_id for change in self.latest_changes]
+        self.team_players_by_key = {
+            (team_player.team_id, team_player.player_id): team_player for team_player in team_players
+        }
+        self.table_versions = {row.table_name: row for row in table_versions}
+
+
+def _table_rows(connection, model) -> list:
+    table = model.__table__
+    return connection.execute(select(table).order_by(*table.primary_key.columns)).all()
+
+
+def load(source_engine=engine) -> Snapshot:
+    """Reads every table and links the rows the way the relationships in models.py do"""
+    with source_engine.connect() as connection:
+        performance_rows = _table_rows(connection, models.Performance)
+        player_rows = _table_rows(connection, models.Player)
+        team_rows = _table_rows(connection, models.Team)
+        league_rows = _table_rows(connection, models.League)
+        team_player_rows = _table_rows(connection, models.TeamPlayer)
+        season_score_rows = _table_rows(connection, models.PlayerSeasonScore)
+        leaderboard_rows = _table_rows(connection, models.WeeklyLeaderboard)
+        team_week_score_rows = _table_rows(connection, models.TeamWeekScore)
+        change_rows = _table_rows(connection, models.ChangeLog)
+        table_version_rows = _table_rows(connection, models.TableVersion)
+
+    performances = [Performance(**row._mapping) for row in performance_rows]
+    performances_by_player = defaultdict(list)
+    for performance in performances:
+        performances_by_player[performance.player_id].append(performance)
+    players = [
+        Player(**row._mapping, performances=tuple(performances_by_player[row.player_id]))
+        for row in player_rows
+    ]
+
+    team_players = [TeamPlayer(**row._mapping) for row in team_player_rows]
+    players_by_id = {player.player_id: player for player in players}
+    players_by_team = defaultdict(list)
+    for team_player in team_players:
+        players_by_team[team_player.team_id].append(players_by_id[team_player.player_id])
+    teams = [
+        Team(**row._mapping, players=tuple(players_by_team[row.team_id]))
+        for row in team_rows
+    ]
+
+    teams_by_league = defaultdict(list)
+    for team in teams:
+        teams_by_league[team.league_id].append(team)
+    leagues = [
+        League(**row._mapping, teams=tuple(teams_by_league[row.league_id]))
+        for row in league_rows
+    ]
+    season_scores = [SeasonScore(**row._mapping) for row in season_score_rows]
+    leaderboard_entries = [LeaderboardEntry(**row._mapping) for row in leaderboard_rows]
+    team_week_scores = [TeamWeekScore(**row._mapping) for row in team_week_score_rows]
+    change_log = [Change(**row._mapping) for row in change_rows]
+    return Snapshot(performances, players, teams, leagues, team_players, season_scores, leaderboard_entries, team_week_scores, change_log, table_version_rows)
+
+
+_current = None
+_lock = threading.Lock()
+
+
+def current() -> Snapshot:
+    """Returns the loaded snapshot, loading it on first use"""
+    global _current
+    if _current is None:
+        with _lock:
+            if _current is None:
+                _current = load()
+    return _current
+
+
+def reload() -> Snapshot:
+    """Loads the database again and swaps the new snapshot in.
+
+    The engine's pooled connections are closed first, so a database file
+    replaced on disk is opened again instead of read through old handles."""
+    global _current
+    with _lock:
+        engine.dispose()
+        _current = load()
+    return _current
+
+
+def _page(table: Table, rows: list, skip: int, limit: int, min_last_changed_date: date, cursor: dict) -> list:
+    """Filters by date, orders, seeks and limits rows the same way crud.paginate does.
+
+    rows is None to page through the whole table, or the rows that matched
+    an index lookup, in primary key order."""
+    if min_last_changed_date:
+        if rows is None:
+            rows, keys = table.by_date, table.date_keys
+            start = bisect_left(keys, (min_last_changed_date,))
+        else:
+            rows = sorted(
+                (row for row in rows if row.last_changed_date >= min_last_changed_date),
+                key=table.date_key,
+            )
+            keys = [table.date_key(row) for row in rows]
+            start = 0
+        if cursor is not None:
+            cursor_key = (cursor["last_changed_date"], cursor["id"])
+            start = max(start, bisect_right(keys, cursor_key))
+    else:
+        if rows is None:
+            rows, keys = table.rows, table.ids
+        else:
+            keys = [getattr(row, table.id_attr) for row in rows]
+        start = 0
+        if cursor is not None:
+            start = bisect_right(keys, cursor["id"])
+    if cursor is None:
+        start += skip
+    return rows[start:start + limit]
+
+
+def _matching(rows: list, **equals) -> list:
+    """Keeps the rows that equal every filter value that was sent"""
+    for attr, value in equals.items():
+        if value:
+            rows = [row for row in rows if getattr(row, attr) == value]
+    return rows
+
+
+# The list functions take the same fields parameter as crud.py, but every
+# field is already in memory, so only the response encoding uses it.
+def get_player(snapshot: Snapshot, player_id: int):
+    return snapshot.players.by_id.get(player_id)
+
+
+def get_players(snapshot: Snapshot, skip: int = 0, limit: int = 100, min_last_changed_date: date = None, last_name: str = None, first_name: str = None, cursor: dict = None, player_ids: list = None, fields: tuple = None):
+    rows = None
+    if player_ids:
+        rows = _matching(
+            [snapshot.players.by_id[player_id] for player_id in sorted(set(player_ids)) if player_id in snapshot.players.by_id],
+            first_name=first_name,
+            last_name=last_name,
+        )
+    elif last_name:
+        rows = _matching(snapshot.players_by_last_name.get(last_name, []), first_name=first_name)
+    elif first_name:
+        rows = snapshot.players_by_first_name.get(first_name, [])
+    return _page(snapshot.players, rows, skip, limit, min_last_changed_date, cursor)
+
+
+def search_players(snapshot: Snapshot, query: str, match: str = "prefix", limit: int = 10):
+    return search.rank(snapshot.players.rows, query, match, limit)
+
+
+def get_performances(snapshot: Snapshot, skip: int = 0, limit: int = 100, min_last_changed_date: date = None, cursor: dict = None, fields: tuple = None, season: int = None, week_from: int = None, week_to: int = None):
+    rows = None
+    if season:
+        rows = snapshot.performances_by_season.get(season, [])
+    if week_from or week_to:
+        rows = [
+            row for row in (snapshot.performances.rows if rows is None else rows)
+            if (not week_from or row.week >= week_from) and (not week_to or row.week <= week_to)
+        ]
+    return _page(snapshot.performances, rows, skip, limit, min_last_changed_date, cursor)
+
+
+def get_league(snapshot: Snapshot, league_id: int = None):
+    return snapshot.leagues.by_id.get(league_id)
+
+
+def get_leagues(snapshot: Snapshot, skip: int = 0, limit: int = 100, min_last_changed_date: date = None, league_name: str = None, cursor: dict = None, fields: tuple = None):
+    rows = None
+    if league_name:
+        rows = snapshot.leagues_by_name.get(league_name, [])
+    return _page(snapshot.leagues, rows, skip, limit, min_last_changed_date, cursor)
+
+
+def get_teams(snapshot: Snapshot, skip: int = 0, limit: int = 100, min_last_changed_date: date = None, team_name: str = None, league_id: int = None, cursor: dict = None, fields: tuple = None):
+    rows = None
+    if league_id:
+        rows = _matching(snapshot.teams_by_league.get(league_id, []), team_name=team_name)
+    elif team_name:
+        rows = snapshot.teams_by_name.get(team_name, [])
+    return _page(snapshot.teams, rows, skip, limit, min_last_changed_date, cursor)
+
+
+def get_counts(snapshot: Snapshot):
+    return {
+        "league_count": len(snapshot.leagues.rows),
+        "team_count": len(snapshot.teams.rows),
+        "player_count": len(snapshot.players.rows),
+    }
+
+
+def get_season_scores(snapshot: Snapshot, skip: int = 0, limit: int = 100, season: int = None, player_id: int = None, position: str = None, min_games_played: int = None, sort_by: str = "total_points", descending: bool = True):
+    rows = _matching(snapshot.season_scores, season=season, player_id=player_id)
+    if position:
+        rows = [row for row in rows if snapshot.players.by_id[row.player_id].position == position]
+    if min_games_played:
+        rows = [row for row in rows if row.games_played >= min_games_played]
+    # Sort by the tie breakers first, then by the sort column, which keeps
+    # the tie breakers in order the way crud.season_scores_query does
+    rows = sorted(rows, key=lambda row: (row.player_id, row.season))
+    rows.sort(key=lambda row: getattr(row, sort_by), reverse=descending)
+    return rows[skip:skip + limit]
+
+
+def get_weekly_leaderboard(snapshot: Snapshot, season: int, week: int, position: str = None, limit: int = 10):
+    return snapshot.leaderboards.get((season, week, position or models.ALL_POSITIONS), [])[:limit]
+
+
+def get_team_week_scores(snapshot: Snapshot, skip: int = 0, limit: int = 100, league_id: int = None, team_id: int = None, season: int = None, week: int = None):
+    rows = _matching(snapshot.team_week_scores, league_id=league_id, team_id=team_id, season=season, week=week)
+    return rows[skip:skip + limit]
+
+
+def get_changes(snapshot: Snapshot, since: int = 0, limit: int = 500):
+    start = bisect_right(snapshot.latest_change_ids, since)
+    latest = snapshot.latest_changes[start:start + limit]
+    rows = {}
+    for table_name, keys in changes.keys_to_load(latest).items():
+        if table_name == models.TeamPlayer.__tablename__:
+            found = (snapshot.team_players_by_key.get(key) for key in keys)
+        else:
+            by_id = snapshot.tables[changes.FEED_MODELS[table_name]].by_id
+            found = (by_id.get(key[0]) for key in keys)
+        for row in found:
+            if row is not None:
+                rows[table_name, changes.row_key(table_name, row)] = row
+    return changes.entries(latest, rows)
+
+
+def get_table_version(snapshot: Snapshot, tables: tuple):
+    rows = (snapshot.table_versions.get(model.__tablename__) for model in tables)
+    return table_versions.combine(row for row in rows if row is not None)
+
+
+def get_table_rows(snapshot: Snapshot, model):
+    """Returns every row of a table as tuples in the column order of the model"""
+    if model is models.TeamPlayer:
+        rows = snapshot.team_players
+    else:
+        rows = snapshot.tables[model].rows
+    names = [column.name for column in model.__table__.columns]
+    return [tuple(getattr(row, name) for name in names) for row in rows]
@@ -0,0 +1,83 @@
+"""Table versions for the ETag and Last-Modified headers
+
+Triggers on every table the API serves with an ETag keep a row in
+table_version for that table: version goes up by one, and changed_at is
+set to the time, on every insert, update and delete. Unlike the
+last_changed_date of the rows, this moves when a row is deleted, or
+changed again on the same day, so a client's copy is never reported as
+current after the data changed. Create the triggers with python migrate.py."""
+from sqlalchemy import func, select, text
+from sqlalchemy.engine import Engine
+
+import models
+
+# Tables behind the responses that have validators
+VERSIONED_MODELS = (
+    models.League,
+    models.Team,
+    models.Player,
+    models.TeamPlayer,
+    models.Performance,
+    models.PlayerSeasonScore,
+    models.WeeklyLeaderboard,
+    models.TeamWeekScore,
+)
+
+OPERATIONS = ("insert", "update", "delete")
+
+
+def trigger_ddl() -> dict:
+    """Returns the statements that create the triggers, keyed by trigger name"""
+    statements = {}
+    for model in VERSIONED_MODELS:
+        table_name = model.__tablename__
+        for operation in OPERATIONS:
+            name = f"{table_name}_version_{operation}"
+            statements[name] = (
+                f"CREATE TRIGGER {name} AFTER {operation.upper()} ON {table_name} BEGIN "
+                "INSERT INTO table_version (table_name, version, changed_at) "
+                f"VALUES ('{table_name}', 1, CURRENT_TIMESTAMP) "
+                "ON CONFLICT (table_name) DO UPDATE SET "
+                "version = version + 1, changed_at = excluded.changed_at; END"
+            )
+    return statements
+
+
+def create_table_versions(target_engine: Engine) -> list:
+    """Creates any missing trigger, and adds a row for each table that has
+    none yet, dated by its latest last_changed_date. The table_version
+    table comes from models.py."""
+    created = []
+    with target_engine.begin() as connection:
+        existing = set(connection.scalars(text("SELECT name FROM sqlite_master WHERE type = 'trigger'")))
+        for name, statement in trigger_ddl().items():
+            if name not in existing:
+                connection.execute(text(statement))
+                created.append(name)
+        for model in VERSIONED_MODELS:
+            table_name = model.__tablename__
+            connection.execute(text(
+                "INSERT OR IGNORE INTO table_version (table_name, version, changed_at) "
+                f"SELECT '{table_name}', 0, coalesce(datetime(max(last_changed_date)), CURRENT_TIMESTAMP) "
+                f"FROM {table_name}"
+            ))
+    return created
+
+
+def table_version_query(tables: tuple):
+    """Builds one statement for the combined version of the tables and the
+    time the latest of them changed. Versions only go up, so their sum
+    changes whenever any of the tables does."""
+    table_version = models.TableVersion
+    return select(func.sum(table_version.version), func.max(table_version.changed_at)).where(
+        table_version.table_name.in_([model.__tablename__ for model in tables])
+    )
+
+
+def combine(rows) -> tuple:
+    """Returns (version, changed_at) for the table_version rows, or None
+    when there are none"""
+    rows = list(rows)
+    if not rows:
+        return None
+    return (sum(row.version for row in rows), max(row.changed_at for row in rows))
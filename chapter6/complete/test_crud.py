@@ -1,9 +1,23 @@
 """Testing SQLAlchemy Helper Functions"""
+import asyncio
+import sqlite3
 import pytest
 from datetime import date
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool, QueuePool
 
+import async_crud
+import cache
+import changes
 import crud
-from database import SessionLocal
+import models
+import snapshot
+import database
+import migrate
+import scoring
+import search
+from database import SessionLocal, engine
 
 # use a test date of 4/1/2024 to test the min_last_changed_date.
 test_date = date(2024,4,1)
@@ -31,6 +45,22 @@ def test_get_players_by_name(db_session):
     assert len(players) == 1
     assert players[0].player_id == 102
 
+def test_get_players_by_ids(db_session):
+    """Tests that a list of ids returns those players, in id order, with their performances"""
+    players = crud.get_players(db_session, player_ids=[109, 102, 650, 999999], limit=4)
+    assert [player.player_id for player in players] == [102, 109, 650]
+    assert all(len(player.performances) > 0 for player in players)
+
+
+def test_get_players_with_fields(db_session):
+    """Tests that only the requested columns and relationships are loaded"""
+    players = crud.get_players(db_session, limit=5, fields=("player_id", "first_name"))
+    assert len(players) == 5
+    loaded = players[0].__dict__
+    assert "first_name" in loaded
+    assert "gsis_id" not in loaded
+    assert "performances" not in loaded
+
 
 def test_get_all_performances(db_session):
     """Tests that the count of performances in the database is what is expected - all the performances"""
@@ -78,4 +108,624 @@ def test_get_team_count(db_session):
 
 def test_get_league_count(db_session):
     league_count = crud.get_league_count(db_session)
-    assert league_count == 5
\ No newline at end of file
+    assert league_count == 5
+
+#test keyset pagination
+def test_get_performances_with_cursor(db_session):
+    """Tests that walking the performances with a cursor returns every row once"""
+    seen = []
+    cursor = None
+    while True:
+        page = crud.get_performances(db_session, limit=300, cursor=cursor)
+        seen.extend(performance.performance_id for performance in page)
+        if len(page) < 300:
+            break
+        cursor = {"id": page[-1].performance_id}
+    assert len(seen) == 1100
+    assert len(set(seen)) == 1100
+
+
+def test_get_players_with_date_cursor(db_session):
+    """Tests that the cursor seeks past the last changed date and id of the previous page"""
+    first_page = crud.get_players(db_session, limit=100, min_last_changed_date=test_date)
+    last_player = first_page[-1]
+    cursor = {"id": last_player.player_id, "last_changed_date": last_player.last_changed_date}
+    second_page = crud.get_players(db_session, limit=100, min_last_changed_date=test_date, cursor=cursor)
+    assert second_page == crud.get_players(db_session, skip=100, limit=100, min_last_changed_date=test_date)
+
+
+
+#test that filtered queries use an index
+def query_plans(db_session, crud_function, **kwargs):
+    """Runs a crud function and returns the EXPLAIN QUERY PLAN details of its first statement"""
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        crud_function(db_session, **kwargs)
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    statement, parameters = statements[0]
+    plan = db_session.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+    return [row[-1] for row in plan]
+
+
+@pytest.mark.parametrize("crud_function, table, kwargs", [
+    (crud.get_players, "player", {"min_last_changed_date": test_date}),
+    (crud.get_players, "player", {"first_name": "Bryce"}),
+    (crud.get_players, "player", {"last_name": "Young"}),
+    (crud.get_players, "player", {"first_name": "Bryce", "last_name": "Young"}),
+    (crud.get_performances, "performance", {"min_last_changed_date": test_date}),
+    (crud.get_performances, "performance", {"season": 2023}),
+    (crud.get_performances, "performance", {"season": 2023, "week_from": 2, "week_to": 4}),
+    (crud.get_leagues, "league", {"min_last_changed_date": test_date}),
+    (crud.get_leagues, "league", {"league_name": "Pigskin Prodigal Fantasy League"}),
+    (crud.get_teams, "team", {"min_last_changed_date": test_date}),
+    (crud.get_teams, "team", {"team_name": "Keep Pounding"}),
+    (crud.get_teams, "team", {"league_id": 5001}),
+])
+def test_filtered_queries_use_index(db_session, crud_function, table, kwargs):
+    """Tests that a filtered query searches an index instead of scanning the table"""
+    plans = query_plans(db_session, crud_function, **kwargs)
+    table_plans = [plan for plan in plans if plan.split()[1:2] == [table]]
+    assert table_plans
+    for plan in table_plans:
+        assert "USING" in plan and "INDEX" in plan, plans
+
+
+def test_get_counts(db_session):
+    """Tests that all the counts come back from one statement"""
+    counts = crud.get_counts(db_session)
+    assert counts == {"league_count": 5, "team_count": 20, "player_count": 550}
+
+
+@pytest.mark.skipif(database.SQLITE_READ_ONLY, reason="the database is opened read-only")
+def test_data_version_changes_on_write(db_session):
+    """Tests that a write through a session invalidates the cached counts"""
+    cache.counts_cache.get("counts", lambda: crud.get_counts(db_session))
+    version = cache.data_version()
+    db_session.add(models.League(league_id=9999, league_name="Test", scoring_type="PPR", last_changed_date=test_date))
+    db_session.flush()
+    assert cache.data_version() != version
+    assert cache.counts_cache.get("counts", lambda: crud.get_counts(db_session))["league_count"] == 6
+    db_session.rollback()
+
+
+@pytest.mark.skipif(database.SQLITE_READ_ONLY, reason="the database is opened read-only")
+def test_table_version_changes_on_delete(db_session):
+    """Tests that a delete changes the version behind the ETags, though the
+    latest last_changed_date of the table stays the same"""
+    tables = (models.TeamPlayer,)
+    version, changed_at = crud.get_table_version(db_session, tables)
+    last_changed_date = crud.get_last_changed_date(db_session, tables)
+    db_session.delete(db_session.scalars(select(models.TeamPlayer).limit(1)).one())
+    db_session.flush()
+    assert crud.get_last_changed_date(db_session, tables) == last_changed_date
+    assert crud.get_table_version(db_session, tables)[0] == version + 1
+    db_session.rollback()
+
+
+def test_snapshot_table_version(db_session):
+    tables = (models.Player, models.Performance)
+    assert snapshot.get_table_version(snapshot.current(), tables) == crud.get_table_version(db_session, tables)
+
+
+#test the asyncio query functions
+def run_async_crud(crud_function, **kwargs):
+    """Runs an async_crud function against the database and returns its result"""
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from database import ASYNC_DATABASE_URL
+
+    async def run():
+        async_engine = create_async_engine(ASYNC_DATABASE_URL)
+        try:
+            async with async_sessionmaker(bind=async_engine)() as session:
+                return await crud_function(session, **kwargs)
+        finally:
+            await async_engine.dispose()
+
+    return asyncio.run(run())
+
+
+def test_async_get_players():
+    players = run_async_crud(async_crud.get_players, skip=0, limit=10000, min_last_changed_date=test_date)
+    assert len(players) == 550
+    assert all(player.performances is not None for player in players)
+
+
+def test_async_get_league():
+    league = run_async_crud(async_crud.get_league, league_id=5002)
+    assert len(league.teams) == 8
+
+
+def test_async_get_counts():
+    counts = run_async_crud(async_crud.get_counts)
+    assert counts == {"league_count": 5, "team_count": 20, "player_count": 550}
+
+
+
+#test the season and week filters
+def test_get_performances_by_week(db_session):
+    """Tests the integer season and week columns match the week_number"""
+    performances = crud.get_performances(db_session, season=2023, week_from=2, week_to=2, limit=10000)
+    assert len(performances) == 550
+    assert {performance.week_number for performance in performances} == {"2023_2"}
+    assert (performances[0].season, performances[0].week) == (2023, 2)
+    assert crud.get_performances(db_session, season=2022) == []
+
+
+def test_add_columns_derives_week(tmp_path):
+    """Tests the season and week columns added to an existing table are filled in"""
+    old_engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with old_engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE TABLE performance (performance_id INTEGER PRIMARY KEY, week_number VARCHAR NOT NULL, "
+            "fantasy_points FLOAT NOT NULL, last_changed_date DATE NOT NULL, player_id INTEGER)"
+        )
+        connection.exec_driver_sql("INSERT INTO performance VALUES (1, '2023_12', 10.0, '2024-01-01', 1)")
+    assert migrate.add_columns(old_engine) == ["performance.season", "performance.week"]
+    assert migrate.add_columns(old_engine) == []
+    with old_engine.connect() as connection:
+        assert connection.exec_driver_sql("SELECT season, week FROM performance").one() == (2023, 12)
+    old_engine.dispose()
+
+
+def test_restore_rollback_journal(tmp_path):
+    """Tests the migrated file is left in rollback mode with its writes in it"""
+    wal_engine = create_engine(f"sqlite:///{tmp_path / 'wal.db'}")
+    database.set_sqlite_pragmas(wal_engine, {"journal_mode": "WAL"})
+    with wal_engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE league (league_id INTEGER PRIMARY KEY)")
+        connection.exec_driver_sql("INSERT INTO league VALUES (1)")
+    assert migrate.restore_rollback_journal(wal_engine) == "delete"
+    wal_engine.dispose()
+    assert not (tmp_path / "wal.db-wal").exists()
+    with sqlite3.connect(tmp_path / "wal.db") as connection:
+        assert connection.execute("PRAGMA journal_mode").fetchone() == ("delete",)
+        assert connection.execute("SELECT league_id FROM league").fetchall() == [(1,)]
+
+
+#test that the in-memory snapshot answers the same as the database
+@pytest.mark.parametrize("function_name, id_attr, kwargs", [
+    ("get_players", "player_id", {"skip": 0, "limit": 10000}),
+    ("get_players", "player_id", {"skip": 40, "limit": 25, "min_last_changed_date": test_date}),
+    ("get_players", "player_id", {"first_name": "Bryce", "last_name": "Young"}),
+    ("get_players", "player_id", {"cursor": {"id": 150}, "limit": 30}),
+    ("get_players", "player_id", {"player_ids": [109, 102, 650, 999999], "limit": 4}),
+    ("get_performances", "performance_id", {"skip": 0, "limit": 10000, "min_last_changed_date": test_date}),
+    ("get_performances", "performance_id", {"cursor": {"id": 1000, "last_changed_date": test_date}, "min_last_changed_date": test_date}),
+    ("get_performances", "performance_id", {"season": 2023, "week_from": 2, "limit": 10000}),
+    ("get_performances", "performance_id", {"week_to": 1, "skip": 20, "limit": 30}),
+    ("get_leagues", "league_id", {"league_name": "Pigskin Prodigal Fantasy League"}),
+    ("get_teams", "team_id", {"league_id": 5001}),
+    ("get_teams", "team_id", {"skip": 3, "limit": 5, "min_last_changed_date": test_date}),
+    ("get_season_scores", "player_id", {"limit": 50}),
+    ("get_season_scores", "player_id", {"season": 2023, "position": "WR", "sort_by": "max_points", "descending": False, "skip": 10}),
+    ("get_weekly_leaderboard", "player_id", {"season": 2023, "week": 2, "limit": 25}),
+    ("get_weekly_leaderboard", "player_id", {"season": 2023, "week": 1, "position": "TE", "limit": 100}),
+    ("get_team_week_scores", "team_id", {"limit": 1000}),
+    ("search_players", "player_id", {"query": "ja", "limit": 50}),
+    ("get_changes", "change_id", {"limit": 5000}),
+    ("get_changes", "change_id", {"since": 500, "limit": 100}),
+    ("search_players", "player_id", {"query": "justn jeferson", "match": "fuzzy"}),
+    ("get_team_week_scores", "team_id", {"league_id": 5002, "season": 2023, "week": 2}),
+])
+def test_snapshot_matches_crud(db_session, function_name, id_attr, kwargs):
+    """Tests that the snapshot returns the same rows in the same order as crud.py"""
+    expected = [getattr(row, id_attr) for row in getattr(crud, function_name)(db_session, **kwargs)]
+    rows = getattr(snapshot, function_name)(snapshot.current(), **kwargs)
+    assert [getattr(row, id_attr) for row in rows] == expected
+
+
+def test_snapshot_nested_rows():
+    """Tests the snapshot links rows like the relationships in models.py"""
+    current = snapshot.current()
+    assert len(snapshot.get_league(current, league_id=5002).teams) == 8
+    first_team = snapshot.get_teams(current, min_last_changed_date=test_date)[0]
+    assert len(first_team.players) == 7
+    assert snapshot.get_counts(current) == {"league_count": 5, "team_count": 20, "player_count": 550}
+
+
+#test the materialized scoring tables
+@pytest.fixture(scope="function")
+def scratch_session(tmp_path):
+    """This starts a session on an empty database with every table and the
+    scoring triggers, for tests that write"""
+    scratch_engine = create_engine(f"sqlite:///{tmp_path / 'scratch.db'}")
+    migrate.create_tables(scratch_engine)
+    migrate.create_scoring_triggers(scratch_engine)
+    session = Session(scratch_engine)
+    yield session
+    session.close()
+    scratch_engine.dispose()
+
+
+def add_performances(session, rows):
+    for performance_id, player_id, week_number, fantasy_points, last_changed_date in rows:
+        session.merge(models.Performance(
+            performance_id=performance_id, player_id=player_id, week_number=week_number,
+            fantasy_points=fantasy_points, last_changed_date=last_changed_date))
+    session.flush()
+
+
+def season_totals(session):
+    return {
+        (row.player_id, row.season): (row.games_played, row.total_points, row.max_points)
+        for row in session.query(models.PlayerSeasonScore)
+    }
+
+
+def test_get_season_scores(db_session):
+    """Tests season totals are sorted and filtered"""
+    season_scores = crud.get_season_scores(db_session, season=2023, position="QB", limit=5)
+    assert len(season_scores) == 5
+    totals = [season_score.total_points for season_score in season_scores]
+    assert totals == sorted(totals, reverse=True)
+    assert crud.get_season_scores(db_session, season=1999) == []
+
+
+def test_refresh_season_scores_incrementally(scratch_session):
+    """Tests the season totals only recompute changed players and pick up updates and deletes"""
+    for player_id in (1, 2):
+        scratch_session.add(models.Player(player_id=player_id, first_name="A", last_name="B", position="QB", last_changed_date=date(2024, 1, 1)))
+    add_performances(scratch_session, [
+        (1, 1, "2023_1", 10.0, date(2024, 1, 1)),
+        (2, 1, "2023_2", 20.0, date(2024, 1, 1)),
+        (3, 2, "2023_1", 5.0, date(2024, 1, 1)),
+        (4, 2, "2024_1", 7.0, date(2024, 1, 1)),
+    ])
+    assert scoring.refresh_all(scratch_session)["player_season_score"] == 3
+    assert season_totals(scratch_session) == {(1, 2023): (2, 30.0, 20.0), (2, 2023): (1, 5.0, 5.0), (2, 2024): (1, 7.0, 7.0)}
+
+    add_performances(scratch_session, [(2, 1, "2023_2", 25.0, date(2024, 2, 1))])
+    scoring.refresh_all(scratch_session)
+    assert season_totals(scratch_session)[(1, 2023)] == (2, 35.0, 25.0)
+
+    # Only the players changed since the last refresh's date are recomputed
+    add_performances(scratch_session, [(3, 2, "2023_1", 6.0, date(2024, 3, 1))])
+    assert scoring.refresh_all(scratch_session)["player_season_score"] == 2
+    assert season_totals(scratch_session)[(2, 2023)] == (1, 6.0, 6.0)
+
+    scratch_session.query(models.Performance).filter(models.Performance.performance_id == 4).delete()
+    scoring.refresh_all(scratch_session)
+    assert (2, 2024) not in season_totals(scratch_session)
+
+
+def test_refresh_season_scores_after_delete_and_move(scratch_session):
+    """Tests the totals of a season are recomputed when only some of its
+    performances are deleted, or one moves to another season"""
+    for player_id in (1, 2):
+        scratch_session.add(models.Player(player_id=player_id, first_name="A", last_name="B", position="QB", last_changed_date=date(2024, 1, 1)))
+    # Player 2's later row moves the watermark past player 1's rows
+    add_performances(scratch_session, [
+        (1, 1, "2023_1", 10.0, date(2024, 1, 1)),
+        (2, 1, "2023_2", 20.0, date(2024, 1, 1)),
+        (3, 1, "2023_3", 5.0, date(2024, 1, 1)),
+        (4, 2, "2023_1", 1.0, date(2024, 2, 1)),
+    ])
+    scoring.refresh_all(scratch_session)
+    assert season_totals(scratch_session)[(1, 2023)] == (3, 35.0, 20.0)
+
+    scratch_session.query(models.Performance).filter(models.Performance.performance_id == 2).delete()
+    scoring.refresh_all(scratch_session)
+    assert season_totals(scratch_session)[(1, 2023)] == (2, 15.0, 10.0)
+
+    # The moved row keeps its date, so only the trigger finds its old season
+    scratch_session.get(models.Performance, 3).week_number = "2024_1"
+    scratch_session.flush()
+    scoring.refresh_all(scratch_session)
+    totals = season_totals(scratch_session)
+    assert (totals[(1, 2023)], totals[(1, 2024)]) == ((1, 10.0, 10.0), (1, 5.0, 5.0))
+
+
+def test_get_weekly_leaderboard(db_session):
+    """Tests the leaderboard matches ranking the week's performances directly"""
+    performances = [
+        performance for performance in crud.get_performances(db_session, limit=10000)
+        if performance.week_number == "2023_1" and performance.player.position == "QB"
+    ]
+    expected = sorted(performances, key=lambda performance: (-performance.fantasy_points, performance.player_id))[:10]
+    entries = crud.get_weekly_leaderboard(db_session, season=2023, week=1, position="QB", limit=10)
+    assert [entry.player_id for entry in entries] == [performance.player_id for performance in expected]
+    assert [entry.rank for entry in entries] == list(range(1, 11))
+
+
+def test_refresh_weekly_leaderboards(scratch_session):
+    """Tests the leaderboards of a week are ranked again when a performance or player changes"""
+    for player_id, position in ((1, "QB"), (2, "QB"), (3, "WR")):
+        scratch_session.add(models.Player(player_id=player_id, first_name="A", last_name="B", position=position, last_changed_date=date(2024, 1, 1)))
+    add_performances(scratch_session, [
+        (1, 1, "2023_1", 10.0, date(2024, 1, 1)),
+        (2, 2, "2023_1", 20.0, date(2024, 1, 1)),
+        (3, 3, "2023_1", 15.0, date(2024, 1, 1)),
+        (4, 3, "2023_10", 1.0, date(2024, 1, 1)),
+    ])
+    scoring.refresh_all(scratch_session)
+
+    def board(week, position=None):
+        return [entry.player_id for entry in crud.get_weekly_leaderboard(scratch_session, 2023, week, position)]
+
+    assert board(1) == [2, 3, 1]
+    assert board(1, "QB") == [2, 1]
+    assert board(10) == [3]
+
+    scratch_session.get(models.Player, 3).position = "QB"
+    scratch_session.get(models.Player, 3).last_changed_date = date(2024, 2, 1)
+    add_performances(scratch_session, [(1, 1, "2023_1", 30.0, date(2024, 2, 1))])
+    scoring.refresh_all(scratch_session)
+    assert board(1) == [1, 2, 3]
+    assert board(1, "QB") == [1, 2, 3]
+    assert board(1, "WR") == []
+    assert crud.get_weekly_leaderboard(scratch_session, 2023, 10)[0].position == "QB"
+
+
+def test_refresh_weekly_leaderboards_after_delete(scratch_session):
+    """Tests a week is ranked again when one of its performances is deleted
+    and the week still has other performances"""
+    for player_id in (1, 2, 3):
+        scratch_session.add(models.Player(player_id=player_id, first_name="A", last_name="B", position="QB", last_changed_date=date(2024, 1, 1)))
+    # The later row in week 2 moves the watermark past the rows of week 1
+    add_performances(scratch_session, [
+        (1, 1, "2023_1", 10.0, date(2024, 1, 1)),
+        (2, 2, "2023_1", 20.0, date(2024, 1, 1)),
+        (3, 3, "2023_1", 15.0, date(2024, 1, 1)),
+        (4, 1, "2023_2", 1.0, date(2024, 2, 1)),
+    ])
+    scoring.refresh_all(scratch_session)
+    scratch_session.query(models.Performance).filter(models.Performance.performance_id == 2).delete()
+    scoring.refresh_all(scratch_session)
+    entries = crud.get_weekly_leaderboard(scratch_session, 2023, 1)
+    assert [(entry.rank, entry.player_id) for entry in entries] == [(1, 3), (2, 1)]
+    assert [entry.player_id for entry in crud.get_weekly_leaderboard(scratch_session, 2023, 1, "QB")] == [3, 1]
+
+
+def test_get_team_week_scores(db_session):
+    """Tests a league's weekly totals match adding up its players' performances"""
+    teams = crud.get_teams(db_session, league_id=5002)
+    expected = {
+        team.team_id: sum(
+            performance.fantasy_points
+            for player in team.players
+            for performance in player.performances
+            if performance.week_number == "2023_2"
+        )
+        for team in teams
+    }
+    team_scores = crud.get_team_week_scores(db_session, league_id=5002, season=2023, week=2)
+    assert {team_score.team_id: team_score.total_points for team_score in team_scores} == pytest.approx(expected)
+    totals = [team_score.total_points for team_score in team_scores]
+    assert totals == sorted(totals, reverse=True)
+
+
+def test_refresh_team_week_scores(scratch_session):
+    """Tests team totals are added up again when a performance, roster or team changes"""
+    for player_id in (1, 2, 3):
+        scratch_session.add(models.Player(player_id=player_id, first_name="A", last_name="B", position="QB", last_changed_date=date(2024, 1, 1)))
+    for team_id, league_id in ((10, 100), (20, 100)):
+        scratch_session.add(models.Team(team_id=team_id, team_name=f"Team {team_id}", league_id=league_id, last_changed_date=date(2024, 1, 1)))
+    for team_id, player_id in ((10, 1), (10, 2), (20, 3)):
+        scratch_session.add(models.TeamPlayer(team_id=team_id, player_id=player_id, last_changed_date=date(2024, 1, 1)))
+    add_performances(scratch_session, [
+        (1, 1, "2023_1", 10.0, date(2024, 1, 1)),
+        (2, 2, "2023_1", 5.0, date(2024, 1, 1)),
+        (3, 3, "2023_1", 7.0, date(2024, 1, 1)),
+        (4, 1, "2023_2", 3.0, date(2024, 1, 1)),
+    ])
+    assert scoring.refresh_all(scratch_session)["team_week_score"] == 3
+
+    def team_totals():
+        return {
+            (row.team_id, row.week): (row.total_points, row.players_scored)
+            for row in crud.get_team_week_scores(scratch_session)
+        }
+
+    assert team_totals() == {(10, 1): (15.0, 2), (10, 2): (3.0, 1), (20, 1): (7.0, 1)}
+
+    add_performances(scratch_session, [(3, 3, "2023_1", 9.0, date(2024, 2, 1))])
+    scoring.refresh_all(scratch_session)
+    assert team_totals()[(20, 1)] == (9.0, 1)
+
+    # Player 2 moves to team 20, so both teams change, though nothing is
+    # left of the roster row to find team 10 by date
+    scratch_session.query(models.TeamPlayer).filter(models.TeamPlayer.player_id == 2).delete()
+    scratch_session.add(models.TeamPlayer(team_id=20, player_id=2, last_changed_date=date(2024, 3, 1)))
+    scoring.refresh_all(scratch_session)
+    assert team_totals() == {(10, 1): (10.0, 1), (10, 2): (3.0, 1), (20, 1): (14.0, 2)}
+
+    scratch_session.query(models.Performance).filter(models.Performance.performance_id == 4).delete()
+    scoring.refresh_all(scratch_session)
+    assert (10, 2) not in team_totals()
+
+
+def test_refresh_team_week_scores_after_drop(scratch_session):
+    """Tests a team's totals are added up again when a player is dropped, or
+    a performance deleted, without any change to the team row"""
+    for player_id in (1, 2, 3):
+        scratch_session.add(models.Player(player_id=player_id, first_name="A", last_name="B", position="QB", last_changed_date=date(2024, 1, 1)))
+    for team_id in (10, 20):
+        scratch_session.add(models.Team(team_id=team_id, team_name=f"Team {team_id}", league_id=100, last_changed_date=date(2024, 1, 1)))
+    for team_id, player_id in ((10, 1), (10, 2), (20, 3)):
+        scratch_session.add(models.TeamPlayer(team_id=team_id, player_id=player_id, last_changed_date=date(2024, 1, 1)))
+    # Player 3's later row moves the watermark past team 10's rows
+    add_performances(scratch_session, [
+        (1, 1, "2023_1", 10.0, date(2024, 1, 1)),
+        (2, 2, "2023_1", 5.0, date(2024, 1, 1)),
+        (3, 1, "2023_2", 4.0, date(2024, 1, 1)),
+        (4, 2, "2023_2", 6.0, date(2024, 1, 1)),
+        (5, 3, "2023_1", 7.0, date(2024, 2, 1)),
+    ])
+    scoring.refresh_all(scratch_session)
+
+    def team_10_totals():
+        return {
+            row.week: (row.total_points, row.players_scored)
+            for row in crud.get_team_week_scores(scratch_session, team_id=10)
+        }
+
+    assert team_10_totals() == {1: (15.0, 2), 2: (10.0, 2)}
+
+    scratch_session.delete(scratch_session.get(models.Performance, 3))
+    scratch_session.flush()
+    scoring.refresh_all(scratch_session)
+    assert team_10_totals() == {1: (15.0, 2), 2: (6.0, 1)}
+
+    scratch_session.delete(scratch_session.get(models.TeamPlayer, (10, 2)))
+    scratch_session.flush()
+    scoring.refresh_all(scratch_session)
+    assert team_10_totals() == {1: (10.0, 1)}
+    assert scratch_session.query(models.ScoringChange).count() == 0
+
+
+#test the player name search
+def test_search_players_prefix(db_session):
+    """Tests every word of the query starts the first or last name"""
+    players = crud.search_players(db_session, query="bry yo")
+    assert [(player.first_name, player.last_name) for player in players] == [("Bryce", "Young")]
+    players = crud.search_players(db_session, query="JA", limit=50)
+    assert players and all(
+        player.first_name.lower().startswith("ja") or player.last_name.lower().startswith("ja")
+        for player in players
+    )
+    scores = [player.score for player in players]
+    assert scores == sorted(scores, reverse=True)
+    assert crud.search_players(db_session, query="%") == []
+
+
+@pytest.mark.parametrize("query", ["br", "b y"])
+def test_search_players_short_words_use_index(db_session, query):
+    """Tests words too short for the trigram index search the name indexes"""
+    plans = query_plans(db_session, crud.search_players, query=query)
+    player_plans = [plan for plan in plans if plan.split()[1:2] == ["player"]]
+    assert player_plans == [
+        "SEARCH player USING INDEX ix_player_first_name_nocase (first_name>? AND first_name<?)",
+        "SEARCH player USING INDEX ix_player_last_name_nocase (last_name>? AND last_name<?)",
+    ], plans
+
+
+def test_search_players_fuzzy(db_session):
+    """Tests misspelled names are found, the closest first"""
+    players = crud.search_players(db_session, query="justn jeferson", match="fuzzy")
+    assert (players[0].first_name, players[0].last_name) == ("Justin", "Jefferson")
+    assert crud.search_players(db_session, query="justn jeferson") == []
+
+
+def test_search_index_follows_player_changes(scratch_session):
+    """Tests the triggers keep the search index in sync with the player table"""
+    search.create_search_index(scratch_session.get_bind())
+    scratch_session.add(models.Player(player_id=1, first_name="Bryce", last_name="Young", position="QB", last_changed_date=date(2024, 1, 1)))
+    scratch_session.flush()
+    assert [player.player_id for player in crud.search_players(scratch_session, query="young")] == [1]
+
+    scratch_session.get(models.Player, 1).last_name = "Old"
+    scratch_session.flush()
+    assert crud.search_players(scratch_session, query="young") == []
+    assert [player.player_id for player in crud.search_players(scratch_session, query="old")] == [1]
+
+    scratch_session.delete(scratch_session.get(models.Player, 1))
+    scratch_session.flush()
+    assert crud.search_players(scratch_session, query="bryce", match="fuzzy") == []
+
+
+#test the changes feed
+def test_get_changes_full_copy(db_session):
+    """Tests token 0 returns every row of every table in the feed once"""
+    entries = crud.get_changes(db_session, since=0, limit=100000)
+    counts = {}
+    for entry in entries:
+        counts[entry.entity] = counts.get(entry.entity, 0) + 1
+        assert getattr(entry, entry.entity) is not None
+    assert counts == {
+        "league": 5, "team": 20, "player": 550,
+        "team_player": db_session.query(models.TeamPlayer).count(),
+        "performance": db_session.query(models.Performance).count(),
+    }
+    change_ids = [entry.change_id for entry in entries]
+    assert change_ids == sorted(change_ids)
+    team_player = next(entry.team_player for entry in entries if entry.entity == "team_player")
+    assert team_player.last_changed_date is not None
+
+
+def test_changes_after_token(scratch_session):
+    """Tests the triggers log changes and each row comes back once, with its latest change"""
+    changes.create_change_log(scratch_session.get_bind())
+    for row in (
+        models.League(league_id=1, league_name="A", scoring_type="PPR", last_changed_date=date(2024, 1, 1)),
+        models.Team(team_id=10, team_name="T", league_id=1, last_changed_date=date(2024, 1, 1)),
+        models.Player(player_id=1, first_name="A", last_name="B", position="QB", last_changed_date=date(2024, 1, 1)),
+        models.TeamPlayer(team_id=10, player_id=1, last_changed_date=date(2024, 1, 1)),
+    ):
+        scratch_session.add(row)
+        scratch_session.flush()
+    first_sync = crud.get_changes(scratch_session)
+    assert [(entry.entity, entry.operation) for entry in first_sync] == [
+        ("league", "upsert"), ("team", "upsert"), ("player", "upsert"), ("team_player", "upsert")]
+    token = first_sync[-1].change_id
+    assert crud.get_changes(scratch_session, since=token) == []
+
+    scratch_session.get(models.League, 1).league_name = "B"
+    scratch_session.flush()
+    scratch_session.delete(scratch_session.get(models.TeamPlayer, (10, 1)))
+    scratch_session.flush()
+    scratch_session.get(models.League, 1).league_name = "C"
+    scratch_session.flush()
+    entries = crud.get_changes(scratch_session, since=token)
+    assert [(entry.entity, entry.operation, entry.key) for entry in entries] == [
+        ("team_player", "delete", {"team_id": 10, "player_id": 1}),
+        ("league", "upsert", {"league_id": 1}),
+    ]
+    assert entries[0].team_player is None
+    assert entries[1].league.league_name == "C"
+    assert [entry.change_id for entry in crud.get_changes(scratch_session, since=token, limit=1)] == [entries[0].change_id]
+    assert scratch_session.query(models.ChangeLog).count() == 4
+
+
+def test_changes_query_is_a_range(db_session):
+    """Tests a page of changes reads a range of the log instead of grouping all of it"""
+    plans = query_plans(db_session, crud.get_changes, since=1000, limit=10)
+    assert plans == ["SEARCH change_log USING INTEGER PRIMARY KEY (rowid>?)"], plans
+
+
+def test_create_change_log_replaces_old_triggers(scratch_session):
+    """Tests triggers from an older changes.py are replaced and the log compacted"""
+    scratch_engine = scratch_session.get_bind()
+    with scratch_engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE TRIGGER league_change_update AFTER UPDATE ON league BEGIN "
+            "INSERT INTO change_log (table_name, operation, row_key) "
+            "VALUES ('league', 'upsert', json_object('league_id', new.league_id)); END"
+        )
+        connection.exec_driver_sql("INSERT INTO change_log (table_name, operation, row_key) VALUES "
+                                   "('league', 'upsert', '{\"league_id\":1}'), ('league', 'upsert', '{\"league_id\":1}')")
+    assert "league_change_update" in changes.create_change_log(scratch_engine)
+    assert changes.create_change_log(scratch_engine) == []
+    assert [change.change_id for change in scratch_session.query(models.ChangeLog)] == [2]
+
+
+#test the connection pool settings
+def test_pool_options_from_environment():
+    options = database.pool_options(environ={
+        "SWC_DB_POOL_SIZE": "20",
+        "SWC_DB_MAX_OVERFLOW": "0",
+        "SWC_DB_POOL_PRE_PING": "true",
+        "SWC_DB_POOL_RECYCLE": "3600",
+    })
+    assert issubclass(options["poolclass"], QueuePool)
+    assert options["pool_size"] == 20
+    assert options["max_overflow"] == 0
+    assert options["pool_pre_ping"] is True
+    assert options["pool_recycle"] == 3600
+
+
+def test_pool_options_null_pool():
+    options = database.pool_options(environ={"SWC_DB_POOL_CLASS": "null", "SWC_DB_POOL_SIZE": "20"})
+    assert issubclass(options["poolclass"], NullPool)
+    assert "pool_size" not in options
+
+
+def test_pool_options_unknown_pool():
+    with pytest.raises(ValueError):
+        database.pool_options(environ={"SWC_DB_POOL_CLASS": "bogus"})
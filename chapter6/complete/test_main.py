@@ -1,6 +1,18 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import pytest
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from fastapi.testclient import TestClient
+import main
 from main import app
 
+import compression, crud, schemas, serialization
+from database import SessionLocal
+
 client = TestClient(app)
 
 
@@ -48,6 +60,53 @@ def test_read_performances_by_date():
     assert len(response.json()) == 550
 
 
+# test /v0/performances/ with cursor pagination
+def test_read_performances_with_cursor():
+    performance_ids = []
+    url = "/v0/performances/?limit=500"
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        performance_ids.extend(p["performance_id"] for p in response.json())
+        next_cursor = response.headers.get("X-Next-Cursor")
+        url = f"/v0/performances/?limit=500&cursor={next_cursor}" if next_cursor else None
+    assert len(performance_ids) == 1100
+    assert len(set(performance_ids)) == 1100
+
+
+def test_read_players_with_cursor_and_date():
+    first_page = client.get("/v0/players/?limit=200&minimum_last_changed_date=2024-04-01")
+    next_cursor = first_page.headers["X-Next-Cursor"]
+    second_page = client.get(
+        f"/v0/players/?limit=200&minimum_last_changed_date=2024-04-01&cursor={next_cursor}"
+    )
+    skip_page = client.get("/v0/players/?skip=200&limit=200&minimum_last_changed_date=2024-04-01")
+    assert second_page.status_code == 200
+    assert second_page.json() == skip_page.json()
+
+
+def test_read_players_with_bad_cursor():
+    response = client.get("/v0/players/?cursor=not-a-cursor")
+    assert response.status_code == 400
+
+
+# test /v0/performances/export
+def test_export_performances():
+    response = client.get("/v0/performances/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.text.splitlines()
+    assert len(lines) == 1100
+    first_page = client.get("/v0/performances/?limit=1").json()
+    assert json.loads(lines[0]) == first_page[0]
+
+
+def test_export_performances_by_date():
+    response = client.get("/v0/performances/export?minimum_last_changed_date=2024-04-01")
+    assert response.status_code == 200
+    assert len(response.text.splitlines()) == 550
+
+
 # test /v0/leagues/{league_id}/
 def test_read_leagues_with_id():
     response = client.get("/v0/leagues/5002/")
@@ -76,6 +135,37 @@ def test_read_teams_for_one_league():
     assert len(response.json()) == 12
 
 
+# test /v0/bulk/{table_name}
+@pytest.mark.parametrize("table_name, row_count", [
+    ("players", 550),
+    ("performances", 1100),
+    ("leagues", 5),
+    ("teams", 20),
+])
+def test_read_bulk_parquet_file(table_name, row_count):
+    pq = pytest.importorskip("pyarrow.parquet")
+    response = client.get(f"/v0/bulk/{table_name}?file_format=parquet")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/vnd.apache.parquet"
+    assert pq.read_table(io.BytesIO(response.content)).num_rows == row_count
+
+
+def test_read_bulk_arrow_file():
+    pa = pytest.importorskip("pyarrow")
+    response = client.get("/v0/bulk/performances?file_format=arrow")
+    assert response.status_code == 200
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.num_rows == 1100
+    assert table.column_names == ["performance_id", "week_number", "season", "week", "fantasy_points", "last_changed_date", "player_id"]
+
+
+def test_read_bulk_file_not_modified():
+    pytest.importorskip("pyarrow")
+    response = client.get("/v0/bulk/leagues")
+    not_modified = client.get("/v0/bulk/leagues", headers={"If-None-Match": response.headers["ETag"]})
+    assert not_modified.status_code == 304
+
+
 # test the count functions
 def test_counts():
     response = client.get("/v0/counts/")
@@ -84,3 +174,364 @@ def test_counts():
     assert response_data["league_count"] == 5
     assert response_data["team_count"] == 20
     assert response_data["player_count"] == 550
+
+
+def test_counts_are_cached():
+    client.get("/v0/counts/")
+    response = client.get("/v0/counts/")
+    assert response.status_code == 200
+    assert response.json()["league_count"] == 5
+    assert response.headers["X-SQL-Statement-Count"] == "0"
+
+
+def test_read_players_by_ids():
+    response = client.get("/v0/players/?ids=109,102,650&limit=1")
+    assert response.status_code == 200
+    assert [player["player_id"] for player in response.json()] == [102, 109, 650]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_read_players_by_ids_statement_count():
+    client.get("/v0/players/?ids=101")
+    ids = ",".join(str(player_id) for player_id in range(101, 401))
+    response = client.get(f"/v0/players/?ids={ids}")
+    assert len(response.json()) == 300
+    assert int(response.headers["X-SQL-Statement-Count"]) <= 2
+
+
+@pytest.mark.parametrize("ids", ["101,abc", ",".join(str(player_id) for player_id in range(1, 502))])
+def test_read_players_by_ids_invalid(ids):
+    response = client.get(f"/v0/players/?ids={ids}")
+    assert response.status_code == 400
+
+
+# test sparse fieldsets
+def test_read_players_with_fields():
+    client.get("/v0/players/?limit=1&fields=player_id")
+    response = client.get("/v0/players/?limit=3&fields=last_name,player_id")
+    assert response.status_code == 200
+    assert response.json()[0] == {"player_id": 101, "last_name": "McKee"}
+    assert int(response.headers["X-SQL-Statement-Count"]) <= 1
+
+
+def test_read_teams_with_nested_fields():
+    response = client.get("/v0/teams/?league_id=5001&fields=team_name,players")
+    assert response.status_code == 200
+    team = response.json()[0]
+    assert list(team) == ["team_name", "players"]
+    assert len(team["players"]) > 0
+
+
+def test_read_performances_fields_with_date_cursor():
+    first_page = client.get("/v0/performances/?limit=5&minimum_last_changed_date=2024-04-01&fields=fantasy_points")
+    assert list(first_page.json()[0]) == ["fantasy_points"]
+    cursor = first_page.headers["X-Next-Cursor"]
+    second_page = client.get(f"/v0/performances/?limit=5&minimum_last_changed_date=2024-04-01&cursor={cursor}")
+    full_page = client.get("/v0/performances/?limit=5&skip=5&minimum_last_changed_date=2024-04-01")
+    assert second_page.json() == full_page.json()
+
+
+def test_read_players_unknown_field():
+    response = client.get("/v0/players/?fields=player_id,salary")
+    assert response.status_code == 400
+
+
+# test that nested lists are loaded without a query per row
+def test_read_players_statement_count():
+    client.get("/v0/players/?limit=1")
+    small_page = client.get("/v0/players/?limit=10")
+    large_page = client.get("/v0/players/?limit=500")
+    assert small_page.status_code == 200
+    assert large_page.status_code == 200
+    assert small_page.headers["X-SQL-Statement-Count"] == large_page.headers["X-SQL-Statement-Count"]
+    assert int(large_page.headers["X-SQL-Statement-Count"]) <= 2
+
+
+def test_read_teams_statement_count():
+    client.get("/v0/teams/?limit=1")
+    small_page = client.get("/v0/teams/?limit=2")
+    large_page = client.get("/v0/teams/?limit=20")
+    assert small_page.status_code == 200
+    assert large_page.status_code == 200
+    assert small_page.headers["X-SQL-Statement-Count"] == large_page.headers["X-SQL-Statement-Count"]
+    assert int(large_page.headers["X-SQL-Statement-Count"]) <= 2
+
+
+def test_server_timing_reports_database_use():
+    response = client.get("/v0/performances/?limit=5&skip=7")
+    timing = response.headers["Server-Timing"]
+    assert "db-checkout;dur=" in timing
+    assert "db-query;dur=" in timing
+    assert "db-session;dur=" in timing
+
+
+# test season totals
+def test_read_season_scores():
+    response = client.get("/v0/season_scores/?season=2023&position=RB&limit=10&sort_by=average_points")
+    assert response.status_code == 200
+    season_scores = response.json()
+    assert len(season_scores) == 10
+    averages = [season_score["average_points"] for season_score in season_scores]
+    assert averages == sorted(averages, reverse=True)
+    assert set(season_scores[0]) == {"player_id", "season", "games_played", "total_points", "average_points", "max_points", "last_changed_date"}
+
+
+def test_read_season_scores_for_player():
+    response = client.get("/v0/season_scores/?player_id=102")
+    performances = [performance for performance in client.get("/v0/performances/?limit=10000").json() if performance["player_id"] == 102]
+    assert response.json()[0]["games_played"] == len(performances)
+    assert response.json()[0]["total_points"] == pytest.approx(sum(performance["fantasy_points"] for performance in performances))
+
+
+# test the weekly leaderboards
+def test_read_weekly_leaderboard():
+    response = client.get("/v0/leaderboards/weekly/?season=2023&week=2&position=WR&limit=5")
+    assert response.status_code == 200
+    entries = response.json()
+    assert [entry["rank"] for entry in entries] == [1, 2, 3, 4, 5]
+    assert all(entry["position"] == "WR" for entry in entries)
+    points = [entry["fantasy_points"] for entry in entries]
+    assert points == sorted(points, reverse=True)
+    assert int(response.headers["X-SQL-Statement-Count"]) <= 2
+
+
+def test_read_weekly_leaderboard_limit():
+    assert client.get("/v0/leaderboards/weekly/?season=2023&week=2&limit=101").status_code == 422
+    assert client.get("/v0/leaderboards/weekly/?season=1999&week=1").json() == []
+
+
+# test the season and week filters
+def test_read_performances_by_week():
+    response = client.get("/v0/performances/?season=2023&week_from=1&week_to=1&limit=10000")
+    assert response.status_code == 200
+    performances = response.json()
+    assert len(performances) == 550
+    assert all(performance["week_number"] == "2023_1" and performance["week"] == 1 for performance in performances)
+    assert client.get("/v0/performances/?week_from=0").status_code == 422
+    assert client.get("/v0/performances/?week_from=2&week_to=4").status_code == 400
+
+
+# test the player name search
+def test_search_players():
+    response = client.get("/v0/players/search/?q=bry%20yo")
+    assert response.status_code == 200
+    players = response.json()
+    assert [player["last_name"] for player in players] == ["Young"]
+    assert set(players[0]) == {"player_id", "gsis_id", "first_name", "last_name", "position", "last_changed_date", "score"}
+
+
+def test_search_players_fuzzy():
+    players = client.get("/v0/players/search/?q=justn%20jeferson&match=fuzzy&limit=1").json()
+    assert [(player["first_name"], player["last_name"]) for player in players] == [("Justin", "Jefferson")]
+
+
+def test_search_players_validation():
+    assert client.get("/v0/players/search/?q=").status_code == 422
+    assert client.get("/v0/players/search/?q=bryce&match=exact").status_code == 422
+    assert client.get("/v0/players/search/?q=bryce&limit=51").status_code == 422
+
+
+# test the changes feed
+def test_read_changes():
+    response = client.get("/v0/changes/?limit=30")
+    assert response.status_code == 200
+    entries = response.json()
+    assert len(entries) == 30
+    assert response.headers["X-Change-Token"] == str(entries[-1]["change_id"])
+    assert entries[0]["entity"] == "league" and entries[0]["league"]["league_id"] == entries[0]["key"]["league_id"]
+    assert entries[0]["team"] is None
+    team_player_entry = client.get("/v0/changes/?since=575&limit=1").json()[0]
+    assert set(team_player_entry["team_player"]) == {"team_id", "player_id", "last_changed_date"}
+
+    token = response.headers["X-Change-Token"]
+    next_page = client.get(f"/v0/changes/?since={token}&limit=30").json()
+    assert next_page[0]["change_id"] > int(token)
+
+
+def test_read_changes_caught_up():
+    last_page = client.get("/v0/changes/?since=1000000")
+    assert last_page.json() == []
+    assert last_page.headers["X-Change-Token"] == "1000000"
+    assert client.get("/v0/changes/?limit=1001").status_code == 422
+
+
+# test the weekly team totals
+def test_read_team_scores():
+    response = client.get("/v0/team_scores/?league_id=5001&season=2023&week=1")
+    assert response.status_code == 200
+    team_scores = response.json()
+    assert len(team_scores) == len(client.get("/v0/teams/?league_id=5001").json())
+    assert all(team_score["league_id"] == 5001 for team_score in team_scores)
+    totals = [team_score["total_points"] for team_score in team_scores]
+    assert totals == sorted(totals, reverse=True)
+    assert set(team_scores[0]) == {"team_id", "league_id", "season", "week", "total_points", "players_scored", "last_changed_date"}
+
+
+# test response compression
+preferred_encoding = compression.ENCODINGS[0] if compression.ENCODINGS else None
+needs_gzip = pytest.mark.skipif("gzip" not in compression.ENCODINGS, reason="gzip compression is turned off")
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("gzip, deflate, br, zstd", preferred_encoding),
+    ("identity", None),
+    ("*;q=0", None),
+    ("*", preferred_encoding),
+    (None, None),
+])
+def test_negotiate_encoding(accept_encoding, expected):
+    assert compression.negotiate(accept_encoding) == expected
+
+
+def test_negotiate_encoding_q_values():
+    assert compression.negotiate("gzip;q=0.5, br;q=0.9", ("zstd", "br", "gzip")) == "br"
+    assert compression.negotiate("gzip, br;q=0", ("zstd", "br", "gzip")) == "gzip"
+    assert compression.negotiate("br, gzip", ("zstd", "br", "gzip")) == "br"
+
+
+@pytest.mark.parametrize("encoding", compression.ENCODINGS)
+def test_read_performances_compressed(encoding):
+    plain = client.get("/v0/performances/?limit=500", headers={"Accept-Encoding": "identity"})
+    compressed = client.get("/v0/performances/?limit=500", headers={"Accept-Encoding": encoding})
+    assert compressed.headers["Content-Encoding"] == encoding
+    assert int(compressed.headers["Content-Length"]) < len(plain.content) / 5
+    assert compressed.headers["Vary"] == "Accept-Encoding"
+    assert compressed.content == plain.content
+    assert compressed.headers["ETag"] == plain.headers["ETag"]
+
+
+@needs_gzip
+def test_small_response_not_compressed():
+    response = client.get("/v0/counts/", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+
+
+@needs_gzip
+def test_compressed_response_not_modified():
+    response = client.get("/v0/players/?limit=50", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    not_modified = client.get(
+        "/v0/players/?limit=50",
+        headers={"Accept-Encoding": "gzip", "If-None-Match": response.headers["ETag"]},
+    )
+    assert not_modified.status_code == 304
+
+
+@needs_gzip
+def test_large_body_compressed_in_thread_pool(monkeypatch):
+    """Tests large bodies are compressed off the event loop and small ones on it"""
+    compressed_off_loop = []
+
+    async def record_threadpool(function, *args):
+        compressed_off_loop.append(len(args[0]))
+        return function(*args)
+
+    monkeypatch.setattr(compression, "run_in_threadpool", record_threadpool)
+    compression.compressed_body_cache.clear()
+    small = client.get("/v0/players/?limit=20", headers={"Accept-Encoding": "gzip"})
+    assert small.headers["Content-Encoding"] == "gzip"
+    assert compressed_off_loop == []
+    large = client.get("/v0/performances/?limit=1000", headers={"Accept-Encoding": "gzip"})
+    assert large.headers["Content-Encoding"] == "gzip"
+    assert len(compressed_off_loop) == 1
+    assert compressed_off_loop[0] >= compression.THREAD_SIZE
+
+
+@needs_gzip
+def test_export_compressed():
+    response = client.get("/v0/performances/export", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert len(response.text.splitlines()) == 1100
+
+
+# test the snapshot startup
+def test_lifespan_loads_snapshot_off_the_main_thread(monkeypatch):
+    """Tests the app starts with the snapshot turned on when TestClient runs
+    it in another thread, where signal handlers can't be added"""
+    monkeypatch.setattr(main, "USE_SNAPSHOT", True)
+    with TestClient(app):
+        pass
+
+
+# test the Prometheus metrics
+def test_read_metrics():
+    client.get("/v0/players/?limit=3&skip=2")
+    client.get("/v0/players/999999")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'swc_http_requests_total{method="GET",operation_id="v0_get_players",status="200"}' in text
+    assert 'swc_http_requests_total{method="GET",operation_id="v0_get_players_by_player_id",status="404"}' in text
+    assert 'swc_http_request_duration_seconds_bucket{le="+Inf",operation_id="v0_get_players"}' in text
+    assert 'swc_http_response_size_bytes_count{operation_id="v0_get_players"}' in text
+    assert "swc_http_requests_in_flight 1.0" in text
+    assert 'swc_db_statements_total{operation_id="v0_get_players"}' in text
+
+
+def test_metrics_add_up_across_workers(tmp_path):
+    """Tests /metrics reports the totals of every worker sharing the metrics directory"""
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path))
+    record = "import metrics; metrics.requests_total.labels('v0_get_counts', 'GET', '200').inc()"
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", record], env=env, check=True)
+    rendered = subprocess.run(
+        [sys.executable, "-c", "import metrics, sys; sys.stdout.write(metrics.render().decode())"],
+        env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    assert 'swc_http_requests_total{method="GET",operation_id="v0_get_counts",status="200"} 2.0' in rendered
+
+
+# test conditional requests
+def test_read_players_not_modified():
+    response = client.get("/v0/players/?limit=10")
+    etag = response.headers["ETag"]
+    not_modified = client.get("/v0/players/?limit=10", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.headers["ETag"] == etag
+    assert not_modified.headers["X-SQL-Statement-Count"] == "0"
+
+
+def test_not_modified_needs_a_valid_request():
+    headers = {"If-None-Match": "*"}
+    assert client.get("/v0/players/99999", headers=headers).status_code == 404
+    assert client.get("/v0/leagues/1", headers=headers).status_code == 404
+    assert client.get("/v0/players/?cursor=not-a-cursor", headers=headers).status_code == 400
+    assert client.get("/v0/players/102", headers=headers).status_code == 304
+
+
+def test_etag_depends_on_query_parameters():
+    first_page = client.get("/v0/performances/?limit=10")
+    second_page = client.get(
+        "/v0/performances/?limit=10&skip=10",
+        headers={"If-None-Match": first_page.headers["ETag"]},
+    )
+    assert second_page.status_code == 200
+    assert second_page.headers["ETag"] != first_page.headers["ETag"]
+
+
+def test_read_league_if_modified_since():
+    response = client.get("/v0/leagues/5002")
+    last_modified = response.headers["Last-Modified"]
+    not_modified = client.get("/v0/leagues/5002", headers={"If-Modified-Since": last_modified})
+    assert not_modified.status_code == 304
+    modified = client.get("/v0/leagues/5002", headers={"If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT"})
+    assert modified.status_code == 200
+    assert len(modified.json()["teams"]) == 8
+
+
+# test that the fast list encoding sends the same bytes as the response models
+@pytest.mark.parametrize("crud_function, schema", [
+    (crud.get_players, schemas.Player),
+    (crud.get_performances, schemas.Performance),
+    (crud.get_leagues, schemas.League),
+    (crud.get_teams, schemas.Team),
+])
+def test_fast_serialization_matches_response_model(crud_function, schema):
+    db = SessionLocal()
+    try:
+        rows = crud_function(db, limit=200)
+        expected = JSONResponse(jsonable_encoder([schema.model_validate(row) for row in rows])).body
+        assert serialization.render_rows(rows, schema) == expected
+    finally:
+        db.close()
@@ -6,6 +6,31 @@ from .schemas import League, Team, Player, Performance
 from typing import List
 import backoff
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def accepted_encodings() -> str:
+    """Returns the Accept-Encoding header for the encodings the SDK can decode.
+
+    httpx decodes gzip on its own, brotli when the brotli package is
+    installed, and zstd when the zstandard package is installed. Install
+    the SDK with the compression extra to get both."""
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return ", ".join(encodings)
+
 
 class SWCClient:
     """Interacts with the Sports World Central API.
@@ -28,6 +53,9 @@ class SWCClient:
     LIST_TEAMS_ENDPOINT = "/v0/teams/"
     GET_COUNTS_ENDPOINT = "/v0/counts/"
 
+    # Most player IDs the API accepts in one call to v0/players
+    MAX_PLAYER_IDS = 500
+
     BULK_FILE_BASE_URL = (
         "https://raw.githubusercontent.com/ryandaydev"
         + "/portfolio-project/main/chapter7/sdk/bulk/"
@@ -43,6 +71,7 @@ class SWCClient:
         self.backoff = input_config.swc_backoff
         self.backoff_max_time = input_config.swc_backoff_max_time
         self.bulk_file_format = input_config.swc_bulk_file_format
+        self.accept_encoding = accepted_encodings()
 
         self.BULK_FILE_NAMES = {
         "players": "player_data",
@@ -67,9 +96,15 @@ class SWCClient:
 
 
     def get_url(self, url: str) -> httpx.Response:
-        """Makes API call and logs errors."""
+        """Makes API call and logs errors.
+
+        Asks for a compressed response in every encoding the SDK can
+        decode. The response content is already decoded when it is returned."""
         try:
-            with httpx.Client(base_url=self.swc_base_url) as client:
+            with httpx.Client(
+                base_url=self.swc_base_url,
+                headers={"Accept-Encoding": self.accept_encoding},
+            ) as client:
                 response = client.get(url)
                 self.logger.debug(response.json())
                 return response
@@ -245,6 +280,30 @@ class SWCClient:
         responsePlayer = Player(**response.json())
         return responsePlayer
 
+    def get_players_by_ids(self, player_ids: List[int]) -> List[Player]:
+        """Returns the Players matching a list of SWC Player IDs.
+
+        Calls the API v0/players endpoint with the ids parameter, which
+        looks up many players in one call instead of one call per player.
+        Long lists are sent in batches of MAX_PLAYER_IDS. IDs that don't
+        match a player are left out.
+
+        Returns:
+        A List of schemas.Player objects in Player ID order.
+
+        """
+        self.logger.debug("Entered get players by IDs")
+
+        unique_ids = sorted(set(player_ids))
+        players = []
+        for start in range(0, len(unique_ids), self.MAX_PLAYER_IDS):
+            batch = unique_ids[start : start + self.MAX_PLAYER_IDS]
+            params = {"ids": ",".join(str(player_id) for player_id in batch)}
+            endpoint_url = self.build_url(self.LIST_PLAYERS_ENDPOINT, params)
+            response = self.get_url(endpoint_url)
+            players.extend(Player(**player) for player in response.json())
+        return players
+
     def list_performances(
         self, skip: int = 0, limit: int = 100, minimum_last_changed_date: str = None
     ):
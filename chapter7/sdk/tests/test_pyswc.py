@@ -134,6 +134,26 @@ def test_get_player_by_id():
     assert isinstance(player_response, Player)
     assert player_response.first_name == "Bryce"       
 
+
+def test_get_players_by_ids():
+    """Tests get players by a list of IDs from SDK"""
+
+    players_response = client.get_players_by_ids([109, 102, 650, 102])
+
+    assert isinstance(players_response, list)
+    for player in players_response:
+        assert isinstance(player, Player)
+    assert [player.player_id for player in players_response] == [102, 109, 650]
+    assert players_response[0].first_name == "Bryce"
+
+def test_get_url_compressed():
+    """Tests the SDK asks for a compressed response and decodes it"""
+
+    response = client.get_url("/v0/performances/?limit=500")
+
+    assert response.headers["content-encoding"] == client.accept_encoding.split(", ")[0]
+    assert len(response.json()) == 500
+
 #scoring endpoints
 def test_list_performances():
     """Tests get peformances from SDK"""